@@ -0,0 +1,211 @@
+import click
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import WingDataIngest
+import sys
+
+''' ########### CONSTANTS: Compiled Dataset Layout ########### '''
+
+# Bump when the layout of the compiled dataset changes so that stale datasets are compiled again.
+COMPILED_FORMAT_VERSION = 1
+
+# Dimensions of the compiled dataset: (code column, label columns). The code column of the wing survey
+# dataset is stored as is when each code has a single label. Otherwise, e.g. when a code is blank, the
+# labels are numbered in order of first appearance.
+DIMENSIONS = {
+    'species': ('AOU_number', ['species_aou', 'species_name']),
+    'season': ('Season', []),
+    'flyway': ('flyway_code', ['flyway_name']),
+    'state': ('state_code', ['state'])
+}
+
+# Rows aggregated at a time, bounding the memory of the bin keys.
+AGGREGATE_CHUNK_ROWS = 10000000
+
+META_FILENAME = 'meta.json'
+
+
+''' ########### FUNCTIONS: Compiling the Wing Survey Dataset ########### '''
+
+def get_compiled_path(filename):
+    ''' Returns the path of the compiled dataset directory kept next to the CSV dataset. '''
+    return os.path.splitext(filename)[0] + '.compiled'
+
+def get_compiled_fingerprint(filename):
+    ''' Fingerprint of the CSV dataset the compiled dataset is built from. '''
+    fingerprint = WingDataIngest.get_source_fingerprint(filename)
+    fingerprint['version'] = COMPILED_FORMAT_VERSION
+    return fingerprint
+
+def is_compiled_valid(filename, compiled_path):
+    ''' Checks that the compiled dataset exists and was built from the current version of the CSV dataset. '''
+    try:
+        with open(os.path.join(compiled_path, META_FILENAME)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get('source') == get_compiled_fingerprint(filename)
+
+def encode_dimension(df, code_colname, label_colnames):
+    '''
+    Encodes a dimension of the dataset as integer codes.
+
+    returns (codes array, lookup DataFrame with the stored "code", the code column and the label columns,
+            in order of first appearance).
+    '''
+    colnames = [code_colname] + label_colnames
+    lookup = df[colnames].drop_duplicates()
+    if (df[code_colname].notnull().all() and not lookup[code_colname].duplicated().any()):
+        codes = df[code_colname].to_numpy(dtype=np.int64)
+        lookup.insert(0, 'code', lookup[code_colname].to_numpy(dtype=np.int64))
+    else:
+        codes = df.groupby(colnames, observed=True, dropna=False, sort=False).ngroup().to_numpy(dtype=np.int64)
+        lookup.insert(0, 'code', np.arange(len(lookup)))
+    return (codes.astype(np.min_scalar_type(int(codes.max()))), lookup.reset_index(drop=True))
+
+def save_lookup(compiled_path, dimension, lookup):
+    ''' Saves the lookup table of a dimension as one NumPy file per column. Blank text labels are saved as "". '''
+    for colname in lookup.columns:
+        values = lookup[colname]
+        if pd.api.types.is_numeric_dtype(values):
+            values = values.to_numpy(dtype=np.int64 if values.notnull().all() else np.float64)
+        else:
+            values = values.astype(object).where(values.notnull(), '').astype(str).to_numpy(dtype=str)
+        np.save(os.path.join(compiled_path, dimension+'.'+colname+'.npy'), values)
+
+def compile_wing_data(filename, compiled_path):
+    '''
+    Compiles the wing survey dataset into integer coded, memory-mappable NumPy arrays.
+
+    Each dimension is stored as an integer code per row (<dimension>.npy) with a lookup table of its labels
+    (<dimension>.<column>.npy), next to the harvest_weight array. No text is stored per row.
+    '''
+    print_info('Compiling dataset '+filename+' into ['+compiled_path+']. This is done once per dataset version.')
+    colnames = list(dict.fromkeys(WingDataIngest.WING_DATA_COLUMNS + [code for code, labels in DIMENSIONS.values()]))
+    df = WingDataIngest.load_wing_data(filename, colnames)
+    missing = [code for code, labels in DIMENSIONS.values() if code not in df.columns]
+    if (len(missing) > 0):
+        print_fatal_exit('Dataset '+filename+' is missing the column(s) '+str(missing)+' needed by the compiled dataset.')
+
+    tmp_path = compiled_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for dimension, (code_colname, label_colnames) in DIMENSIONS.items():
+        codes, lookup = encode_dimension(df, code_colname, label_colnames)
+        np.save(os.path.join(tmp_path, dimension+'.npy'), codes)
+        save_lookup(tmp_path, dimension, lookup)
+    np.save(os.path.join(tmp_path, 'harvest_weight.npy'), df['harvest_weight'].fillna(0).to_numpy(dtype=np.float64))
+    with open(os.path.join(tmp_path, META_FILENAME), 'w') as f:
+        json.dump({'source': get_compiled_fingerprint(filename), 'rows': len(df)}, f)
+
+    shutil.rmtree(compiled_path, ignore_errors=True)
+    os.replace(tmp_path, compiled_path)
+    print_info('Compiled dataset created with '+str(len(df))+' rows.')
+
+
+''' ########### FUNCTIONS: Reading the Compiled Dataset ########### '''
+
+def open_compiled(compiled_path):
+    '''
+    Maps the arrays of a compiled dataset read-only. Processes mapping the same dataset share its pages.
+
+    returns Dictionary with the "arrays" of each dimension and of harvest_weight, the "lookups" DataFrame
+            of each dimension and the number of "rows".
+    '''
+    with open(os.path.join(compiled_path, META_FILENAME)) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(compiled_path, name+'.npy'), mmap_mode='r') for name in list(DIMENSIONS) + ['harvest_weight']}
+    lookups = {}
+    for dimension, (code_colname, label_colnames) in DIMENSIONS.items():
+        lookup = pd.DataFrame()
+        for colname in ['code', code_colname] + label_colnames:
+            values = np.load(os.path.join(compiled_path, dimension+'.'+colname+'.npy'))
+            if values.dtype.kind == 'U':
+                values = pd.Series(values, dtype=object)
+                values = values.where(values != '', np.nan)
+            lookup[colname] = values
+        lookups[dimension] = lookup
+    return {'arrays': arrays, 'lookups': lookups, 'rows': meta['rows']}
+
+def get_code_positions(lookup):
+    ''' Array mapping each code of a dimension to its row in the lookup table, -1 for unknown codes. '''
+    codes = lookup['code'].to_numpy()
+    positions = np.full(int(codes.max()) + 1 if len(codes) > 0 else 1, -1, dtype=np.int64)
+    positions[codes] = np.arange(len(codes))
+    return positions
+
+def aggregate_harvest_weights(compiled, seasons=None):
+    '''
+    Sums harvest_weight per (species, season, flyway, state) with np.bincount over the mapped arrays.
+
+    parameter seasons: (first, last) season range, or None for every season.
+    returns (weights, counts) arrays shaped by the lookup tables of the dimensions, in the order of DIMENSIONS.
+    '''
+    arrays = compiled['arrays']
+    positions = {dimension: get_code_positions(lookup) for dimension, lookup in compiled['lookups'].items()}
+    shape = tuple(len(compiled['lookups'][dimension]) for dimension in DIMENSIONS)
+    weights = np.zeros(int(np.prod(shape)), dtype=np.float64)
+    counts = np.zeros(len(weights), dtype=np.int64)
+
+    for start in range(0, compiled['rows'], AGGREGATE_CHUNK_ROWS):
+        stop = min(start + AGGREGATE_CHUNK_ROWS, compiled['rows'])
+        keys = np.zeros(stop - start, dtype=np.int64)
+        for dimension, size in zip(DIMENSIONS, shape):
+            keys = keys * size + positions[dimension][arrays[dimension][start:stop]]
+        chunk_weights = arrays['harvest_weight'][start:stop]
+        if seasons is not None:
+            season_codes = arrays['season'][start:stop]
+            in_range = (season_codes >= seasons[0]) & (season_codes <= seasons[1])
+            keys = keys[in_range]
+            chunk_weights = chunk_weights[in_range]
+        weights += np.bincount(keys, weights=chunk_weights, minlength=len(weights))
+        counts += np.bincount(keys, minlength=len(weights))
+    return (weights.reshape(shape), counts.reshape(shape))
+
+def read_harvest_sums(filename, seasons=None):
+    '''
+    Reads the harvest sums of the wing survey dataset from its compiled dataset, compiling it when stale.
+
+    parameter seasons: (first, last) season range, or None for all seasons.
+    returns DataFrame with the same columns and types as WingDataIngest.stream_wing_data_sums. Species come in
+            order of first appearance in the dataset, as in the dataset itself.
+    '''
+    compiled_path = get_compiled_path(filename)
+    if not is_compiled_valid(filename, compiled_path):
+        compile_wing_data(filename, compiled_path)
+    print_info('Reading dataset from compiled arrays ['+compiled_path+'].')
+    compiled = open_compiled(compiled_path)
+
+    weights, counts = aggregate_harvest_weights(compiled, seasons)
+    cells = np.nonzero(counts)
+    df = pd.DataFrame()
+    for dimension, positions in zip(DIMENSIONS, cells):
+        code_colname, label_colnames = DIMENSIONS[dimension]
+        lookup = compiled['lookups'][dimension]
+        for colname in [code_colname] + label_colnames:
+            df[colname] = lookup[colname].to_numpy()[positions]
+    df['harvest_weight'] = weights[cells]
+    df = df[[c for c in WingDataIngest.WING_DATA_SUM_KEYS if c in df.columns] + ['harvest_weight']]
+
+    for colname in df.columns:
+        if colname in WingDataIngest.WING_DATA_DTYPES:
+            df[colname] = df[colname].astype(WingDataIngest.WING_DATA_DTYPES[colname])
+    print_info('Aggregated '+str(compiled['rows'])+' compiled rows into '+str(len(df))+' harvest sums.')
+    return df
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
+
+def print_fatal_exit(output_str):
+    click.echo("[FATAL] " + str(output_str))
+    click.echo("[FATAL] Exiting now...")
+    sys.exit()
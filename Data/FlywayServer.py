@@ -0,0 +1,282 @@
+import click
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import FlywayQuery
+import sys
+
+''' ########### CONSTANTS: Query Parameters ########### '''
+
+# Flyway codes accepted by the harvest queries, mapped to the flyway names of the wing survey dataset.
+HARVEST_FLYWAY_CODES = {
+    'AF': 'Atlantic Flyway',
+    'MF': 'Mississippi Flyway',
+    'CF': 'Central Flyway',
+    'PF': 'Pacific Flyway',
+    'AK': 'Alaska'
+}
+
+ALLOWED_METRICS = ['active_hunters', 'bag_per_hunter', 'days_hunted']
+
+# Species parameters of the harvest queries and the dataset column of each. "species" is short for "species_aou".
+HARVEST_SPECIES_PARAMS = [('species_name', 'species_name'), ('species_aou', 'species_aou'), ('species', 'species_aou')]
+
+
+''' ########### FUNCTIONS: Response Cache ########### '''
+
+class ResponseCache:
+    '''
+    Cache of serialized responses with time-to-live and least recently used eviction.
+
+    Entries older than the time-to-live are recalculated, so a dataset updated while the service runs is
+    picked up after at most ttl seconds. The cache is shared by the request threads.
+    '''
+
+    def __init__(self, max_entries=512, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        ''' Returns the cached response, or None when it is missing or expired. '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, response):
+        ''' Caches a response, evicting the least recently used responses over max_entries. '''
+        with self._lock:
+            self._entries[key] = (time.monotonic(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+''' ########### FUNCTIONS: Query Handling ########### '''
+
+def get_param(params, name, default=None, required=False):
+    ''' Returns the value of a query string parameter. Raises ValueError when a required parameter is missing. '''
+    values = params.get(name)
+    if not values or values[0] == '':
+        if required:
+            raise ValueError('Missing query parameter ['+name+'].')
+        return default
+    return values[0]
+
+def get_seasons_param(params):
+    ''' Returns the (from, to) season range of the query, or None for every season. '''
+    season_from = get_param(params, 'from')
+    season_to = get_param(params, 'to')
+    if season_from is None and season_to is None:
+        return None
+    if season_from is None or season_to is None:
+        raise ValueError('Query parameters [from] and [to] must be used together.')
+    if not (season_from.isdigit() and season_to.isdigit()):
+        raise ValueError('Query parameters [from] and [to] must be years, e.g. from=1999&to=2022.')
+    if int(season_from) > int(season_to):
+        raise ValueError('Query parameter [from] must not be after [to].')
+    return (int(season_from), int(season_to))
+
+def get_period_width_param(params):
+    ''' Returns the time period width of the query, 5 years by default. '''
+    period_width = get_param(params, 'period_width', '5')
+    if not period_width.isdigit() or int(period_width) < 1:
+        raise ValueError('Query parameter [period_width] must be a positive number of years.')
+    return int(period_width)
+
+def get_harvest_flyway_param(params):
+    ''' Returns the flyway name of a harvest query, from its flyway code or name. Raises ValueError for unknown flyways. '''
+    flyway = get_param(params, 'flyway', 'AF')
+    if flyway in HARVEST_FLYWAY_CODES.values():
+        return flyway
+    if flyway.upper() not in HARVEST_FLYWAY_CODES:
+        raise ValueError('Query parameter [flyway] must be one of '+str(list(HARVEST_FLYWAY_CODES))+'.')
+    return HARVEST_FLYWAY_CODES[flyway.upper()]
+
+def get_harvest_species_param(params):
+    ''' Returns the (species column, species list) of a harvest query. Raises ValueError when no species is given. '''
+    for name, species_colname in HARVEST_SPECIES_PARAMS:
+        species = get_param(params, name)
+        if species is not None:
+            return (species_colname, species.split('|'))
+    raise ValueError('Missing query parameter [species], [species_aou] or [species_name].')
+
+def select_flyway_columns(df, flyway_states, flyway):
+    ''' Keeps the season, the state columns of the flyway and the flyway and US totals of a harvest table. '''
+    return df[[c for c in df.columns if c == 'Season' or c in flyway_states or c in (flyway, 'US')]]
+
+def tables_to_json(query, table_df, averages_df):
+    ''' Serializes the estimates and time period averages of a table query. '''
+    return ('{"query": '+json.dumps(query)+', "estimates": '+table_df.to_json(orient='records')+
+            ', "averages": '+averages_df.to_json(orient='records')+'}').encode('utf-8')
+
+def query_harvest(datasets, params):
+    '''
+    Answers /harvest?flyway=AF&species=MALL&from=1999&to=2022. Species joined by "|" are summed as a group.
+
+    The species are given with species (AOU codes), species_aou or species_name. The tables hold the states of
+    the flyway and the flyway and US totals.
+    '''
+    if datasets.get('harvest') is None:
+        raise LookupError('No harvest dataset is loaded in this service.')
+    flyway = get_harvest_flyway_param(params)
+    species_colname, species = get_harvest_species_param(params)
+    seasons = get_seasons_param(params)
+    period_width = get_period_width_param(params)
+    table_df, averages_df = FlywayQuery.get_harvest_table(datasets['harvest'], flyway, species[0] if len(species) == 1 else species,
+                                                          seasons, species_colname, period_width)
+    flyway_states = FlywayQuery.get_flyway_states(datasets['harvest'], flyway)
+    table_df = select_flyway_columns(table_df, flyway_states, flyway)
+    averages_df = select_flyway_columns(averages_df, flyway_states, flyway)
+    query = {'flyway': flyway, species_colname: species, 'seasons': seasons, 'period_width': period_width}
+    return tables_to_json(query, table_df, averages_df)
+
+def query_hunter(datasets, params):
+    ''' Answers /hunter?flyway=AF&group=ducks&metric=active_hunters&from=1999&to=2022. Add variance=true for the Var and CI columns. '''
+    if datasets.get('hunter') is None:
+        raise LookupError('No hunter dataset is loaded in this service.')
+    flyway = get_param(params, 'flyway', 'AF')
+    group = get_param(params, 'group', required=True)
+    metric = get_param(params, 'metric', 'active_hunters')
+    if metric not in ALLOWED_METRICS:
+        raise ValueError('Query parameter [metric] must be one of '+str(ALLOWED_METRICS)+'.')
+    seasons = get_seasons_param(params)
+    period_width = get_period_width_param(params)
+    include_variance = get_param(params, 'variance', 'false').lower() in ('1', 'true', 'yes')
+    table_df, averages_df = FlywayQuery.get_hunter_table(datasets['hunter'], flyway, group, metric, seasons, period_width,
+                                                         include_variance)
+    query = {'flyway': flyway, 'group': group, 'metric': metric, 'seasons': seasons, 'period_width': period_width,
+             'variance': include_variance}
+    return tables_to_json(query, table_df, averages_df)
+
+QUERY_HANDLERS = {
+    '/harvest': query_harvest,
+    '/hunter': query_hunter
+}
+
+
+''' ########### FUNCTIONS: HTTP Service ########### '''
+
+class FlywayRequestHandler(BaseHTTPRequestHandler):
+    ''' Answers the GET queries of the service from the response cache or from the memoized table queries. '''
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        handler = QUERY_HANDLERS.get(url.path.rstrip('/'))
+        if handler is None:
+            self.send_json(404, {'error': 'Unknown query ['+url.path+']. Available queries are '+str(list(QUERY_HANDLERS))+'.'})
+            return
+        params = parse_qs(url.query)
+        cache_key = (url.path.rstrip('/'), tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        response = self.server.response_cache.get(cache_key)
+        if response is not None:
+            self.send_body(200, response, 'HIT')
+            return
+        try:
+            response = handler(self.server.datasets, params)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except LookupError as e:
+            self.send_json(404, {'error': str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': 'Unable to answer query: '+str(e)})
+            return
+        self.server.response_cache.put(cache_key, response)
+        self.send_body(200, response, 'MISS')
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload).encode('utf-8'), 'MISS')
+
+    def send_body(self, status, body, cache_status):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Cache', cache_status)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print_info(self.address_string()+' '+(format % args))
+
+class FlywayHTTPServer(ThreadingHTTPServer):
+    ''' HTTP server answering each request on its own thread, with a listen backlog sized for dashboard bursts. '''
+    daemon_threads = True
+    request_queue_size = 128
+
+def create_server(host, port, datasets, cache_size=512, cache_ttl=300):
+    '''
+    Creates the query service. Each request is answered on its own thread.
+
+    parameter datasets: Dictionary with the paths of the "harvest" and "hunter" datasets, either may be None.
+    '''
+    server = FlywayHTTPServer((host, port), FlywayRequestHandler)
+    server.datasets = datasets
+    server.response_cache = ResponseCache(cache_size, cache_ttl)
+    return server
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
+
+def print_fatal_exit(output_str):
+    click.echo("[FATAL] " + str(output_str))
+    click.echo("[FATAL] Exiting now...")
+    sys.exit()
+
+
+''' ########### MAIN FUNCTION ########### '''
+
+@click.command()
+@click.option('--harvest', default=None, type=click.Path(exists=True, dir_okay=False), help='Wing survey CSV dataset, SQLite \
+              repository or harvest aggregate store answering the /harvest queries.')
+@click.option('--hunter', default=None, type=click.Path(exists=True, dir_okay=False), help='Harvest estimates CSV dataset, SQLite \
+              repository or hunter aggregate store answering the /hunter queries.')
+@click.option('--host', default='127.0.0.1', help='Address the service listens on. Default is 127.0.0.1.')
+@click.option('--port', default=8050, type=click.IntRange(min=0, max=65535), help='Port the service listens on. Default is 8050.')
+@click.option('--cache_size', default=512, type=click.IntRange(min=1), help='Number of responses kept in the response cache. \
+              Default is 512.')
+@click.option('--cache_ttl', default=300, type=click.IntRange(min=0), help='Seconds a cached response is served before it is \
+              recalculated. Default is 300.')
+def main(harvest, hunter, host, port, cache_size, cache_ttl):
+
+    print_info("###### Welcome to the Flyway Query Service #######")
+    if (harvest is None and hunter is None):
+        print_fatal_exit('No dataset to serve. Use --harvest and/or --hunter. Please refer to --help for more information.')
+
+    # The datasets are loaded once and stay in memory while the service runs.
+    if (harvest is not None):
+        FlywayQuery.load_harvest_dataset(harvest)
+    if (hunter is not None):
+        FlywayQuery.load_hunter_dataset(hunter)
+
+    server = create_server(host, port, {'harvest': harvest, 'hunter': hunter}, cache_size, cache_ttl)
+    print_info('Serving /harvest and /hunter queries on http://'+host+':'+str(server.server_address[1])+'. Press Ctrl+C to stop.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print_info('Query service stopped.')
+
+
+if __name__ == '__main__':
+    ''' Program entry point '''
+    main()
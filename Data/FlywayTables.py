@@ -1,154 +1,392 @@
+from functools import partial
+import math
+import numbers
 from openpyxl import Workbook
-from openpyxl.styles import Border, Side
 from openpyxl.styles import Border, Side, Alignment, Font
 from openpyxl.styles import NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.worksheet.cell_range import CellRange
 import pandas as pd
 from pandas import DataFrame
+import PipelineMetrics
 import sys
 
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
 
-def create_table_to_ws(workbook: Workbook, 
-                 estimate_data_df: DataFrame, average_data_df: DataFrame, 
+
+''' ########### Table Styles ########### '''
+
+# Number formats of the data columns, by pandas dtype kind.
+INTEGER_NUMBER_FORMAT = '#,##0'
+DECIMAL_NUMBER_FORMAT = '#,##0.0'
+
+# Prefix of the named styles registered in the workbook.
+TABLE_STYLE_PREFIX = 'Flyway Table '
+
+TABLE_BORDER_SIDE = Side(border_style='medium', color="FF000000")
+
+# XlsxWriter index and color of the same medium black border.
+XLSXWRITER_BORDER_STYLE = 2
+XLSXWRITER_BORDER_COLOR = '#000000'
+
+# Excel writer engines of write_tables_to_workbook.
+EXCEL_ENGINES = ['openpyxl', 'xlsxwriter']
+
+# Longest sheet name accepted by Excel.
+MAX_SHEET_NAME_LENGTH = 31
+
+
+def create_table_to_ws(workbook: Workbook,
+                 estimate_data_df: DataFrame, average_data_df: DataFrame,
+                 asterisk_text_list,
+                 table_title: str,
+                 sheet_name: str,
+                 summary_sections=None):
+    '''
+    Writes a table to a new sheet of the workbook.
+
+    parameter summary_sections: Optional list of (section title, DataFrame) written after the 'Averages'
+                                section, such as moving averages and the long-term average.
+    '''
+
+    sheet_name = sheet_name.replace('/',' ')
+    record = PipelineMetrics.start_stage('excel_sheet', sheet_name, rows_in=len(estimate_data_df))
+    ws1 = workbook.create_sheet(sheet_name)
+
+    table_rows, table_width, table_height = _layout_table_rows(partial(_register_table_style, workbook), estimate_data_df,
+                                                               average_data_df, asterisk_text_list, table_title, summary_sections)
+
+    for row_idx, (values, styles, is_merged) in enumerate(table_rows, start=1):
+        ws1.append(values)
+        for col_idx, style in enumerate(styles, start=1):
+            if style is not None:
+                ws1.cell(row=row_idx, column=col_idx).style = style
+        if is_merged:
+            ws1.merge_cells(start_row=row_idx, start_column=1, end_row=row_idx, end_column=table_width)
+
+    PipelineMetrics.end_stage(record, rows_out=len(table_rows))
+
+
+def create_table_to_write_only_ws(workbook: Workbook,
+                 estimate_data_df: DataFrame, average_data_df: DataFrame,
                  asterisk_text_list,
                  table_title: str,
-                 sheet_name: str): 
-    
+                 sheet_name: str,
+                 summary_sections=None):
+    '''
+    Writes the same table as create_table_to_ws to a sheet of a write-only workbook.
+
+    Rows are streamed to the sheet as they are appended, so the cell styles, borders and merged
+    ranges are decided before each row is written instead of being applied to the sheet afterwards.
+    '''
+
     sheet_name = sheet_name.replace('/',' ')
-    print_info('Begin creating table for table [' + str(table_title) + '] on sheet ' + sheet_name)
+    record = PipelineMetrics.start_stage('excel_sheet', sheet_name, rows_in=len(estimate_data_df))
     ws1 = workbook.create_sheet(sheet_name)
-    
-    #track starting row for the table in sheet
-    table_start = 0
 
-    #track the starting row for the table average section in sheet
-    table_avg_start = 0
+    table_rows, table_width, table_height = _layout_table_rows(partial(_register_table_style, workbook), estimate_data_df,
+                                                               average_data_df, asterisk_text_list, table_title, summary_sections)
 
-    #track the table height
-    table_height = 0
+    for row_idx, (values, styles, is_merged) in enumerate(table_rows, start=1):
+        cells = []
+        for value, style in zip(values, styles):
+            cell = WriteOnlyCell(ws1, value=value)
+            if style is not None:
+                cell.style = style
+            cells.append(cell)
+        ws1.append(cells)
+        if is_merged:
+            ws1.merged_cells.add(CellRange(min_row=row_idx, min_col=1, max_row=row_idx, max_col=table_width))
 
-    #track the table header
+    PipelineMetrics.end_stage(record, rows_out=len(table_rows))
+
+
+def create_table_to_xlsxwriter_ws(workbook,
+                 estimate_data_df: DataFrame, average_data_df: DataFrame,
+                 asterisk_text_list,
+                 table_title: str,
+                 sheet_name: str,
+                 summary_sections=None,
+                 formats=None):
+    '''
+    Writes the same table as create_table_to_ws to a new sheet of an XlsxWriter workbook.
+
+    The workbook is opened in constant memory mode, so each row is flushed to the file once the next row
+    is written.
+
+    parameter formats: Dictionary of the cell formats of the workbook by (role, edges), shared by its tables.
+    '''
+
+    sheet_name = sheet_name.replace('/',' ')
+    record = PipelineMetrics.start_stage('excel_sheet', sheet_name, rows_in=len(estimate_data_df))
+    ws1 = workbook.add_worksheet(sheet_name)
+
+    if formats is None:
+        formats = {}
+    table_rows, table_width, table_height = _layout_table_rows(partial(_register_xlsxwriter_format, workbook, formats),
+                                                               estimate_data_df, average_data_df, asterisk_text_list,
+                                                               table_title, summary_sections)
+
+    # XlsxWriter rows and columns are 0-based.
+    for row_idx, (values, styles, is_merged) in enumerate(table_rows):
+        if is_merged:
+            ws1.merge_range(row_idx, 0, row_idx, table_width - 1, values[0], styles[0])
+            continue
+        for col_idx, (value, style) in enumerate(zip(values, styles)):
+            _write_xlsxwriter_cell(ws1, row_idx, col_idx, value, style)
+
+    PipelineMetrics.end_stage(record, rows_out=len(table_rows))
+
+
+def write_tables_to_workbook(workbook_name, table_list, write_only=False, excel_engine='openpyxl'):
+    '''
+    Builds every table sheet of a workbook and saves the workbook once.
+
+    parameter workbook_name: File name of the Excel workbook.
+    parameter table_list: List of (estimate_data_df, average_data_df, asterisk_text_list, table_title, sheet_name),
+                          optionally followed by the summary_sections of the table. Sheet names follow get_sheet_name.
+    parameter write_only: Use the openpyxl write-only mode, which streams rows to the file in near-constant memory.
+                          The xlsxwriter engine always streams its rows.
+    parameter excel_engine: Writer of the workbook, one of EXCEL_ENGINES. Both write the same tables and styles,
+                            except that xlsxwriter sets the default font size of 11 explicitly.
+    '''
+    if (excel_engine == 'openpyxl'):
+        _write_tables_with_openpyxl(workbook_name, table_list, write_only)
+    elif (excel_engine == 'xlsxwriter'):
+        _write_tables_with_xlsxwriter(workbook_name, table_list)
+    else:
+        print_fatal_exit('Invalid Excel engine ['+str(excel_engine)+']. Options are '+str(EXCEL_ENGINES)+'.')
+    print_info('Completed Excel workbook file ['+workbook_name+']')
+
+
+def get_sheet_name(sheet_name, used_names):
+    '''
+    Sheet name of a table, the same with every Excel engine.
+
+    "/" is replaced and names are shortened to MAX_SHEET_NAME_LENGTH characters. A name already used in the
+    workbook, compared case-insensitively as by Excel, gets a numeric suffix, e.g. "Long group name 2".
+    parameter used_names: Set of the lowercase sheet names of the workbook, the returned name is added to it.
+    '''
+    sheet_name = sheet_name.replace('/',' ')[:MAX_SHEET_NAME_LENGTH]
+    unique_name = sheet_name
+    suffix = 1
+    while unique_name.lower() in used_names:
+        suffix += 1
+        unique_name = sheet_name[:MAX_SHEET_NAME_LENGTH - len(str(suffix)) - 1]+' '+str(suffix)
+    used_names.add(unique_name.lower())
+    return unique_name
+
+def _with_sheet_names(table_list):
+    ''' Tables of the workbook with their sheet names replaced by the names of get_sheet_name. '''
+    used_names = set()
+    return [tuple(table[:4]) + (get_sheet_name(table[4], used_names),) + tuple(table[5:]) for table in table_list]
+
+
+def _write_tables_with_openpyxl(workbook_name, table_list, write_only=False):
+    ''' Writes the table sheets with openpyxl, which holds the workbook in memory until it is saved unless write_only. '''
+    wb = Workbook(write_only=write_only)
+    if not write_only:
+        # Removing the default 'Sheet'
+        del wb['Sheet']
+
+    for table in _with_sheet_names(table_list):
+        if write_only:
+            create_table_to_write_only_ws(wb, *table)
+        else:
+            create_table_to_ws(wb, *table)
+
+    with PipelineMetrics.stage('excel_save', workbook_name, rows_in=len(table_list)):
+        wb.save(workbook_name)
+
+
+def _write_tables_with_xlsxwriter(workbook_name, table_list):
+    ''' Writes the table sheets with XlsxWriter in constant memory mode. '''
+    if xlsxwriter is None:
+        print_fatal_exit('Package XlsxWriter is not installed. It is required by --excel_engine xlsxwriter.')
+
+    # Text is written as is, never converted to formulas, links or numbers.
+    wb = xlsxwriter.Workbook(workbook_name, {'constant_memory': True, 'strings_to_formulas': False,
+                                             'strings_to_urls': False, 'strings_to_numbers': False})
+    formats = {}
+    for table in _with_sheet_names(table_list):
+        create_table_to_xlsxwriter_ws(wb, *table, formats=formats)
+
+    with PipelineMetrics.stage('excel_save', workbook_name, rows_in=len(table_list)):
+        wb.close()
+
+
+''' ########### FUNCTIONS: Table Layout and Styles ########### '''
+
+def _layout_table_rows(register_style, estimate_data_df, average_data_df, asterisk_text_list, table_title, summary_sections=None):
+    '''
+    Lays out a table as a list of (values, styles, is_merged) rows.
+
+    parameter register_style: Function of (role, edges) returning the style of the writer engine for the cells
+                              of a role with the given border edges, as _register_table_style.
+
+    The title row is followed by the header row, the estimate rows, the 'Averages' section, the
+    optional summary sections and the asterisk footnotes. The table from the header row to the last
+    section row is boxed with a medium border, as are the header row and each section. Number formats
+    are decided per column from the DataFrame dtypes and borders from the position of the cell in the
+    table, so no cell values are inspected.
+    '''
     table_headers = list(estimate_data_df.columns)
+    table_width = len(table_headers) + 1
+    sections = [('Averages', average_data_df)] + list(summary_sections or [])
+
+    # Table rows, 1-based. The title row is row 1.
+    header_row = 2
+    section_title_rows = []
+    last_row = header_row + len(estimate_data_df)
+    for section_title, section_df in sections:
+        section_title_rows.append(last_row + 1)
+        last_row += 1 + len(section_df)
+    table_height = last_row - header_row + 1
+
+    style_names = {}
+    def style(role, row_idx, col_idx):
+        edges = ''
+        if header_row <= row_idx <= last_row:
+            edges += 'L' if col_idx == 1 else ''
+            edges += 'R' if col_idx == table_width else ''
+            edges += 'T' if (row_idx == header_row or row_idx in section_title_rows) else ''
+            edges += 'B' if row_idx in (header_row, last_row) else ''
+        if (role, edges) not in style_names:
+            style_names[(role, edges)] = register_style(role, edges)
+        return style_names[(role, edges)]
+
+    def data_rows(df, first_row_idx):
+        # The first column holds the season or period labels, followed by a blank spacer column.
+        roles = ['Text'] + _get_column_roles(df)[1:] + ['Text']
+        rows = []
+        # Columns are converted one at a time so that each keeps its own type.
+        columns = [df.iloc[:, i].tolist() for i in range(len(df.columns))]
+        for row_idx, row in enumerate(zip(*columns), start=first_row_idx):
+            values = [str(row[0])] + list(row[1:]) + ['']
+            rows.append((values, [style(role, row_idx, col_idx) for col_idx, role in enumerate(roles, start=1)], False))
+        return rows
+
+    table_rows = []
+    table_rows.append(([table_title], [style('Title', 1, 1)], True))
+
+    header_roles = ['Header'] + ['Header Right'] * (table_width - 1)
+    table_rows.append((table_headers + [None], [style(role, header_row, col_idx) for col_idx, role in enumerate(header_roles, start=1)], False))
+    table_rows += data_rows(estimate_data_df, header_row + 1)
+
+    for (section_title, section_df), title_row in zip(sections, section_title_rows):
+        table_rows.append(([section_title] + [None] * (table_width - 1), [style('Text', title_row, col_idx) for col_idx in range(1, table_width + 1)], False))
+        table_rows += data_rows(section_df, title_row + 1)
 
-    #track the table width
-    estimate_data_df[' '] = ''
-    average_data_df[' '] = ''
-
-    table_width = len(list(estimate_data_df.columns))
-    estimate_data_df.iloc[:, 0] = estimate_data_df.iloc[:, 0].astype(str)
-    average_data_df.iloc[:, 0] = average_data_df.iloc[:, 0].astype(str)
-
-    #add column headings. NB. these must be strings
-    ws1.append([table_title])
-    table_start += 1
-    set_title_row_style(ws1[table_start])
-
-    #merge title row
-    ws1.merge_cells(start_row=1, start_column=1, end_row=1, end_column=table_width)
-    ws1.append(table_headers)
-    table_height += 1
-    table_start += 1
-
-    #setting font and alignment for table header
-    for idx, cell in enumerate(ws1[table_start]):
-        if (idx > 0):
-            cell.alignment = Alignment(horizontal='right')
-        cell.font = Font(bold=True)
-
-    #adding estimate data to ws
-    for row in estimate_data_df.to_numpy():
-        ws1.append(row.tolist())
-        set_data_row_style(ws1[table_start+table_height])
-        table_height += 1
-        
-
-
-    
-    
-    #Add 'Average' section title
-    ws1.append(['Averages'])
-    table_height += 1
-    table_avg_start = table_start+table_height
-
-    #Add 'Average' data section
-    for row in average_data_df.to_numpy():
-        ws1.append(row.tolist())
-        set_data_row_style(ws1[table_start+table_height])
-        table_height += 1
-        
-    
-
-    #set border for the entire table
-    set_border_rows(ws1[table_start:table_start+table_height-1])
-
-    #set border for header section
-    set_border_rows(ws1[table_start], True)
-
-    #set border for average section
-    set_border_rows(ws1[table_avg_start-1:table_start+table_height-1]) 
-
-    print_info('Table Created with Size='+str(table_width)+'x' + str(table_height))
-
-    asterisk_start_row = table_start+table_height
-    #setting the * section text
     for item in asterisk_text_list:
-        ws1.append([item])
-        ws1.merge_cells(start_row=asterisk_start_row, start_column=1, end_row=asterisk_start_row, end_column=table_width)
-        ws1.cell(asterisk_start_row, 1).font = Font(size=10)
-        asterisk_start_row += 1
-
-    print_info('Done creating Excel table for [' + table_title + '] on sheet ' + sheet_name)
-
-
-def _draw_border(row, pos_y, max_x, max_y):
-        side = Side(border_style='medium', color="FF000000")
-        for pos_x, cell in enumerate(row):
-            border = Border(
-                left=cell.border.left,
-                right=cell.border.right,
-                top=cell.border.top,
-                bottom=cell.border.bottom
-            )
-            if pos_x == 0:
-                border.left = side
-            if pos_x == max_x:
-                border.right = side
-            if pos_y == 0:
-                border.top = side
-            if pos_y == max_y:
-                border.bottom = side
-
-            # set new border only if it's one of the edge cells
-            if pos_x == 0 or pos_x == max_x or pos_y == 0 or pos_y == max_y:
-                cell.border = border
-
-def set_border_rows(rows, isOneRow=False):
-    
-    if (isOneRow):
-        _draw_border(rows, 0, len(rows)-1, 0)
-        return
-
-
-    rows = list(rows)  # we convert iterator to list for simplicity, but it's not memory efficient solution
-    max_y = len(rows) - 1  # index of the last row
-    
-    for pos_y, row in enumerate(rows):
-        max_x = len(row) - 1  # index of the last cell
-        _draw_border(row, pos_y, max_x, max_y)
-        
-    
-#set style on a single row
-def set_title_row_style(row):
-    for cell in row:
-        cell.font = Font(bold=True)
-
-def set_data_row_style(row):
-    for idx, cell in enumerate(row):
-        try:
-            if (idx > 0 and int(cell.value) > 0):
-                cell.number_format = '#,###'
-        except:
-            continue
-            
+        table_rows.append(([item], [style('Footnote', last_row + 1, 1)], True))
+
+    return (table_rows, table_width, table_height)
+
+
+def _get_column_roles(df):
+    ''' Style role of each DataFrame column, decided from the column dtypes. '''
+    roles = []
+    for i, dtype in enumerate(df.dtypes):
+        kind = getattr(dtype, 'kind', 'O')
+        if kind == 'O':
+            # Columns mixing labels and numbers are inferred once for the whole column.
+            inferred = pd.api.types.infer_dtype(df.iloc[:, i], skipna=True)
+            kind = {'integer': 'i', 'floating': 'f', 'mixed-integer-float': 'f'}.get(inferred, 'O')
+        if kind in 'iu':
+            roles.append('Integer')
+        elif kind == 'f':
+            roles.append('Decimal')
+        else:
+            roles.append('Text')
+    return roles
+
+
+def _register_table_style(workbook, role, edges):
+    '''
+    Registers the named style of a table cell role with the given border edges, once per workbook.
+
+    parameter role: One of Title, Header, Header Right, Text, Integer, Decimal or Footnote.
+    parameter edges: Medium border edges of the cell, any of 'L', 'R', 'T' and 'B'.
+    returns Name of the registered style, or None when the cell keeps the default style.
+    '''
+    if role == 'Text' and edges == '':
+        return None
+    name = TABLE_STYLE_PREFIX + role + ((' ' + edges) if edges else '')
+    if name in workbook.named_styles:
+        return name
+
+    table_style = NamedStyle(name=name, font=DEFAULT_FONT)
+    if role in ('Title', 'Header', 'Header Right'):
+        table_style.font = Font(bold=True)
+    if role == 'Header Right':
+        table_style.alignment = Alignment(horizontal='right')
+    if role == 'Footnote':
+        table_style.font = Font(size=10)
+    if role == 'Integer':
+        table_style.number_format = INTEGER_NUMBER_FORMAT
+    if role == 'Decimal':
+        table_style.number_format = DECIMAL_NUMBER_FORMAT
+    table_style.border = Border(left=TABLE_BORDER_SIDE if 'L' in edges else Side(),
+                                right=TABLE_BORDER_SIDE if 'R' in edges else Side(),
+                                top=TABLE_BORDER_SIDE if 'T' in edges else Side(),
+                                bottom=TABLE_BORDER_SIDE if 'B' in edges else Side())
+    workbook.add_named_style(table_style)
+    return name
+
+
+def _register_xlsxwriter_format(workbook, formats, role, edges):
+    '''
+    Adds the XlsxWriter format of a table cell role with the given border edges, once per workbook.
+
+    The format has the same font, alignment, number format and borders as the named style of
+    _register_table_style. XlsxWriter writes the font size of every format, so the fonts that openpyxl
+    leaves at the default size are written with an explicit size of 11, which Excel displays the same.
+
+    parameter formats: Dictionary of the formats added to the workbook by (role, edges).
+    returns The format, or None when the cell keeps the default format.
+    '''
+    if role == 'Text' and edges == '':
+        return None
+    if (role, edges) in formats:
+        return formats[(role, edges)]
+
+    properties = {}
+    if role in ('Title', 'Header', 'Header Right'):
+        properties['bold'] = True
+    if role == 'Header Right':
+        properties['align'] = 'right'
+    if role == 'Footnote':
+        properties['font_size'] = 10
+    if role == 'Integer':
+        properties['num_format'] = INTEGER_NUMBER_FORMAT
+    if role == 'Decimal':
+        properties['num_format'] = DECIMAL_NUMBER_FORMAT
+    for edge, side in (('L', 'left'), ('R', 'right'), ('T', 'top'), ('B', 'bottom')):
+        if edge in edges:
+            properties[side] = XLSXWRITER_BORDER_STYLE
+            properties[side + '_color'] = XLSXWRITER_BORDER_COLOR
+    formats[(role, edges)] = workbook.add_format(properties)
+    return formats[(role, edges)]
+
+
+def _write_xlsxwriter_cell(ws, row_idx, col_idx, value, cell_format):
+    '''
+    Writes a cell value with the XlsxWriter method of its type. Empty values keep only their format, so that
+    their borders are drawn, and missing numbers are left blank.
+    '''
+    if isinstance(value, bool):
+        ws.write_boolean(row_idx, col_idx, value, cell_format)
+    elif isinstance(value, numbers.Real) and math.isfinite(value):
+        ws.write_number(row_idx, col_idx, value, cell_format)
+    elif value is not None and value != '' and not isinstance(value, numbers.Real):
+        ws.write_string(row_idx, col_idx, str(value), cell_format)
+    elif cell_format is not None:
+        ws.write_blank(row_idx, col_idx, None, cell_format)
+
 
 
 ''' ########### FUNCTIONS: Printing Output ########### '''
@@ -165,4 +403,3 @@ def print_fatal_exit(output_str):
     sys.exit()
 
 
-
@@ -0,0 +1,104 @@
+import click
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import PipelineMetrics
+import PipelineProfiler
+
+try:
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+''' ########### FUNCTIONS: Sharing Base Data with Worker Processes ########### '''
+
+# Base data of the worker process, loaded once by the pool initializer.
+_shared_frame = None
+
+def write_shared_frame(df, directory):
+    '''
+    Writes the base data to a file that every worker process maps instead of receiving a pickled copy per task.
+
+    The data is written as an uncompressed Arrow (Feather) file so that workers can memory-map it.
+    A pickle file is used when pyarrow is not installed.
+    returns (path, index_names) to pass to read_shared_frame.
+    '''
+    index_names = None
+    if not isinstance(df.index, pd.RangeIndex):
+        index_names = list(df.index.names)
+        df = df.reset_index()
+    if pyarrow is not None:
+        path = os.path.join(directory, 'shared_frame.arrow')
+        pyarrow.feather.write_feather(df, path, compression='uncompressed')
+    else:
+        path = os.path.join(directory, 'shared_frame.pkl')
+        df.to_pickle(path)
+    return (path, index_names)
+
+def read_shared_frame(path, index_names=None):
+    ''' Reads the base data written by write_shared_frame, memory-mapping Arrow files. '''
+    if path.endswith('.arrow'):
+        df = pyarrow.feather.read_table(path, memory_map=True).to_pandas()
+    else:
+        df = pd.read_pickle(path)
+    if index_names is not None:
+        df = df.set_index(index_names)
+    return df
+
+def _init_worker(path, index_names, profile_settings=None):
+    ''' Pool initializer, loads the shared base data once per worker process and enables the profiling of the run. '''
+    global _shared_frame
+    _shared_frame = read_shared_frame(path, index_names)
+    if profile_settings is not None:
+        PipelineProfiler.enable_profiling(*profile_settings)
+
+def _run_task(task):
+    '''
+    Calls a table calculation function with the shared base data as its first argument.
+
+    returns (result, stage records measured by the worker for this table).
+    '''
+    func, args = task
+    PipelineMetrics.reset_metrics()
+    result = func(_shared_frame, *args)
+    return (result, PipelineMetrics.get_metrics())
+
+
+''' ########### FUNCTIONS: Parallel Table Calculation ########### '''
+
+def map_tables(func, shared_df, args_list, workers=1):
+    '''
+    Calculates func(shared_df, *args) for every args in args_list, on a pool of worker processes.
+
+    parameter func: Module level table calculation function taking the base data as its first argument.
+    parameter shared_df: Base data shared by all calculations.
+    parameter args_list: List of argument tuples, one per table.
+    parameter workers: Number of worker processes. 1 calculates the tables in this process.
+    returns List of results in the same order as args_list.
+    '''
+    if workers <= 1 or len(args_list) <= 1:
+        return [func(shared_df, *args) for args in args_list]
+
+    workers = min(workers, len(args_list))
+    print_info('Calculating '+str(len(args_list))+' tables on '+str(workers)+' worker processes.')
+    directory = tempfile.mkdtemp(prefix='flyway_tables_')
+    try:
+        path, index_names = write_shared_frame(shared_df, directory)
+        initargs = (path, index_names, PipelineProfiler.get_profile_settings())
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            # map returns results in submission order, so the sheet order does not depend on scheduling.
+            results = []
+            for result, records in executor.map(_run_task, [(func, args) for args in args_list]):
+                PipelineMetrics.add_metrics(records)
+                results.append(result)
+            return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
@@ -0,0 +1,273 @@
+import click
+import json
+import os
+import shutil
+import urllib.parse
+import pandas as pd
+import WingDataIngest
+import sys
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+''' ########### CONSTANTS: Partitioned Dataset Layout ########### '''
+
+# Bump when the layout of the partitioned dataset changes so that datasets written by older versions are ingested again.
+PARTITION_FORMAT_VERSION = 1
+
+# Partition columns of each dataset, outermost first. Each partition is a Hive-style directory,
+# e.g. harvest/Season=2021/flyway_name=Atlantic Flyway/part-0.parquet.
+PARTITION_COLUMNS = {
+    'harvest': ['Season', 'flyway_name'],
+    'hunter': ['season', 'mgmt_unit']
+}
+
+# Directory value of a blank partition column, as written by Hive and read by Arrow.
+DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Position of each row in the source dataset, so that rows read from several partitions come back in dataset order.
+ROW_NUMBER_COLNAME = 'row_number'
+
+PART_FILENAME = 'part-0.parquet'
+META_FILENAME = 'meta.json'
+
+
+''' ########### FUNCTIONS: Writing the Partitioned Dataset ########### '''
+
+def format_partition_value(value):
+    ''' Directory value of a partition, with the characters not allowed in file names escaped. '''
+    if pd.isnull(value):
+        return DEFAULT_PARTITION
+    return urllib.parse.quote(str(value), safe=' ')
+
+def parse_partition_value(text, dtype):
+    ''' Value of a partition directory, as an int or float for numeric partition columns. None for a blank partition. '''
+    if text == DEFAULT_PARTITION:
+        return None
+    value = urllib.parse.unquote(text)
+    if pd.api.types.is_integer_dtype(dtype):
+        return int(value)
+    if pd.api.types.is_float_dtype(dtype):
+        return float(value)
+    return value
+
+def write_partitioned(df, dataset_path, kind, filename):
+    '''
+    Writes a dataset as one Parquet file per partition, replacing the previous partitions of the dataset atomically.
+
+    parameter kind: Kind of dataset, "harvest" or "hunter", which sets the partition columns and the directory.
+    parameter filename: Path of the source dataset, recorded in the description of the partitioned dataset.
+    '''
+    partition_colnames = PARTITION_COLUMNS[kind]
+    kind_path = os.path.join(dataset_path, kind)
+    tmp_path = kind_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    df = df.reset_index(drop=True)
+    df[ROW_NUMBER_COLNAME] = df.index
+    partitions = 0
+    for values, partition_df in df.groupby(partition_colnames, observed=True, dropna=False):
+        partition_path = os.path.join(tmp_path, *[c+'='+format_partition_value(v) for c, v in zip(partition_colnames, values)])
+        os.makedirs(partition_path)
+        # The partition columns are given by the directories, as in Hive.
+        partition_df.drop(columns=partition_colnames).to_parquet(os.path.join(partition_path, PART_FILENAME), index=False)
+        partitions += 1
+
+    stat = os.stat(filename)
+    meta = {'version': PARTITION_FORMAT_VERSION, 'kind': kind,
+            'source': {'source': os.path.abspath(filename), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns},
+            'columns': [c for c in df.columns if c != ROW_NUMBER_COLNAME],
+            'dtypes': {c: str(df[c].dtype) for c in df.columns if c != ROW_NUMBER_COLNAME},
+            'partition_columns': partition_colnames, 'partitions': partitions, 'rows': len(df)}
+    with open(os.path.join(tmp_path, META_FILENAME), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(kind_path, ignore_errors=True)
+    os.replace(tmp_path, kind_path)
+    print_info('Partitioned dataset ['+kind_path+'] written with '+str(len(df))+' rows in '+str(partitions)+
+               ' partitions from dataset '+filename+'.')
+
+def ingest_harvest_dataset(dataset_path, filename, use_cache=True):
+    '''
+    Writes the wing survey dataset partitioned by season and flyway.
+
+    The records are written as in the dataset. The species cleaning rules are applied by the table generators,
+    which select species before cleaning.
+    '''
+    df = WingDataIngest.load_wing_data(filename, None, use_cache=use_cache)
+    write_partitioned(df, dataset_path, 'harvest', filename)
+
+def ingest_hunter_dataset(dataset_path, filename):
+    ''' Writes the hunter estimates dataset partitioned by season and flyway (mgmt_unit). '''
+    df = pd.read_csv(filename)
+    write_partitioned(df, dataset_path, 'hunter', filename)
+
+
+''' ########### FUNCTIONS: Reading the Partitioned Dataset ########### '''
+
+def read_meta(dataset_path, kind):
+    ''' Reads the description of a partitioned dataset, exiting when it does not exist or is of an older version. '''
+    meta_path = os.path.join(dataset_path, kind, META_FILENAME)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        print_fatal_exit('Partitioned '+kind+' dataset ['+os.path.join(dataset_path, kind)+'] does not exist. '
+                         'Create it with PartitionedDataset first.')
+    if meta.get('version') != PARTITION_FORMAT_VERSION:
+        print_fatal_exit('Partitioned '+kind+' dataset ['+os.path.join(dataset_path, kind)+'] is not of version '+
+                         str(PARTITION_FORMAT_VERSION)+'. Create it again with PartitionedDataset.')
+    return meta
+
+def matches_filter(value, value_filter):
+    '''
+    Checks a value against a filter of read_partitioned. Blank values only match when there is no filter.
+
+    parameter value_filter: List of allowed values, (first, last) tuple of an inclusive range, or None.
+    '''
+    if value_filter is None:
+        return True
+    if value is None:
+        return False
+    if isinstance(value_filter, tuple):
+        return value_filter[0] <= value <= value_filter[1]
+    return value in value_filter
+
+def select_partitions(dataset_path, meta, filters):
+    '''
+    Selects the partition files matching the filters of the partition columns from the directory names alone.
+
+    returns List of (file path, dictionary of partition column values) in partition order.
+    '''
+    selected = [(os.path.join(dataset_path, meta['kind']), {})]
+    for colname in meta['partition_columns']:
+        next_selected = []
+        for path, values in selected:
+            for dirname in sorted(os.listdir(path)):
+                if not dirname.startswith(colname+'='):
+                    continue
+                value = parse_partition_value(dirname[len(colname)+1:], meta['dtypes'][colname])
+                if matches_filter(value, filters.get(colname)):
+                    next_selected.append((os.path.join(path, dirname), dict(values, **{colname: value})))
+        selected = next_selected
+    return [(os.path.join(path, PART_FILENAME), values) for path, values in selected]
+
+def read_partitioned(dataset_path, kind, filters=None, columns=None):
+    '''
+    Reads the rows of a partitioned dataset matching the filters. Filters of partition columns select the partition
+    files that are read, other filters are applied to the rows of the selected files.
+
+    parameter kind: Kind of dataset, "harvest" or "hunter".
+    parameter filters: Dictionary of column name to a list of allowed values, or to a (first, last) tuple of an
+                       inclusive range. Filters with a None value are skipped.
+    parameter columns: Columns to read. Columns missing from the dataset are skipped. None reads all columns.
+    returns DataFrame with the types of the source dataset, in source dataset order.
+    '''
+    if pyarrow is None:
+        print_fatal_exit('Package pyarrow is not installed. It is required to read the partitioned dataset ['+dataset_path+'].')
+    meta = read_meta(dataset_path, kind)
+    filters = {colname: value for colname, value in (filters or {}).items() if value is not None}
+    if columns is None:
+        columns = meta['columns']
+    columns = [c for c in columns if c in meta['columns']]
+    file_colnames = [c for c in columns if c not in meta['partition_columns']] + [ROW_NUMBER_COLNAME]
+    row_filters = {colname: value for colname, value in filters.items() if colname not in meta['partition_columns']}
+    file_colnames += [c for c in row_filters if c not in file_colnames]
+
+    partitions = select_partitions(dataset_path, meta, filters)
+    frames = []
+    for path, values in partitions:
+        partition_df = pd.read_parquet(path, columns=file_colnames)
+        for colname, value_filter in row_filters.items():
+            if isinstance(value_filter, tuple):
+                partition_df = partition_df[partition_df[colname].between(value_filter[0], value_filter[1])]
+            else:
+                partition_df = partition_df[partition_df[colname].isin(list(value_filter))]
+        for colname, value in values.items():
+            partition_df[colname] = value
+        frames.append(partition_df)
+    print_info('Reading '+str(len(partitions))+' of '+str(meta['partitions'])+' partitions of dataset ['+
+               os.path.join(dataset_path, kind)+'].')
+
+    if (len(frames) <= 0):
+        return pd.DataFrame({c: pd.Series(dtype=meta['dtypes'][c]) for c in columns})
+    df = pd.concat(frames, ignore_index=True)
+    df = df.sort_values(ROW_NUMBER_COLNAME).reset_index(drop=True)
+    df = df[columns]
+    # Partition columns are read from the directory names. Categories keep only the values read, as when the
+    # rows are read from a CSV dataset.
+    for colname in columns:
+        if str(df[colname].dtype) != meta['dtypes'][colname]:
+            df[colname] = df[colname].astype(meta['dtypes'][colname])
+        if isinstance(df[colname].dtype, pd.CategoricalDtype):
+            df[colname] = df[colname].cat.remove_unused_categories()
+    print_info('Read '+str(len(df))+' of '+str(meta['rows'])+' rows of partitioned dataset ['+os.path.join(dataset_path, kind)+'].')
+    return df
+
+def read_harvest_data(dataset_path, seasons=None, flyways=None):
+    '''
+    Reads the wing survey records from the partitioned dataset.
+
+    parameter seasons: (first, last) season range, or None for all seasons.
+    parameter flyways: List of flyway names, or None for all flyways.
+    returns DataFrame with the same columns and types as WingDataIngest.load_wing_data.
+    '''
+    return read_partitioned(dataset_path, 'harvest', {'Season': seasons, 'flyway_name': flyways}, WingDataIngest.WING_DATA_COLUMNS)
+
+def read_hunter_estimates(dataset_path, seasons=None, mgmt_units=None, species_groups=None):
+    '''
+    Reads the hunter estimates from the partitioned dataset.
+
+    parameter seasons: (first, last) season range, or None for all seasons.
+    parameter mgmt_units: List of flyway codes, or None for all flyways.
+    parameter species_groups: List of species groups, or None for all groups.
+    '''
+    return read_partitioned(dataset_path, 'hunter', {'season': seasons, 'mgmt_unit': mgmt_units,
+                                                     'sp_group_estimated': species_groups})
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
+
+def print_fatal_exit(output_str):
+    click.echo("[FATAL] " + str(output_str))
+    click.echo("[FATAL] Exiting now...")
+    sys.exit()
+
+
+''' ########### MAIN FUNCTION ########### '''
+
+@click.command()
+@click.argument('dataset', required=1, type=click.Path(file_okay=False))
+@click.option('--harvest', default=None, type=click.Path(exists=True, dir_okay=False), help='Path to the CSV wing survey dataset, \
+              e.g. WingData.csv. Its records are written to DATASET/harvest, partitioned by Season and flyway_name.')
+@click.option('--hunter', default=None, type=click.Path(exists=True, dir_okay=False), help='Path to the CSV harvest estimates \
+              dataset, e.g. vw_harvest_estimates.csv. Its estimates are written to DATASET/hunter, partitioned by season and mgmt_unit.')
+@click.option('--cache/--no-cache', default=True, help='Read the wing survey dataset through its columnar Parquet cache. Default is --cache.')
+def main(dataset, harvest, hunter, cache):
+    ''' Writes the datasets into the season and flyway partitioned DATASET directory, replacing the partitions written before. '''
+
+    print_info("###### Welcome to Partitioned Dataset Ingest #######")
+    if (harvest is None and hunter is None):
+        print_fatal_exit('No dataset to partition. Use --harvest and/or --hunter. Please refer to --help for more information.')
+    if pyarrow is None:
+        print_fatal_exit('Package pyarrow is not installed. It is required to write the partitioned dataset.')
+
+    if (harvest is not None):
+        ingest_harvest_dataset(dataset, harvest, use_cache=cache)
+    if (hunter is not None):
+        ingest_hunter_dataset(dataset, hunter)
+    print_info('Completed partitioned dataset ['+dataset+']')
+
+
+if __name__ == '__main__':
+    ''' Program entry point '''
+    main()
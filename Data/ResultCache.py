@@ -0,0 +1,133 @@
+import click
+import hashlib
+import json
+import os
+import pickle
+import pandas as pd
+
+''' ########### CONSTANTS: Result Cache Layout ########### '''
+
+# Bump when the calculation of the tables or the layout of the cached results changes, so that earlier results
+# are not reused.
+RESULT_CACHE_VERSION = 3
+
+# Default size cap of the result cache directory, in megabytes.
+DEFAULT_CACHE_SIZE_MB = 512
+
+# Bytes of the input read at a time while hashing its content.
+HASH_BLOCK_SIZE = 1048576
+
+# Content hashes of the inputs by path, size and modification time, so that an unchanged input is hashed only once.
+HASHES_FILENAME = 'hashes.json'
+
+RESULT_SUFFIX = '.result.pkl'
+
+
+''' ########### FUNCTIONS: Result Keys ########### '''
+
+def read_known_hashes(cache_dir):
+    ''' Reads the content hashes of the inputs hashed before. Returns an empty dictionary when there are none. '''
+    try:
+        with open(os.path.join(cache_dir, HASHES_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def get_content_hash(cache_dir, path):
+    '''
+    SHA-256 hash of the content of an input file.
+
+    The hash is kept in the cache directory with the size and modification time of the file, and the file is
+    hashed again only when they change. A file copied or touched without changes keeps its hash.
+    '''
+    stat = os.stat(path)
+    known_hashes = read_known_hashes(cache_dir)
+    known = known_hashes.get(os.path.abspath(path))
+    if known is not None and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['sha256']
+
+    print_info('Hashing the content of input ['+path+'] for the result cache.')
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    known_hashes[os.path.abspath(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256.hexdigest()}
+    tmp_path = os.path.join(cache_dir, HASHES_FILENAME+'.'+str(os.getpid())+'.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(known_hashes, f, indent=2)
+    os.replace(tmp_path, os.path.join(cache_dir, HASHES_FILENAME))
+    return sha256.hexdigest()
+
+def get_result_key(cache_dir, command, input_path, options):
+    '''
+    Key of the results of a run: a hash of the content of its input and of its normalized options.
+
+    parameter command: Name of the script, e.g. "HarvestTableGen".
+    parameter input_path: Path of the file the results are calculated from, e.g. the CSV dataset.
+    parameter options: Dictionary of the normalized options the results depend on. Lists keep their order, which
+                       is the order of the tables.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    key = {'version': RESULT_CACHE_VERSION, 'pandas': pd.__version__, 'command': command,
+           'input': get_content_hash(cache_dir, input_path), 'options': options}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+''' ########### FUNCTIONS: Reading and Writing Results ########### '''
+
+def get_result_path(cache_dir, key):
+    ''' Path of the cached results of a key. '''
+    return os.path.join(cache_dir, key + RESULT_SUFFIX)
+
+def read_result(cache_dir, key):
+    ''' Reads the cached results of a key, or returns None on a cache miss. A hit marks the results as recently used. '''
+    result_path = get_result_path(cache_dir, key)
+    try:
+        with open(result_path, 'rb') as f:
+            results = pickle.load(f)
+    except FileNotFoundError:
+        print_info('Result cache miss ['+key[:12]+'].')
+        return None
+    except Exception as e:
+        print_error('Unable to read cached results ['+result_path+'], calculating them again: '+str(e))
+        return None
+    os.utime(result_path)
+    print_info('Result cache hit ['+key[:12]+'], the tables are not calculated again.')
+    return results
+
+def write_result(cache_dir, key, results, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+    ''' Caches the results of a key, then evicts the least recently used results above the size cap. '''
+    result_path = get_result_path(cache_dir, key)
+    tmp_path = result_path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, result_path)
+    except OSError as e:
+        print_error('Unable to write cached results ['+result_path+']: '+str(e))
+        return
+    evict_results(cache_dir, max_size_mb * 1048576)
+
+def evict_results(cache_dir, max_bytes):
+    ''' Removes the least recently used results until the results of the cache directory fit in max_bytes. '''
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(RESULT_SUFFIX):
+            stat = os.stat(os.path.join(cache_dir, filename))
+            entries.append((stat.st_mtime_ns, stat.st_size, filename))
+    total_bytes = sum(size for mtime_ns, size, filename in entries)
+    for mtime_ns, size, filename in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        os.remove(os.path.join(cache_dir, filename))
+        total_bytes -= size
+        print_info('Evicted cached results ['+filename+'] from the result cache.')
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
@@ -0,0 +1,211 @@
+import click
+import os
+import numpy as np
+import pandas as pd
+import sys
+
+''' ########### CONSTANTS: Synthetic Dataset Dimensions ########### '''
+
+# (flyway_code, flyway_name, flyway_abbrev, states) of the wing survey. 49 states, all but Hawaii.
+FLYWAY_STATES = [
+    (1, 'Atlantic Flyway', 'AF', ['CT', 'DE', 'FL', 'GA', 'ME', 'MD', 'MA', 'NH', 'NJ', 'NY', 'NC', 'PA', 'RI', 'SC', 'VT', 'VA', 'WV']),
+    (2, 'Mississippi Flyway', 'MF', ['AL', 'AR', 'IL', 'IN', 'IA', 'KY', 'LA', 'MI', 'MN', 'MS', 'MO', 'OH', 'TN', 'WI']),
+    (3, 'Central Flyway', 'CF', ['CO', 'KS', 'MT', 'NE', 'NM', 'ND', 'OK', 'SD', 'TX', 'WY']),
+    (4, 'Pacific Flyway', 'PF', ['AZ', 'CA', 'ID', 'NV', 'OR', 'UT', 'WA']),
+    (5, 'Alaska', 'AK', ['AK'])
+]
+
+# (AOU_number, species_aou, species_name) of the ducks and geese of the Parts Collection Survey, most harvested first.
+# AOU number 1722 is the Minima Cackling Goose reported as Cackling Goose, cleaned by the table generators.
+SPECIES = [
+    (1320, 'MALL', 'Mallard'), (1390, 'AGWT', 'American Green-winged Teal'), (1440, 'WODU', 'Wood Duck'),
+    (1350, 'GADW', 'Gadwall'), (1400, 'BWTE', 'Blue-winged Teal'), (1720, 'CANG', 'Canada Goose'),
+    (1420, 'NSHO', 'Northern Shoveler'), (1500, 'RNDU', 'Ring-necked Duck'), (1430, 'NOPI', 'Northern Pintail'),
+    (1370, 'AMWI', 'American Wigeon'), (1690, 'SNGO', 'Snow Goose'), (1490, 'LESC', 'Lesser Scaup'),
+    (1530, 'BUFF', 'Bufflehead'), (1710, 'GWFG', 'Greater White-fronted Goose'), (1330, 'ABDU', 'American Black Duck'),
+    (1460, 'REDH', 'Redhead'), (1670, 'RUDD', 'Ruddy Duck'), (1470, 'CANV', 'Canvasback'),
+    (1310, 'HOME', 'Hooded Merganser'), (1340, 'MODU', 'Mottled Duck'), (1410, 'CITE', 'Cinnamon Teal'),
+    (1510, 'COGO', 'Common Goldeneye'), (1480, 'GRSC', 'Greater Scaup'), (1700, 'ROGO', "Ross's Goose"),
+    (1721, 'CACG', 'Cackling Goose'), (1722, 'CACG', 'Cackling Goose'), (1730, 'BRAN', 'Brant'),
+    (1630, 'BLSC', 'Black Scoter'), (1660, 'SUSC', 'Surf Scoter'), (1650, 'WWSC', 'White-winged Scoter'),
+    (1540, 'LTDU', 'Long-tailed Duck'), (1600, 'COEI', 'Common Eider'), (1290, 'COME', 'Common Merganser'),
+    (1300, 'RBME', 'Red-breasted Merganser'), (1780, 'BBWD', 'Black-bellied Whistling-Duck'),
+    (1770, 'FUWD', 'Fulvous Whistling-Duck'), (1520, 'BAGO', "Barrow's Goldeneye"), (1550, 'HARD', 'Harlequin Duck'),
+    (1620, 'KIEI', 'King Eider')
+]
+
+# (sp_group_surveyed, sp_group_estimated) of the Migratory Bird Hunter Diary Survey.
+SPECIES_GROUPS = [
+    ('WATF', 'ducks'), ('WATF', 'geese'), ('WATF', 'sea ducks'), ('WATF', 'brant'), ('DOVE', 'mourning dove'),
+    ('DOVE', 'white-winged dove'), ('DOVE', 'band-tailed pigeon'), ('AMWO', 'American woodcock'), ('SCRG', "Wilson's snipe"),
+    ('SCRG', 'American coot'), ('SCRG', 'rails'), ('SCRG', 'gallinules'), ('CRAN', 'sandhill crane')
+]
+
+# Columns of the harvest estimates dataset, in file order.
+HUNTER_COLUMNS = ['sp_group_surveyed', 'sp_group_estimated', 'season', 'mgmt_unit', 'survey_state', 'survey_state_code',
+                  'state_frame_size', 'days_hunted', 'CI_days_hunted', 'Var_days_hunted', 'retrieved', 'CI_retrieved',
+                  'Var_retrieved', 'unretrieved', 'CI_unretrieved', 'Var_unretrieved', 'active_hunters', 'CI_active_hunters',
+                  'Var_active_hunters', 'bag_per_hunter', 'CI_bph', 'Var_bph', 'status']
+
+
+''' ########### FUNCTIONS: Synthetic Wing Survey Dataset ########### '''
+
+def _get_state_table():
+    ''' One row per state with its flyway, as arrays indexed by state position. '''
+    rows = [(fc, fn, fa, st, fc * 100 + i + 1) for fc, fn, fa, states in FLYWAY_STATES for i, st in enumerate(states)]
+    return [np.array(col) for col in zip(*rows)]
+
+def generate_wing_data_chunk(rng, rows, first_part_id, first_season, last_season):
+    '''
+    Generates rows of a WingData.csv shaped dataset.
+
+    Species follow a Zipf-like distribution so that a few species hold most of the parts, as in the survey.
+    '''
+    flyway_codes, flyway_names, flyway_abbrevs, states, state_codes = _get_state_table()
+    aou_numbers, species_aous, species_names = [np.array(col) for col in zip(*SPECIES)]
+    species_weights = 1.0 / np.arange(1, len(SPECIES) + 1)
+    species_weights /= species_weights.sum()
+
+    season = rng.integers(first_season, last_season + 1, rows)
+    state_idx = rng.integers(0, len(states), rows)
+    species_idx = rng.choice(len(SPECIES), rows, p=species_weights)
+    month = rng.choice([9, 10, 11, 12, 1], rows)
+    age_code = rng.integers(0, 3, rows)
+    sex_code = rng.choice([0, 4, 5], rows)
+    age_char = np.array(['U', 'A', 'I'])[age_code]
+    sex_char = np.where(sex_code == 4, 'M', np.where(sex_code == 5, 'F', 'U'))
+    return pd.DataFrame({
+        'PartId': np.arange(first_part_id, first_part_id + rows),
+        'Season': season,
+        'PCSHunterId': rng.integers(100000000, 1000000000, rows),
+        'harvest_month': month,
+        'harvest_day': rng.integers(1, 29, rows),
+        'harvest_year': np.where(month == 1, season + 1, season),
+        'flyway_code': flyway_codes[state_idx],
+        'flyway_name': flyway_names[state_idx],
+        'flyway_abbrev': flyway_abbrevs[state_idx],
+        'state_code': state_codes[state_idx],
+        'state_name': states[state_idx],
+        'state': states[state_idx],
+        'AOU_number': aou_numbers[species_idx],
+        'species_aou': species_aous[species_idx],
+        'species_name': species_names[species_idx],
+        'age_code': age_code,
+        'age_char': age_char,
+        'sex_code': sex_code,
+        'sex_char': sex_char,
+        'cohort': np.char.add(age_char, sex_char),
+        'harvest_weight': np.round(rng.gamma(2.0, 40.0, rows), 4)
+    })
+
+def generate_wing_data_csv(filename, rows, seed=0, first_season=1961, last_season=2022, chunksize=1000000):
+    '''
+    Writes a seeded synthetic WingData.csv shaped dataset, in bounded chunks.
+
+    The same rows, seed and chunksize always give the same file.
+    returns Number of rows written.
+    '''
+    print_info('Generating '+str(rows)+' synthetic wing survey rows into ['+filename+'] with seed '+str(seed)+'.')
+    rng = np.random.default_rng(seed)
+    written = 0
+    while written < rows:
+        chunk = generate_wing_data_chunk(rng, min(chunksize, rows - written), 1000000000 + written, first_season, last_season)
+        chunk.to_csv(filename, mode='w' if written == 0 else 'a', header=(written == 0), index=False)
+        written += len(chunk)
+    return written
+
+
+''' ########### FUNCTIONS: Synthetic Harvest Estimates Dataset ########### '''
+
+def generate_hunter_data(rows, seed=0, first_season=1999, last_season=2020):
+    '''
+    Generates a vw_harvest_estimates.csv shaped dataset with about the given number of rows.
+
+    Every species group has one row per season and state. Species groups beyond the 13 surveyed groups are
+    added as numbered groups until the dataset has the requested number of rows.
+    '''
+    rng = np.random.default_rng(seed)
+    flyway_codes, flyway_names, flyway_abbrevs, states, state_codes = _get_state_table()
+    seasons = np.arange(first_season, last_season + 1)
+    groups = list(SPECIES_GROUPS)
+    rows_per_group = len(seasons) * len(states)
+    while len(groups) * rows_per_group < rows:
+        groups.append(('SYNT', 'group '+str(len(groups) + 1)))
+
+    group_idx, season_idx, state_idx = [a.ravel() for a in np.meshgrid(np.arange(len(groups)), np.arange(len(seasons)),
+                                                                        np.arange(len(states)), indexing='ij')]
+    n = len(group_idx)
+    active_hunters = np.round(rng.gamma(1.5, 8000.0, n))
+    days_hunted = active_hunters * rng.uniform(2, 8, n)
+    bag_per_hunter = rng.uniform(0.5, 12, n)
+    retrieved = active_hunters * bag_per_hunter
+    unretrieved = retrieved * rng.uniform(0.05, 0.2, n)
+
+    def with_uncertainty(estimates, colname, uncertainty_suffix):
+        # Relative standard errors of 5% to 20%, and CIs as a percentage of the estimate.
+        relative_se = rng.uniform(0.05, 0.2, n)
+        return {colname: estimates, 'CI_'+uncertainty_suffix: np.round(196 * relative_se, 1),
+                'Var_'+uncertainty_suffix: (estimates * relative_se) ** 2}
+
+    data = {
+        'sp_group_surveyed': np.array([g[0] for g in groups])[group_idx],
+        'sp_group_estimated': np.array([g[1] for g in groups])[group_idx],
+        'season': seasons[season_idx],
+        'mgmt_unit': flyway_abbrevs[state_idx],
+        'survey_state': states[state_idx],
+        'survey_state_code': state_codes[state_idx],
+        'state_frame_size': rng.integers(10000, 500000, n)
+    }
+    data.update(with_uncertainty(days_hunted, 'days_hunted', 'days_hunted'))
+    data.update(with_uncertainty(retrieved, 'retrieved', 'retrieved'))
+    data.update(with_uncertainty(unretrieved, 'unretrieved', 'unretrieved'))
+    data.update(with_uncertainty(active_hunters, 'active_hunters', 'active_hunters'))
+    data.update(with_uncertainty(bag_per_hunter, 'bag_per_hunter', 'bph'))
+    data['status'] = np.where(seasons[season_idx] == last_season, 'P', 'F')
+    return pd.DataFrame(data)[HUNTER_COLUMNS]
+
+def generate_hunter_data_csv(filename, rows, seed=0, first_season=1999, last_season=2020):
+    ''' Writes a seeded synthetic vw_harvest_estimates.csv shaped dataset. returns Number of rows written. '''
+    print_info('Generating about '+str(rows)+' synthetic harvest estimates rows into ['+filename+'] with seed '+str(seed)+'.')
+    df = generate_hunter_data(rows, seed, first_season, last_season)
+    df.to_csv(filename, index=False)
+    return len(df)
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
+
+def print_fatal_exit(output_str):
+    click.echo("[FATAL] " + str(output_str))
+    click.echo("[FATAL] Exiting now...")
+    sys.exit()
+
+
+''' ########### MAIN FUNCTION ########### '''
+
+@click.command()
+@click.argument('directory', required=1, type=click.Path(file_okay=False))
+@click.option('--wing_rows', default=1000000, type=click.IntRange(min=0), help='Number of rows of the synthetic WingData.csv. \
+              0 skips the dataset. Default is 1000000.')
+@click.option('--hunter_rows', default=15000, type=click.IntRange(min=0), help='Approximate number of rows of the synthetic \
+              vw_harvest_estimates.csv. 0 skips the dataset. Default is 15000.')
+@click.option('--seed', default=0, type=int, help='Seed of the random generator. The same seed always gives the same datasets. Default is 0.')
+def main(directory, wing_rows, hunter_rows, seed):
+    ''' Generates seeded synthetic WingData.csv and vw_harvest_estimates.csv datasets in DIRECTORY. '''
+
+    os.makedirs(directory, exist_ok=True)
+    if (wing_rows > 0):
+        generate_wing_data_csv(os.path.join(directory, 'WingData.csv'), wing_rows, seed)
+    if (hunter_rows > 0):
+        generate_hunter_data_csv(os.path.join(directory, 'vw_harvest_estimates.csv'), hunter_rows, seed)
+    print_info('Synthetic datasets written to ['+directory+']')
+
+
+if __name__ == '__main__':
+    ''' Program entry point '''
+    main()
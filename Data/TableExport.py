@@ -0,0 +1,103 @@
+import click
+import numpy as np
+import pandas as pd
+import PipelineMetrics
+import sys
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+''' ########### CONSTANTS: Export Formats ########### '''
+
+# File extension of each machine-readable output format. "excel" writes the workbooks of FlywayTables instead.
+EXPORT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'json': '.json'}
+
+OUTPUT_FORMATS = ['excel'] + list(EXPORT_EXTENSIONS)
+
+# Columns of the long format following the labels of each table.
+LONG_COLUMNS = ['section', 'period', 'column', 'value']
+
+
+''' ########### FUNCTIONS: Long Format Tables ########### '''
+
+def tables_to_long(table_list, season_colname):
+    '''
+    Converts tables to a single long format DataFrame, one row per (table, section, season or period, column) cell,
+    in the order of the tables, of their sections and of their rows.
+
+    The cells of each section are taken from its NumPy array in one step, and the DataFrame is built once from
+    the concatenated arrays of every table.
+
+    parameter table_list: List of (labels, estimate_data_df, average_data_df, summary_sections), where labels is a
+                          dictionary of the label columns of the table, e.g. {'flyway': 'AF', 'species_group': 'ducks'},
+                          and summary_sections the list of (section title, DataFrame) of TimePeriods.calc_summary_sections.
+    returns DataFrame with the label columns, then the section title, the season or period label as text, the column
+            name and its value. Values are always float64, so the type of the value column does not depend on the data.
+    '''
+    label_colnames = list(table_list[0][0]) if len(table_list) > 0 else []
+    arrays = {colname: [] for colname in label_colnames + LONG_COLUMNS}
+    for labels, estimate_data_df, average_data_df, summary_sections in table_list:
+        sections = [('Estimates', estimate_data_df), ('Averages', average_data_df)] + list(summary_sections or [])
+        for section_title, section_df in sections:
+            value_colnames = [c for c in section_df.columns if c != season_colname]
+            cells = len(section_df) * len(value_colnames)
+            for colname in label_colnames:
+                arrays[colname].append(np.full(cells, labels[colname], dtype=object))
+            arrays['section'].append(np.full(cells, section_title, dtype=object))
+            arrays['period'].append(np.repeat(section_df[season_colname].astype(str).to_numpy(dtype=object), len(value_colnames)))
+            arrays['column'].append(np.tile(np.array(value_colnames, dtype=object), len(section_df)))
+            arrays['value'].append(section_df[value_colnames].to_numpy(dtype=np.float64).ravel())
+
+    long_df = pd.DataFrame({colname: np.concatenate(values) if len(values) > 0 else np.array([], dtype=object)
+                            for colname, values in arrays.items()})
+    long_df['value'] = long_df['value'].astype(np.float64)
+    return long_df
+
+
+''' ########### FUNCTIONS: Writing Exports ########### '''
+
+def write_long_table(long_df, export_path, output_format):
+    ''' Writes a long format DataFrame as CSV, Parquet or JSON (an array of records). '''
+    if (output_format == 'csv'):
+        long_df.to_csv(export_path, index=False)
+    elif (output_format == 'parquet'):
+        if pyarrow is None:
+            print_fatal_exit('Package pyarrow is not installed. It is required by --output_format parquet.')
+        long_df.to_parquet(export_path, index=False)
+    elif (output_format == 'json'):
+        long_df.to_json(export_path, orient='records')
+    else:
+        print_fatal_exit('Invalid output format ['+str(output_format)+']. Options are '+str(list(EXPORT_EXTENSIONS))+'.')
+
+def write_tables(export_name, table_list, season_colname, output_format):
+    '''
+    Writes every table of a run to one long format file, without building an Excel workbook.
+
+    parameter export_name: File name of the export without its extension, e.g. "AF Hunter Data Tables".
+    parameter table_list: List of (labels, estimate_data_df, average_data_df, summary_sections), as in tables_to_long.
+    parameter output_format: "csv", "parquet" or "json".
+    returns Path of the written file.
+    '''
+    export_path = export_name + EXPORT_EXTENSIONS[output_format]
+    with PipelineMetrics.stage('export', export_path, rows_in=len(table_list)) as record:
+        long_df = tables_to_long(table_list, season_colname)
+        write_long_table(long_df, export_path, output_format)
+        record['rows_out'] = len(long_df)
+    print_info('Completed '+output_format+' export file ['+export_path+'] with '+str(len(table_list))+' tables.')
+    return export_path
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
+
+def print_fatal_exit(output_str):
+    click.echo("[FATAL] " + str(output_str))
+    click.echo("[FATAL] Exiting now...")
+    sys.exit()
@@ -0,0 +1,206 @@
+import click
+import os
+import sqlite3
+import pandas as pd
+import WingDataIngest
+import sys
+
+''' ########### CONSTANTS: Repository Layout ########### '''
+
+# Harvest sums by season, flyway, state and species, derived from the wing survey dataset.
+HARVEST_TABLE = 'harvest_sums'
+
+# Hunter estimates, loaded from the harvest estimates dataset (vw_harvest_estimates.csv).
+HUNTER_TABLE = 'hunter_estimates'
+
+# Source dataset of each table, recorded at ingest.
+SOURCES_TABLE = 'sources'
+
+# Composite indexes of each table. The (season, flyway, state, species) index serves extent queries,
+# and the species led indexes serve the lookups of the table generators, one species or group over
+# a range of seasons.
+HARVEST_INDEXES = {
+    'idx_harvest_season_flyway_state_species': ['Season', 'flyway_name', 'state', 'species_aou'],
+    'idx_harvest_species_aou_season': ['species_aou', 'Season', 'flyway_name', 'state'],
+    'idx_harvest_species_name_season': ['species_name', 'Season', 'flyway_name', 'state']
+}
+HUNTER_INDEXES = {
+    'idx_hunter_season_unit_state_group': ['season', 'mgmt_unit', 'survey_state', 'sp_group_estimated'],
+    'idx_hunter_group_season': ['sp_group_estimated', 'season', 'mgmt_unit', 'survey_state']
+}
+
+
+''' ########### FUNCTIONS: Ingesting Datasets into the Repository ########### '''
+
+def connect(repository_path):
+    ''' Opens the SQLite repository, creating it when it does not exist. '''
+    return sqlite3.connect(repository_path)
+
+def write_table(conn, table_name, df, indexes, filename):
+    ''' Replaces a repository table with the DataFrame, creates its indexes and records its source dataset. '''
+    df.to_sql(table_name, conn, if_exists='replace', index=False, chunksize=100000)
+    for index_name, colnames in indexes.items():
+        conn.execute('CREATE INDEX IF NOT EXISTS '+index_name+' ON '+table_name+' ('+', '.join(colnames)+')')
+    stat = os.stat(filename)
+    conn.execute('CREATE TABLE IF NOT EXISTS '+SOURCES_TABLE+' (table_name TEXT PRIMARY KEY, source TEXT, size INTEGER, '
+                 'mtime_ns INTEGER, rows INTEGER)')
+    conn.execute('INSERT OR REPLACE INTO '+SOURCES_TABLE+' VALUES (?, ?, ?, ?, ?)',
+                 (table_name, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, len(df)))
+    conn.execute('ANALYZE '+table_name)
+    conn.commit()
+    print_info('Repository table ['+table_name+'] loaded with '+str(len(df))+' rows from dataset '+filename+'.')
+
+def ingest_harvest_dataset(conn, filename, use_cache=True):
+    '''
+    Loads the harvest sums of the wing survey dataset into the repository.
+
+    The species codes and names are summed as in the dataset, with AOU_number kept. The species cleaning rules
+    are applied by the table generators, which select species before cleaning.
+    '''
+    df = WingDataIngest.load_wing_data(filename, WingDataIngest.WING_DATA_COLUMNS, use_cache=use_cache)
+    df = WingDataIngest.reduce_harvest_sums(df)
+    write_table(conn, HARVEST_TABLE, df, HARVEST_INDEXES, filename)
+
+def ingest_hunter_dataset(conn, filename):
+    ''' Loads the hunter estimates dataset into the repository. '''
+    df = pd.read_csv(filename)
+    write_table(conn, HUNTER_TABLE, df, HUNTER_INDEXES, filename)
+
+
+''' ########### FUNCTIONS: Querying the Repository ########### '''
+
+def build_where_clause(filters):
+    '''
+    Builds a parameterized WHERE clause.
+
+    parameter filters: Dictionary of column name to a list of allowed values, or to a (first, last) tuple of
+                       an inclusive range. Filters with a None value are skipped. Null values in a list select
+                       the rows where the column is NULL.
+    returns (clause, parameters).
+    '''
+    conditions = []
+    params = []
+    for colname, value in filters.items():
+        if value is None:
+            continue
+        if isinstance(value, tuple):
+            conditions.append(colname+' BETWEEN ? AND ?')
+            params += [value[0], value[1]]
+        else:
+            value = list(value)
+            values = [v for v in value if not pd.isnull(v)]
+            condition = colname+' IN ('+', '.join(['?'] * len(values))+')'
+            if (len(values) < len(value)):
+                condition = '('+condition+' OR '+colname+' IS NULL)'
+            conditions.append(condition)
+            params += values
+    if (len(conditions) <= 0):
+        return ('', params)
+    return (' WHERE '+' AND '.join(conditions), params)
+
+def query_table(repository_path, table_name, filters):
+    ''' Reads the rows of a repository table matching the filters, in ingest order. '''
+    if not os.path.exists(repository_path):
+        print_fatal_exit('Repository ['+repository_path+'] does not exist. Please refer to --help for more information.')
+    where_clause, params = build_where_clause(filters)
+    conn = connect(repository_path)
+    try:
+        df = pd.read_sql_query('SELECT * FROM '+table_name+where_clause+' ORDER BY rowid', conn, params=params)
+    finally:
+        conn.close()
+    print_info('Read '+str(len(df))+' rows from repository table ['+table_name+'].')
+    return df
+
+def get_stored_species(repository_path, species_colname, species):
+    '''
+    Species values of the repository that select the rows of the species, before or after cleaning.
+
+    The repository holds the species as in the dataset, and the species cleaning rules recode some of them.
+    The species dimension of the repository is cleaned, and every stored value that is, or is cleaned to,
+    one of the species is returned. The rows read may hold other species, which the table generators leave out.
+    parameter species: List of species codes or names in species_colname.
+    '''
+    conn = connect(repository_path)
+    try:
+        dimension_df = pd.read_sql_query('SELECT DISTINCT species_aou, species_name, AOU_number FROM '+HARVEST_TABLE, conn)
+    finally:
+        conn.close()
+    stored_species = dimension_df[species_colname].copy()
+    cleaned_species = WingDataIngest.clean_species_columns(dimension_df)[species_colname].astype(object)
+    selected = stored_species.isin(species) | cleaned_species.isin(species)
+    return list(dict.fromkeys(None if pd.isnull(v) else v for v in stored_species[selected]))
+
+def read_harvest_sums(repository_path, seasons=None, flyways=None, species_colname='species_aou', species=None):
+    '''
+    Reads the harvest sums from the repository.
+
+    parameter seasons: (first, last) season range, or None for all seasons.
+    parameter flyways: List of flyway names, or None for all flyways.
+    parameter species: List of species codes or names in species_colname, before or after cleaning, or None
+                       for all species.
+    returns DataFrame with the same columns and types as WingDataIngest.stream_wing_data_sums.
+    '''
+    if (species is not None):
+        species = get_stored_species(repository_path, species_colname, species)
+    df = query_table(repository_path, HARVEST_TABLE, {'Season': seasons, 'flyway_name': flyways, species_colname: species})
+    for colname in df.columns:
+        if colname in WingDataIngest.WING_DATA_DTYPES:
+            df[colname] = df[colname].astype(WingDataIngest.WING_DATA_DTYPES[colname])
+    return df
+
+def read_hunter_estimates(repository_path, seasons=None, mgmt_units=None, species_groups=None):
+    '''
+    Reads the hunter estimates from the repository.
+
+    parameter seasons: (first, last) season range, or None for all seasons.
+    parameter mgmt_units: List of flyway codes, or None for all flyways.
+    parameter species_groups: List of species groups, or None for all groups.
+    '''
+    return query_table(repository_path, HUNTER_TABLE, {'season': seasons, 'mgmt_unit': mgmt_units,
+                                                       'sp_group_estimated': species_groups})
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
+
+def print_fatal_exit(output_str):
+    click.echo("[FATAL] " + str(output_str))
+    click.echo("[FATAL] Exiting now...")
+    sys.exit()
+
+
+''' ########### MAIN FUNCTION ########### '''
+
+@click.command()
+@click.argument('repository', required=1, type=click.Path(dir_okay=False))
+@click.option('--harvest', default=None, type=click.Path(exists=True, dir_okay=False), help='Path to the CSV wing survey dataset, \
+              e.g. WingData.csv. Its harvest sums by season, flyway, state and species are loaded into the repository.')
+@click.option('--hunter', default=None, type=click.Path(exists=True, dir_okay=False), help='Path to the CSV harvest estimates \
+              dataset, e.g. vw_harvest_estimates.csv. Its hunter estimates are loaded into the repository.')
+@click.option('--cache/--no-cache', default=True, help='Read the wing survey dataset through its columnar Parquet cache. Default is --cache.')
+def main(repository, harvest, hunter, cache):
+    ''' Loads the datasets into the SQLite time series REPOSITORY, replacing the tables they were loaded into before. '''
+
+    print_info("###### Welcome to Time Series Repository Ingest #######")
+    if (harvest is None and hunter is None):
+        print_fatal_exit('No dataset to load. Use --harvest and/or --hunter. Please refer to --help for more information.')
+
+    conn = connect(repository)
+    try:
+        if (harvest is not None):
+            ingest_harvest_dataset(conn, harvest, use_cache=cache)
+        if (hunter is not None):
+            ingest_hunter_dataset(conn, hunter)
+    finally:
+        conn.close()
+    print_info('Completed repository ['+repository+']')
+
+
+if __name__ == '__main__':
+    ''' Program entry point '''
+    main()
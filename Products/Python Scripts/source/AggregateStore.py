@@ -0,0 +1,120 @@
+import click
+import json
+import os
+import pandas as pd
+import sys
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+''' ########### CONSTANTS: Aggregate Store Layout ########### '''
+
+# Bump when the store layout changes so that stores written by older versions are rebuilt.
+STORE_FORMAT_VERSION = 2
+
+
+''' ########### FUNCTIONS: Persisted Aggregate Store ########### '''
+
+def get_store_meta_path(store_path):
+    ''' Returns the path of the JSON file describing the store, kept next to the store. '''
+    return store_path + '.json'
+
+def read_store_meta(store_path):
+    ''' Reads the store description, or returns None when the store does not exist or is not readable. '''
+    meta_path = get_store_meta_path(store_path)
+    if not (os.path.exists(store_path) and os.path.exists(meta_path)):
+        return None
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def read_store(store_path, kind):
+    '''
+    Reads the aggregates of a persisted store.
+
+    parameter store_path: Path to the Parquet store.
+    parameter kind: Kind of aggregates expected in the store, "harvest" or "hunter".
+    returns DataFrame of the stored aggregates.
+    '''
+    if pyarrow is None:
+        print_fatal_exit('Package pyarrow is not installed. It is required to read the aggregate store ['+store_path+'].')
+    meta = read_store_meta(store_path)
+    if meta is None:
+        print_fatal_exit('Aggregate store ['+store_path+'] does not exist. Build it first by running without --append_season.')
+    if meta.get('kind') != kind or meta.get('version') != STORE_FORMAT_VERSION:
+        print_fatal_exit('Aggregate store ['+store_path+'] is not a '+kind+' store of version '+str(STORE_FORMAT_VERSION)+
+                         '. Rebuild it by running without --append_season.')
+    df = pd.read_parquet(store_path)
+    print_info('Read '+str(len(df))+' aggregate rows of seasons '+str(meta['seasons'][0])+' to '+str(meta['seasons'][-1])+
+               ' from store ['+store_path+'].')
+    return df
+
+def write_store(df, store_path, kind, season_colname):
+    '''
+    Writes the aggregates to a persisted Parquet store, replacing the previous store atomically.
+
+    parameter kind: Kind of aggregates in the store, "harvest" or "hunter".
+    parameter season_colname: Name of the season column, recorded with the list of stored seasons.
+    '''
+    if pyarrow is None:
+        print_fatal_exit('Package pyarrow is not installed. It is required to write the aggregate store ['+store_path+'].')
+    tmp_path = store_path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, store_path)
+    seasons = sorted(int(s) for s in df[season_colname].dropna().unique())
+    with open(get_store_meta_path(store_path), 'w') as f:
+        json.dump({'kind': kind, 'version': STORE_FORMAT_VERSION, 'season_column': season_colname,
+                   'seasons': seasons, 'rows': len(df)}, f)
+    print_info('Aggregate store ['+store_path+'] saved with '+str(len(df))+' rows of '+str(len(seasons))+' seasons.')
+
+def merge_season(store_df, season_df, season_colname, season):
+    '''
+    Replaces the aggregates of one season in the stored aggregates.
+
+    Rows of other seasons are kept as they are, so appending the same season twice gives the same store.
+    Categorical columns of the store stay categorical.
+    returns DataFrame of the merged aggregates, ordered by season.
+    '''
+    missing_colnames = [c for c in store_df.columns if c not in season_df.columns]
+    if (len(missing_colnames) > 0):
+        print_fatal_exit('Rows of season '+str(season)+' are missing the stored column(s) '+str(missing_colnames)+'.')
+    kept_df = store_df[store_df[season_colname] != season]
+    if (len(kept_df) < len(store_df)):
+        print_info('Replacing '+str(len(store_df) - len(kept_df))+' stored aggregate rows of season '+str(season)+'.')
+    merged_df = pd.concat([kept_df, season_df[list(store_df.columns)]], ignore_index=True)
+    for colname in store_df.columns:
+        if isinstance(store_df[colname].dtype, pd.CategoricalDtype):
+            merged_df[colname] = merged_df[colname].astype('category')
+        elif (merged_df[colname].dtype != store_df[colname].dtype):
+            merged_df[colname] = merged_df[colname].astype(store_df[colname].dtype)
+    return merged_df.sort_values(season_colname, kind='stable', ignore_index=True)
+
+def read_csv_season(filename, season_colname, season, chunksize=1000000):
+    '''
+    Reads only the rows of one season from a CSV dataset, in bounded chunks.
+
+    returns DataFrame of the rows of the season.
+    '''
+    print_info('Reading rows of season '+str(season)+' from dataset '+filename+'.')
+    season_chunks = [chunk[chunk[season_colname] == season] for chunk in pd.read_csv(filename, chunksize=chunksize)]
+    season_df = pd.concat(season_chunks, ignore_index=True)
+    print_info('Found '+str(len(season_df))+' rows of season '+str(season)+'.')
+    return season_df
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
+
+def print_fatal_exit(output_str):
+    click.echo("[FATAL] " + str(output_str))
+    click.echo("[FATAL] Exiting now...")
+    sys.exit()
@@ -0,0 +1,255 @@
+import click
+import gc
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import FlywayTables
+import HarvestTableGen
+import HunterTableGen
+import PipelineMetrics
+import SyntheticData
+import TimePeriods
+import WingDataIngest
+import sys
+
+''' ########### CONSTANTS: Benchmark Report ########### '''
+
+# Bump when the layout of the report changes.
+REPORT_VERSION = 1
+
+# Named group of the harvest benchmarks, so that the group cells of the cube are measured too.
+BENCHMARK_GROUPS = {'is_Dabblers': ['MALL', 'ABDU', 'GADW', 'AMWI', 'AGWT', 'BWTE', 'NSHO', 'NOPI']}
+
+
+''' ########### FUNCTIONS: Measuring Stages ########### '''
+
+def run_stage(stages, stage_name, func, *args, rows=None):
+    '''
+    Runs one pipeline stage and appends its measurements to stages.
+
+    Measures the wall and CPU time of the stage, the peak resident memory of the process after the stage, and
+    when tracemalloc is tracing, the peak memory allocated by the stage above what was allocated when it started.
+    returns The value returned by func.
+    '''
+    gc.collect()
+    memory_tracking = tracemalloc.is_tracing()
+    if memory_tracking:
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    value = func(*args)
+    stage = {'stage': stage_name,
+             'seconds': round(time.perf_counter() - start_time, 4),
+             'cpu_seconds': round(time.process_time() - start_cpu, 4),
+             'peak_memory_mb': None,
+             'peak_rss_mb': PipelineMetrics.get_peak_rss_mb(),
+             'rows': rows}
+    if memory_tracking:
+        stage['peak_memory_mb'] = round((tracemalloc.get_traced_memory()[1] - start_memory) / 1048576, 2)
+    stages.append(stage)
+    print_info('Stage ['+stage_name+'] took '+str(stage['seconds'])+'s, peak memory '+str(stage['peak_memory_mb'])+
+               ' MB, process peak RSS '+str(stage['peak_rss_mb'])+' MB.')
+    return value
+
+
+''' ########### FUNCTIONS: Harvest and Hunter Benchmarks ########### '''
+
+def benchmark_harvest(workdir, rows, seed):
+    ''' Benchmarks each stage of the harvest table pipeline on a synthetic wing survey dataset of the given size. '''
+    filename = os.path.join(workdir, 'WingData_'+str(rows)+'.csv')
+    start_time = time.perf_counter()
+    SyntheticData.generate_wing_data_csv(filename, rows, seed)
+    generate_seconds = round(time.perf_counter() - start_time, 4)
+    stages = []
+
+    run_stage(stages, 'ingest_csv', WingDataIngest.read_wing_data_csv, filename, WingDataIngest.WING_DATA_COLUMNS, rows=rows)
+    cache_path = WingDataIngest.get_cache_path(filename)
+    run_stage(stages, 'ingest_cache_build', WingDataIngest.build_wing_data_cache, filename, cache_path, rows=rows)
+    df = run_stage(stages, 'ingest_cache_read', WingDataIngest.load_wing_data, filename, rows=rows)
+    run_stage(stages, 'ingest_streaming', WingDataIngest.stream_wing_data_sums, filename, rows=rows)
+    df = run_stage(stages, 'clean', WingDataIngest.clean_species_columns, df, rows=rows)
+
+    season_start, season_end = int(df['Season'].min()), int(df['Season'].max())
+    species_list = list(BENCHMARK_GROUPS) + [sp for sp in df['species_aou'].unique() if not pd.isnull(sp)]
+    cube = run_stage(stages, 'grouping', HarvestTableGen.build_harvest_cube, df, season_start, season_end, 'species_aou',
+                     BENCHMARK_GROUPS, rows=rows)
+
+    def pivot_tables():
+        for sp in species_list:
+            species_cube = HarvestTableGen.slice_harvest_cube(cube, sp)
+            HarvestTableGen.aggregate_harvest_by_species_by_flyway(species_cube, 'Atlantic Flyway')
+            HarvestTableGen.aggregate_harvest_by_flyway(species_cube)
+    run_stage(stages, 'pivot', pivot_tables, rows=len(cube))
+
+    def calc_tables():
+        return [HarvestTableGen.calc_harvest_tabledata_by_species(cube, 'Atlantic Flyway', season_start, season_end, sp)
+                for sp in species_list]
+    tables = run_stage(stages, 'tables', calc_tables, rows=len(cube))
+
+    def calc_period_averages():
+        for table_df, averages_df in tables:
+            TimePeriods.calc_period_averages(table_df, 'Season', season_start, season_end)
+    run_stage(stages, 'period_averages', calc_period_averages, rows=sum(len(t[0]) for t in tables))
+
+    table_list = [(t[0], t[1], ['* Preliminary Estimate'], 'Estimates of '+sp+' Harvest', sp) for sp, t in zip(species_list, tables)]
+    workbook_name = os.path.join(workdir, 'benchmark_harvest.xlsx')
+    run_stage(stages, 'excel_write', FlywayTables.write_tables_to_workbook, workbook_name, table_list, rows=len(table_list))
+    run_stage(stages, 'excel_write_only', FlywayTables.write_tables_to_workbook, workbook_name, table_list, True, rows=len(table_list))
+    if FlywayTables.xlsxwriter is not None:
+        run_stage(stages, 'excel_xlsxwriter', FlywayTables.write_tables_to_workbook, workbook_name, table_list, False, 'xlsxwriter',
+                  rows=len(table_list))
+
+    return {'dataset': 'wing', 'rows': rows, 'generate_seconds': generate_seconds, 'stages': stages}
+
+def benchmark_hunter(workdir, rows, seed):
+    ''' Benchmarks each stage of the hunter table pipeline on a synthetic harvest estimates dataset of about the given size. '''
+    filename = os.path.join(workdir, 'vw_harvest_estimates_'+str(rows)+'.csv')
+    start_time = time.perf_counter()
+    rows = SyntheticData.generate_hunter_data_csv(filename, rows, seed)
+    generate_seconds = round(time.perf_counter() - start_time, 4)
+    stages = []
+
+    df = run_stage(stages, 'ingest_csv', pd.read_csv, filename, rows=rows)
+    season_start, season_end = int(df['season'].min()), int(df['season'].max())
+    group_list = list(df['sp_group_estimated'].unique())
+    aggregate = run_stage(stages, 'aggregate', HunterTableGen.aggregate_hunter_estimates, df, ['active_hunters'], rows=rows)
+    national_totals_by_group = run_stage(stages, 'grouping', HunterTableGen.calc_national_totals_multiple_groups, aggregate,
+                                         season_start, season_end, group_list, 'active_hunters', rows=len(aggregate))
+    results = run_stage(stages, 'tables', HunterTableGen.calc_harvest_tabledata_multiple_groups, aggregate, 'AF', season_start, season_end,
+                        group_list, 'active_hunters', national_totals_by_group, rows=len(aggregate))
+
+    table_list = [(r[2], r[3], ['* Preliminary Estimate'], 'Estimates of '+str(r[0]), str(r[0])) for r in results]
+    workbook_name = os.path.join(workdir, 'benchmark_hunter.xlsx')
+    run_stage(stages, 'excel_write', FlywayTables.write_tables_to_workbook, workbook_name, table_list, rows=len(table_list))
+
+    return {'dataset': 'hunter', 'rows': rows, 'generate_seconds': generate_seconds, 'stages': stages}
+
+
+''' ########### FUNCTIONS: Benchmark Report ########### '''
+
+def get_environment():
+    ''' Versions and hardware of the benchmark run, so reports from different machines are told apart. '''
+    try:
+        import pyarrow
+        pyarrow_version = pyarrow.__version__
+    except ImportError:
+        pyarrow_version = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'pandas': pd.__version__, 'numpy': np.__version__, 'pyarrow': pyarrow_version}
+
+def find_regressions(report, baseline, threshold):
+    '''
+    Compares the stage times of a report with a baseline report.
+
+    returns List of (dataset, rows, stage, baseline seconds, seconds) of the stages slower than threshold times the baseline.
+    '''
+    baseline_stages = {}
+    for run in baseline.get('runs', []):
+        for stage in run['stages']:
+            baseline_stages[(run['dataset'], run['rows'], stage['stage'])] = stage['seconds']
+    regressions = []
+    for run in report['runs']:
+        for stage in run['stages']:
+            baseline_seconds = baseline_stages.get((run['dataset'], run['rows'], stage['stage']))
+            if baseline_seconds is not None and stage['seconds'] > baseline_seconds * threshold:
+                regressions.append((run['dataset'], run['rows'], stage['stage'], baseline_seconds, stage['seconds']))
+    return regressions
+
+def parse_sizes_option(sizes):
+    ''' Parses a comma seperated list of dataset sizes in rows. Returns None when invalid. '''
+    sizes = [x.strip() for x in sizes.split(',') if len(x.strip()) > 0]
+    if (len(sizes) <= 0 or not all(x.isdigit() and int(x) > 0 for x in sizes)):
+        return None
+    return [int(x) for x in sizes]
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
+
+def print_fatal_exit(output_str):
+    click.echo("[FATAL] " + str(output_str))
+    click.echo("[FATAL] Exiting now...")
+    sys.exit()
+
+
+''' ########### MAIN FUNCTION ########### '''
+
+@click.command()
+@click.option('--sizes', default='1000000', help='A comma seperated list of synthetic wing survey dataset sizes in rows, \
+              e.g. 1000000,10000000,50000000. Default is 1000000.')
+@click.option('--hunter_rows', default=15000, type=click.IntRange(min=0), help='Approximate number of rows of the synthetic \
+              harvest estimates dataset. 0 skips the hunter benchmark. Default is 15000.')
+@click.option('--seed', default=0, type=int, help='Seed of the synthetic datasets. Default is 0.')
+@click.option('--output', default='benchmark_report.json', type=click.Path(dir_okay=False), help='Path of the JSON benchmark \
+              report. Default is benchmark_report.json.')
+@click.option('--workdir', default=None, type=click.Path(file_okay=False), help='Directory of the synthetic datasets and \
+              workbooks. Default is a temporary directory, removed after the run.')
+@click.option('--memory/--no-memory', default=False, help='Also track the peak memory allocated by each stage with tracemalloc. \
+              This slows the stages down several times, so only compare reports run with the same option. The peak resident \
+              memory of the process is always recorded. Default is --no-memory.')
+@click.option('--baseline', default=None, type=click.Path(exists=True, dir_okay=False), help='Benchmark report of an earlier \
+              release. Stages slower than --threshold times their baseline are reported and the exit code is 1.')
+@click.option('--threshold', default=1.25, type=click.FloatRange(min=1), help='Slowdown over the baseline reported as a \
+              regression. Default is 1.25.')
+def main(sizes, hunter_rows, seed, output, workdir, memory, baseline, threshold):
+    ''' Benchmarks the table generation stages on seeded synthetic datasets and writes a JSON report. '''
+
+    print_info("###### Welcome to the Table Generation Benchmark Suite #######")
+    size_list = parse_sizes_option(sizes)
+    if (size_list is None):
+        print_fatal_exit("Invalid sizes parameter. Please refer to --help for more information.")
+
+    remove_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='flyway_benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    if memory:
+        tracemalloc.start()
+
+    report = {'report_version': REPORT_VERSION, 'created': datetime.now(timezone.utc).isoformat(), 'environment': get_environment(),
+              'seed': seed, 'memory_tracking': memory, 'runs': []}
+    try:
+        for rows in size_list:
+            report['runs'].append(benchmark_harvest(workdir, rows, seed))
+        if (hunter_rows > 0):
+            report['runs'].append(benchmark_hunter(workdir, hunter_rows, seed))
+    finally:
+        if memory:
+            tracemalloc.stop()
+        if remove_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_info('Benchmark report written to ['+output+']')
+
+    if (baseline is not None):
+        with open(baseline) as f:
+            baseline_report = json.load(f)
+        # tracemalloc slows the stages down, so only reports with the same memory tracking are comparable.
+        if (baseline_report.get('memory_tracking') != memory):
+            print_fatal_exit('Baseline report ['+baseline+'] was not run with the same --memory/--no-memory option.')
+        regressions = find_regressions(report, baseline_report, threshold)
+        for dataset, rows, stage, baseline_seconds, seconds in regressions:
+            print_error('Regression in '+dataset+' benchmark of '+str(rows)+' rows, stage ['+stage+'] took '+str(seconds)+
+                        's, baseline '+str(baseline_seconds)+'s.')
+        if (len(regressions) > 0):
+            sys.exit(1)
+        print_info('No stage is slower than '+str(threshold)+' times its baseline.')
+
+
+if __name__ == '__main__':
+    ''' Program entry point '''
+    main()
@@ -0,0 +1,198 @@
+import functools
+import os
+import pandas as pd
+import AggregateStore
+import HarvestTableGen
+import HunterTableGen
+import TimeSeriesRepository
+import WingDataIngest
+
+''' ########### CONSTANTS: Memoization ########### '''
+
+# Number of table results kept by the memoization layer, least recently used first out.
+TABLE_CACHE_SIZE = 256
+
+# Number of loaded datasets and harvest cubes kept in memory.
+DATASET_CACHE_SIZE = 2
+CUBE_CACHE_SIZE = 8
+
+# File extensions of the SQLite time series repository and of the aggregate store.
+REPOSITORY_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+STORE_EXTENSIONS = ('.parquet',)
+
+
+''' ########### FUNCTIONS: Loading Datasets ########### '''
+
+def get_dataset_fingerprint(dataset):
+    '''
+    Fingerprint of a dataset file, part of every memoization key.
+
+    A dataset that is replaced or updated gets a new fingerprint, so results of its previous version are
+    never returned.
+    '''
+    stat = os.stat(dataset)
+    return (os.path.abspath(dataset), stat.st_size, stat.st_mtime_ns)
+
+def get_dataset_kind(dataset):
+    ''' Returns "repository", "store" or "csv", from the file extension of the dataset. '''
+    extension = os.path.splitext(dataset)[1].lower()
+    if extension in REPOSITORY_EXTENSIONS:
+        return 'repository'
+    if extension in STORE_EXTENSIONS:
+        return 'store'
+    return 'csv'
+
+@functools.lru_cache(maxsize=DATASET_CACHE_SIZE)
+def _load_harvest_dataset(fingerprint):
+    '''
+    Loads the harvest data of a wing survey dataset, repository or aggregate store, with the species values of
+    the dataset. The species are cleaned by _clean_harvest_dataset, after the raw species column is kept.
+    '''
+    dataset = fingerprint[0]
+    kind = get_dataset_kind(dataset)
+    if kind == 'repository':
+        return TimeSeriesRepository.read_harvest_sums(dataset)
+    if kind == 'store':
+        return AggregateStore.read_store(dataset, 'harvest')
+    return WingDataIngest.load_wing_data(dataset, WingDataIngest.WING_DATA_COLUMNS)
+
+@functools.lru_cache(maxsize=DATASET_CACHE_SIZE)
+def _clean_harvest_dataset(fingerprint, species_colname):
+    '''
+    Cleans the species of the harvest data as HarvestTableGen does, keeping the values of species_colname before
+    cleaning in HarvestTableGen.RAW_SPECIES_COLNAME, so that group members are matched on them.
+    '''
+    df = _load_harvest_dataset(fingerprint).copy()
+    df = HarvestTableGen.keep_raw_species_column(df, species_colname)
+    return WingDataIngest.clean_species_columns(df)
+
+@functools.lru_cache(maxsize=DATASET_CACHE_SIZE)
+def _load_hunter_dataset(fingerprint):
+    ''' Loads the hunter estimates of a harvest estimates dataset, repository or aggregate store. '''
+    dataset = fingerprint[0]
+    kind = get_dataset_kind(dataset)
+    if kind == 'repository':
+        return TimeSeriesRepository.read_hunter_estimates(dataset)
+    if kind == 'store':
+        return AggregateStore.read_store(dataset, 'hunter')
+    return pd.read_csv(dataset)
+
+def load_harvest_dataset(dataset):
+    ''' Loads and cleans a harvest dataset into memory ahead of the queries, e.g. when a query service starts. '''
+    return _clean_harvest_dataset(get_dataset_fingerprint(dataset), 'species_aou')
+
+def load_hunter_dataset(dataset):
+    ''' Loads a hunter dataset into memory ahead of the queries. '''
+    return _load_hunter_dataset(get_dataset_fingerprint(dataset))
+
+def _resolve_seasons(df, season_colname, seasons):
+    ''' Returns the (start, end) season range, every season of the dataset when seasons is None. '''
+    if seasons is not None:
+        return (int(seasons[0]), int(seasons[1]))
+    return (int(df[season_colname].min()), int(df[season_colname].max()))
+
+@functools.lru_cache(maxsize=CUBE_CACHE_SIZE)
+def _get_harvest_cube(fingerprint, seasons, species_colname, group=None, members=None):
+    '''
+    Harvest cube of every species, shared by the harvest table queries of the same seasons. When a group is
+    given, the cube also holds the cells of the group, summed from its members before species cleaning.
+    '''
+    df = _clean_harvest_dataset(fingerprint, species_colname)
+    selected_species_groups_n_species = {group: list(members)} if group is not None else None
+    return HarvestTableGen.build_harvest_cube(df, seasons[0], seasons[1], species_colname, selected_species_groups_n_species)
+
+
+@functools.lru_cache(maxsize=CUBE_CACHE_SIZE)
+def _get_flyway_states(fingerprint, flyway):
+    ''' States with harvest records in the flyway, sorted. '''
+    df = _load_harvest_dataset(fingerprint)
+    states = df.loc[df['flyway_name'] == flyway, 'state'].dropna().unique()
+    return tuple(sorted(str(state) for state in states))
+
+def get_flyway_states(dataset, flyway):
+    ''' Returns the states with harvest records in the flyway, e.g. "Atlantic Flyway", which are its state columns. '''
+    return list(_get_flyway_states(get_dataset_fingerprint(dataset), flyway))
+
+
+''' ########### FUNCTIONS: Memoized Table Queries ########### '''
+
+@functools.lru_cache(maxsize=TABLE_CACHE_SIZE)
+def _calc_harvest_table(fingerprint, flyway, species, seasons, species_colname, period_width):
+    ''' Memoized harvest table calculation. species is a species or a tuple of species summed as a group. '''
+    seasons = _resolve_seasons(_load_harvest_dataset(fingerprint), 'Season', seasons)
+    if isinstance(species, tuple):
+        # Groups are matched on the species values of the dataset, as by the species options of HarvestTableGen.
+        group = 'is_' + '|'.join(species)
+        cube = _get_harvest_cube(fingerprint, seasons, species_colname, group, species)
+        species = group
+    else:
+        cube = _get_harvest_cube(fingerprint, seasons, species_colname)
+    return HarvestTableGen.calc_harvest_tabledata_by_species(cube, flyway, seasons[0], seasons[1], species, period_width)
+
+@functools.lru_cache(maxsize=TABLE_CACHE_SIZE)
+def _calc_hunter_table(fingerprint, flyway, group, metric, seasons, period_width, include_variance):
+    ''' Memoized hunter table calculation. '''
+    df = _load_hunter_dataset(fingerprint)
+    seasons = _resolve_seasons(df, 'season', seasons)
+    if get_dataset_kind(fingerprint[0]) == 'store':
+        # The aggregate store holds the aggregated estimates of every metric.
+        aggregate = HunterTableGen.store_to_aggregate(df, [metric], include_variance)
+        return HunterTableGen.calc_tabledata_from_aggregate(aggregate, flyway, seasons[0], seasons[1], group, metric,
+                                                            period_width=period_width, include_variance=include_variance)
+    return HunterTableGen.calc_tabledata_for_species_group(df, flyway, seasons[0], seasons[1], group, metric,
+                                                           period_width=period_width, include_variance=include_variance)
+
+def get_harvest_table(dataset, flyway, species, seasons=None, species_colname='species_aou', period_width=5):
+    '''
+    Returns the harvest table of a species or group of species, as generated by HarvestTableGen.
+
+    parameter dataset: Path to the wing survey CSV dataset, the SQLite repository or the harvest aggregate store.
+    parameter flyway: Name of the flyway, e.g. "Atlantic Flyway".
+    parameter species: Species AOU code or name, or a list of them summed together as a group.
+    parameter seasons: (start, end) season range. None selects every season of the dataset.
+    parameter species_colname: "species_aou" or "species_name", the column the species are given in.
+    parameter period_width: Width in years of the time periods of the averages.
+    returns (estimates DataFrame, time period averages DataFrame). Results are memoized per dataset version.
+    '''
+    if not isinstance(species, str):
+        species = tuple(species)
+    if seasons is not None:
+        seasons = (int(seasons[0]), int(seasons[1]))
+    table_df, averages_df = _calc_harvest_table(get_dataset_fingerprint(dataset), flyway, species, seasons,
+                                                species_colname, period_width)
+    # Callers get copies, the memoized tables are never modified.
+    return (table_df.copy(), averages_df.copy())
+
+def get_hunter_table(dataset, flyway, group, metric='active_hunters', seasons=None, period_width=5, include_variance=False):
+    '''
+    Returns the hunter table of a species group, as generated by HunterTableGen.
+
+    parameter dataset: Path to the harvest estimates CSV dataset, the SQLite repository or the hunter aggregate store.
+    parameter flyway: Flyway code, e.g. "AF".
+    parameter group: Species group, e.g. "ducks".
+    parameter metric: active_hunters, bag_per_hunter or days_hunted.
+    parameter seasons: (start, end) season range. None selects every season of the dataset.
+    parameter period_width: Width in years of the time periods of the averages.
+    parameter include_variance: Adds the variance and confidence interval columns of the flyway and US totals.
+    returns (estimates DataFrame, time period averages DataFrame). Results are memoized per dataset version.
+    '''
+    if seasons is not None:
+        seasons = (int(seasons[0]), int(seasons[1]))
+    table_df, averages_df = _calc_hunter_table(get_dataset_fingerprint(dataset), flyway, group, metric, seasons, period_width,
+                                               include_variance)
+    return (table_df.copy(), averages_df.copy())
+
+
+''' ########### FUNCTIONS: Memoization Control ########### '''
+
+_MEMOIZED_FUNCTIONS = [_calc_harvest_table, _calc_hunter_table, _get_harvest_cube, _get_flyway_states, _clean_harvest_dataset,
+                       _load_harvest_dataset, _load_hunter_dataset]
+
+def cache_info():
+    ''' Hits, misses and sizes of the memoization layers, by function name. '''
+    return {func.__name__: func.cache_info() for func in _MEMOIZED_FUNCTIONS}
+
+def clear_cache():
+    ''' Drops every memoized dataset, cube and table. '''
+    for func in _MEMOIZED_FUNCTIONS:
+        func.cache_clear()
@@ -1,10 +1,22 @@
 import click
+import os
 import re
 import pandas as pd
 import numpy as np
 import FlywayTables
-from openpyxl import Workbook
+import WingDataIngest
+import CompiledHarvest
+import AggregateStore
+import TimeSeriesRepository
+import PartitionedDataset
+import ResultCache
+import TableExport
+import ParallelTables
+import TimePeriods
+import PipelineMetrics
+import PipelineProfiler
 import pandas as pd
+import multiprocessing
 import sys
 
 ## Working code with verified totals
@@ -62,13 +74,48 @@ def extract_option_groups_n_species(option_input):
         return None
     return groups
 
+# Flyways with a Data Book, generated by --flyway all.
+DATA_BOOK_FLYWAYS = ['Atlantic Flyway', 'Mississippi Flyway', 'Central Flyway', 'Pacific Flyway']
+
+def parse_flyway_option(flyway):
+    ''' Parses the flyway option into a list of flyways. "all" selects every flyway with a Data Book. '''
+    if (flyway == 'all'):
+        return list(DATA_BOOK_FLYWAYS)
+    flyway_list = [x.strip() for x in flyway.split(',') if len(x.strip()) > 0]
+    if (len(flyway_list) <= 0):
+        print_fatal_exit("Invalid flyway parameter. Please refer to --help for more information.")
+    return flyway_list
+
+def parse_seasons_option(seasons):
+    ''' Parses the seasons option into a (start, end) tuple. Returns None for "all". '''
+    if (seasons == 'all'):
+        return None
+    if (re.match(r"^\d{4}:\d{4}$", seasons)):
+        seasons = seasons.split(':')
+        return (int(seasons[0]), int(seasons[1]))
+    print_fatal_exit("Invalid season parameter. Please refer to --help for more information.")
+
+def get_species_filter(species_name, species_aou):
+    '''
+    Species column and list of species selected by the species options, including the members of named groups.
+    returns (colname, species list), with a species list of None when every species is selected.
+    '''
+    if (species_aou == 'all' and species_name == 'all'):
+        return ('species_aou', None)
+    if (species_aou != 'all'):
+        selected_colname, selected_species_groups_n_species = 'species_aou', extract_option_groups_n_species(species_aou)
+    else:
+        selected_colname, selected_species_groups_n_species = 'species_name', extract_option_groups_n_species(species_name)
+    species = []
+    for members in selected_species_groups_n_species.values():
+        species += [members] if isinstance(members, str) else members
+    return (selected_colname, list(dict.fromkeys(species)))
+
 ''' ########### FUNCTIONS: Mapping species AOU codes to species names ########### '''
 
 def create_species_aou_to_name_dictionary(df):
-    lookup_table = df[['species_aou', 'species_name']].drop_duplicates()
-    # Convert the lookup table to a dictionary for faster lookup
-    aou_to_name_dict = pd.Series(lookup_table.species_name.values,index=lookup_table.species_aou).to_dict()
-    return aou_to_name_dict
+    ''' Dictionary of species AOU codes to species names, from the species dimension table of the dataset. '''
+    return WingDataIngest.get_species_names(WingDataIngest.build_species_dimension(df))
 
 def aou_to_species_name(species_aou, mapping_dict):
     """
@@ -87,32 +134,112 @@ def aou_to_species_name(species_aou, mapping_dict):
 
 ''' ########### FUNCTIONS: Calculate Harvest Data Total for Data Tables ########### '''
 
-def add_new_col_groups(df, selected_species_groups_n_species, selected_species_colname):
-    ''' Creates a new is_* column for each defined group of species.'''
-    new_groups = [(x, selected_species_groups_n_species[x]) for x in selected_species_groups_n_species if not isinstance(selected_species_groups_n_species[x], str)]
-    species = [x for x in selected_species_groups_n_species if isinstance(selected_species_groups_n_species[x], str)]
-    group_colnames = []
-    for ng in new_groups:
-        df[ng[0]] = df[selected_species_colname].apply(lambda x: 1 if x in ng[1] else 0)
-        group_colnames.append(ng[0])
-        print_info('Group ['+ng[0]+'] has '+str(df["is_Duck"].sum())+' values.')
-    return (df, group_colnames, species)
-    
+# Flyways including Alaska
+ALL_FLYWAYS = ['Atlantic Flyway', 'Mississippi Flyway', 'Pacific Flyway', 'Central Flyway', 'Alaska']
 
-# Sum harvest weights by flyway for the species
-def aggregate_harvest_by_flyway(df, season_start, season_end, species_or_group, selected_species_colname):
-    ''' Sum harvest weights by flyway for a species or group of species. '''
-    agg_df = df[
+# Copy of the selected species column holding the values of the dataset before species cleaning. The members of
+# named groups are matched on it, e.g. "Barrow's Goldeneye" or the CACG rows recoded to MCGO by the cleaning.
+RAW_SPECIES_COLNAME = 'raw_species'
+
+def keep_raw_species_column(df, selected_species_colname):
+    ''' Copies the selected species column to RAW_SPECIES_COLNAME, before the species columns are cleaned. '''
+    df[RAW_SPECIES_COLNAME] = df[selected_species_colname].copy()
+    return df
+
+def split_option_groups_n_species(selected_species_groups_n_species):
+    ''' Splits parsed species options into the list of named groups and the list of single species. '''
+    groups = [x for x in selected_species_groups_n_species if not isinstance(selected_species_groups_n_species[x], str)]
+    species = [x for x in selected_species_groups_n_species if isinstance(selected_species_groups_n_species[x], str)]
+    for g in groups:
+        print_info('Group ['+g+'] has species '+str(selected_species_groups_n_species[g])+'.')
+    return (groups, species)
+
+def build_group_membership_matrix(selected_species_groups_n_species, selected_species_colname):
+    '''
+    Builds the sparse species x group membership matrix of the named groups.
+
+    The matrix is kept in coordinate form, one (species, group) row per member species, so groups may
+    overlap and any number of groups costs only as much as their total number of members. Members are
+    the values of the species options, which are matched on the species values of the dataset before
+    cleaning (see RAW_SPECIES_COLNAME).
+    '''
+    pairs = []
+    if (selected_species_groups_n_species is not None):
+        for group in selected_species_groups_n_species:
+            members = selected_species_groups_n_species[group]
+            if not isinstance(members, str):
+                pairs += [(sp, group) for sp in dict.fromkeys(members)]
+    return pd.DataFrame(pairs, columns=[selected_species_colname, 'group'])
+
+def build_group_cube(cube, membership_matrix, selected_species_colname=None):
+    '''
+    Applies the membership matrix to the per-species cube, summing member species cells into group cells.
+
+    parameter cube: Cube indexed by the species column of the membership matrix.
+    parameter selected_species_colname: Index name of the group cube. Default is the index name of cube.
+    returns Cube with the same layout as the species cube, indexed by group.
+    '''
+    member_colname = cube.index.name
+    if selected_species_colname is None:
+        selected_species_colname = member_colname
+    # Members without cells would silently leave a partial group total.
+    unmatched = membership_matrix[~membership_matrix[member_colname].isin(cube.index)]
+    for member, group in zip(unmatched[member_colname], unmatched['group']):
+        print_error('Group ['+str(group)+'] member ['+str(member)+'] matches no harvest records of the selected seasons. '+
+                    'Check the spelling of the member, it is not counted in the group.')
+    group_cube = membership_matrix.merge(cube.reset_index(), on=member_colname, how='inner')
+    group_cube = group_cube.groupby(['group', 'Season', 'flyway_name', 'state'], dropna=False)['harvest_weight'].sum()
+    group_cube = group_cube.reset_index().rename(columns={'group': selected_species_colname})
+    return group_cube.set_index(selected_species_colname)
+
+def sum_harvest_cells(cube_df, species_colname):
+    ''' Sums harvest weights by species, season, flyway and state. Returns the cells indexed by species. '''
+    cube = cube_df.groupby([species_colname, 'Season', 'flyway_name', 'state'], observed=True, dropna=False)['harvest_weight'].sum()
+    cube = cube.reset_index()
+    # The cube is small, plain values keep pivots free of unused categories.
+    for colname in [species_colname, 'flyway_name', 'state']:
+        cube[colname] = cube[colname].astype(object)
+    return cube.set_index(species_colname)
+
+def build_harvest_cube(df, season_start, season_end, selected_species_colname, selected_species_groups_n_species=None):
+    '''
+    Sums harvest weights by species, season, flyway and state in a single pass over the dataset.
+
+    Only the flyways in ALL_FLYWAYS are kept. Records without a state are kept since they count
+    toward the flyway totals. Cells of the named groups are derived from the species cells with
+    the group membership matrix and added under the group name. When df has the RAW_SPECIES_COLNAME
+    column, the group members are matched on the species values before cleaning, from cells summed
+    by that column. The cube is indexed and sorted by species or group so that the data of a table
+    is sliced from it without scanning the dataset again.
+    '''
+    record = PipelineMetrics.start_stage('grouping', rows_in=len(df))
+    cube_df = df[
+        (df['flyway_name'].isin(ALL_FLYWAYS)) &
         (df['Season'] >= season_start) &
         (df['Season'] <= season_end)
     ]
-    if (species_or_group and species_or_group.startswith('is_')):
-        agg_df = agg_df[agg_df[species_or_group] == 1]
-    else:
-        agg_df = agg_df[agg_df[selected_species_colname] == species_or_group]
+    cube = sum_harvest_cells(cube_df, selected_species_colname)
+
+    member_colname = RAW_SPECIES_COLNAME if RAW_SPECIES_COLNAME in cube_df.columns else selected_species_colname
+    membership_matrix = build_group_membership_matrix(selected_species_groups_n_species, member_colname)
+    if (len(membership_matrix) > 0):
+        member_cube = cube if member_colname == selected_species_colname else sum_harvest_cells(cube_df, member_colname)
+        cube = pd.concat([cube, build_group_cube(member_cube, membership_matrix, selected_species_colname)])
+
+    cube = cube.sort_index()
+    PipelineMetrics.end_stage(record, rows_out=len(cube))
+    return cube
+
+def slice_harvest_cube(cube, species_or_group):
+    ''' Returns the cube cells of the given species or group. '''
+    return cube.loc[cube.index.intersection([species_or_group])]
+
+# Sum harvest weights by flyway for the species
+def aggregate_harvest_by_flyway(species_cube):
+    ''' Sum harvest weights by flyway for a species or group of species. '''
 
     # Create a pivot table to sum harvest weights by flyway and season
-    pivot_df = agg_df.pivot_table(
+    pivot_df = species_cube.pivot_table(
         values='harvest_weight',        # The data that needs to be aggregated
         index='Season',                 # Rows (here grouped by 'Season')
         columns='flyway_name',          # Columns will be created for each flyway
@@ -121,40 +248,26 @@ def aggregate_harvest_by_flyway(df, season_start, season_end, species_or_group,
     ).astype(int)
 
     # Round to the nearest hundred
-    pivot_df = pivot_df.applymap(lambda x: round(x, -2))
+    pivot_df = pivot_df.round(-2)
 
     # Ensure all expected flyways are represented in the columns, even if no data exists for them
-    all_flyways = ['Atlantic Flyway', 'Mississippi Flyway', 'Pacific Flyway', 'Central Flyway', 'Alaska']
-    for flyway in all_flyways:
+    for flyway in ALL_FLYWAYS:
         if flyway not in pivot_df.columns:
             pivot_df[flyway] = 0
 
     # Reorder columns to ensure consistent order, regardless of the data present
-    pivot_df = pivot_df[all_flyways]
+    pivot_df = pivot_df[ALL_FLYWAYS]
 
     #Ensure 'Season' is a column
     pivot_df.reset_index(inplace=True)
 
     return pivot_df
     
-def aggregate_harvest_by_species_by_flyway(df, flyway, season_start, season_end, species_or_group, selected_species_colname):
+def aggregate_harvest_by_species_by_flyway(species_cube, flyway):
     ''' Sums the harvest by species or group and by state for given flyway. '''
 
-    ALL_FLYWAYS = ['Atlantic Flyway', 'Mississippi Flyway', 'Pacific Flyway', 'Central Flyway', 'Alaska']
-
-    flyway_df = df[
-        (df['flyway_name'].isin(ALL_FLYWAYS)) &
-        (df['Season'] >= season_start) &
-        (df['Season'] <= season_end)
-    ]
-    if (species_or_group and species_or_group.startswith('is_')):
-        print_info('Calculating for group '+species_or_group)
-        flyway_df = flyway_df[flyway_df[species_or_group] == 1]
-    else:
-        flyway_df = flyway_df[flyway_df[selected_species_colname] == species_or_group]
-
     #create pivot table
-    flyway_pivot = flyway_df.pivot_table(
+    flyway_pivot = species_cube.pivot_table(
         values='harvest_weight',
         index='Season',
         columns='state',
@@ -164,7 +277,7 @@ def aggregate_harvest_by_species_by_flyway(df, flyway, season_start, season_end,
     ).astype(int)
 
     # Round to the nearest hundred
-    flyway_pivot = flyway_pivot.applymap(lambda x: round(x, -2))
+    flyway_pivot = flyway_pivot.round(-2)
   
     # Ensure 'Season' is a column
     flyway_pivot.reset_index(inplace=True)
@@ -172,12 +285,15 @@ def aggregate_harvest_by_species_by_flyway(df, flyway, season_start, season_end,
     return flyway_pivot
 
 
-def calc_harvest_tabledata_by_species(df, flyway, season_start, season_end, species_or_group, selected_species_colname):
-    ''' Calculates the complete harvest table data by species. '''
+def calc_harvest_tabledata_by_species(cube, flyway, season_start, season_end, species_or_group, period_width=5):
+    ''' Calculates the complete harvest table data by species from the harvest cube. '''
 
-    total_species_data = aggregate_harvest_by_species_by_flyway(df, flyway, season_start, season_end, species_or_group, selected_species_colname)
+    record = PipelineMetrics.start_stage('table_data', species_or_group, rows_in=len(cube))
+    species_cube = slice_harvest_cube(cube, species_or_group)
+
+    total_species_data = aggregate_harvest_by_species_by_flyway(species_cube, flyway)
     
-    flyway_data = aggregate_harvest_by_flyway(df, season_start, season_end, species_or_group, selected_species_colname)
+    flyway_data = aggregate_harvest_by_flyway(species_cube)
     
     # Ensure that both DataFrames are indexed by 'Season'
     if 'Season' not in total_species_data.columns:
@@ -191,9 +307,6 @@ def calc_harvest_tabledata_by_species(df, flyway, season_start, season_end, spec
     # Fill any missing values which might be caused by left join
     total_species_data.fillna(0, inplace=True)
 
-    # Flyways including Alaska
-    ALL_FLYWAYS = ['Atlantic Flyway', 'Mississippi Flyway', 'Pacific Flyway', 'Central Flyway', 'Alaska']
-
     for column in ALL_FLYWAYS:
         if column not in total_species_data.columns:
             total_species_data[column] = 0
@@ -201,14 +314,9 @@ def calc_harvest_tabledata_by_species(df, flyway, season_start, season_end, spec
     # Sum the flyway columns to create a new 'US' column
     total_species_data['US'] = total_species_data[ALL_FLYWAYS].sum(axis=1)
 
-    #total_species_data['US'] = pd.concat(total_species_data[ALL_FLYWAYS], axis=1).sum(axis=1).astype(int)
-
-    print_info("Calculating flyway sum data for species: "+species_or_group)
-
-    print_info("Calculating time period averages data for species: "+species_or_group)
-
     # Calculate time period averages
-    time_period_averages = calc_time_period_averages(total_species_data, season_start, season_end)
+    time_period_averages = TimePeriods.calc_period_averages(total_species_data, 'Season', season_start, season_end, period_width)
+    PipelineMetrics.end_stage(record, rows_out=len(total_species_data))
        
     # Returning both the species totals and time period averages data
     return (total_species_data, time_period_averages)
@@ -225,149 +333,138 @@ def join_np_arrays(a_df, b_arr, flyway_colname):
     a_df[flyway_colname] = new_col
     return a_df
 
-def calc_harvest_tabledata_multiple_species(df, flyway, season_start, season_end, species_or_group_list, selected_species_colname):
+def calc_harvest_tabledata_multiple_species(df, flyway, season_start, season_end, species_or_group_list, selected_species_colname,
+                                            selected_species_groups_n_species=None, workers=1, period_width=5):
     ''' Interate through a list of groups or species to generate a list of harvest table data results.'''
     
-    data_results_arr = []
+    # Single pass over the dataset, every table below is sliced from the cube.
+    cube = build_harvest_cube(df, season_start, season_end, selected_species_colname, selected_species_groups_n_species)
+
+    species_names = []
+    table_args_list = []
     species_name = None
+    # Species names are resolved from the species dimension table, built once for all tables.
+    aou_to_name_dict = create_species_aou_to_name_dictionary(df) if selected_species_colname == 'species_aou' else None
     for sp in species_or_group_list:
         if (sp and sp.startswith('is_')):
             # Removing the is_ part from the group.
             species_name = sp[3:]
         elif (sp and selected_species_colname == 'species_aou'and sp.startswith('is_') is False):
-            species_name = aou_to_species_name(sp, create_species_aou_to_name_dictionary(df))
+            species_name = aou_to_species_name(sp, aou_to_name_dict)
         else:
             species_name = sp
        
-        print_info("Calculating harvest data for species: "+species_name)
-        results = calc_harvest_tabledata_by_species(df, flyway, season_start, season_end, sp, selected_species_colname)
-        data_results_arr.append((species_name, flyway, results[0], results[1]))
-    return data_results_arr
-
-''' ########### FUNCTIONS: Calculate Harvest Data Time Period Averages for Data Tables ########### '''
-
-def find_next_year_ending_in_0_or_5(year):
-    ''' Determine the next year ending in 0 or 5 for time period end.'''
-    while year % 5 != 0:
-        year += 1
-    return year
-
-def calc_time_period_averages(species_pivot, first_year, last_year):
-    ''' Calculate time periods and their averages for data table. '''
-    # Calculate the first period's end year to end with 0 or 5
-    first_period_end_year = find_next_year_ending_in_0_or_5(first_year)
-
-    # Initialize time periods dictionary
-    time_periods = {}
-    if first_period_end_year > first_year:
-        time_periods[f"{first_year}-{first_period_end_year}"] = (first_year, first_period_end_year)
-
-    # generate subsequent 5-year periods
-    start_year = first_period_end_year + 1
-    while start_year <= last_year:
-        end_year = start_year + 4
-        if end_year > last_year or (end_year % 10 != 0 and end_year % 10 != 5):
-            end_year = find_next_year_ending_in_0_or_5(last_year)
-            if end_year > last_year:
-                end_year = last_year
-        period_label = f'{start_year}-{end_year}'
-        time_periods[period_label] = (start_year, end_year)
-        start_year = end_year + 1
-
-    # Calculate averages for each time period and create a DataFrame for them
-    averages_rows = []
-    for label, (start_year, end_year) in time_periods.items():
-        # Select the data for the time period
-        if 'Season' in species_pivot.columns:
-            period_data = species_pivot[(species_pivot['Season'] >= start_year) & (species_pivot['Season'] <= end_year)]
-        else:
-            print("Season column is missing.")
-
-        #period_data = species_pivot.loc[start_year:end_year]
-             
-        # Calculate the mean for each column
-        averages = period_data.mean().fillna(0).round(0).astype(int)
-        averages_df = averages.to_frame().T
-        averages_df.index = [label]  # Set the label for the averages row
-        averages_rows.append(averages_df)
-        
-    # Concatenate the averages rows into a single DataFrame
-    final_averages_df = pd.concat(averages_rows)
-    #final_averages_df.set_index('Season', inplace=True)
-
-    final_averages_df['Season'] = final_averages_df.index
+        species_names.append(species_name)
+        table_args_list.append((flyway, season_start, season_end, sp, period_width))
 
-    return final_averages_df
+    # Tables are calculated from the cube, in worker processes when workers > 1.
+    all_results = ParallelTables.map_tables(calc_harvest_tabledata_by_species, cube, table_args_list, workers)
 
+    data_results_arr = []
+    for species_name, results in zip(species_names, all_results):
+        data_results_arr.append((species_name, flyway, results[0], results[1]))
+    return data_results_arr
 
 ''' ########### FUNCTIONS: Excel Table Generation ########### '''
 
-def generate_excel_workbook_for_multiple_species(table_data_results_list):
-    # Creating a new workbook
-    wb = Workbook()
-
-    # Removing the default 'Sheet'
-    del wb['Sheet']
+def generate_excel_workbook_for_multiple_species(table_data_results_list, write_only=False, moving_average_windows=None,
+                                                  long_term_average=False, excel_engine='openpyxl'):
+    ''' Builds the table sheets of every species or group and saves the workbook once. '''
+    if (len(table_data_results_list) <= 0):
+        print_error('No table data to write to the Excel workbook.')
+        return
 
+    table_list = []
     for result in table_data_results_list:
         species_name = result[0]
         flyway = result[1]
-        harvest_estimate_data = result[2]
-        period_averages = result[3]
+        # Tables may be shared between flyway workbooks, write copies of them.
+        harvest_estimate_data = result[2].copy()
+        period_averages = result[3].copy()
 
         asterisk_text_list = ['* Preliminary Estimate', \
                               '** For flyway estimates prior to 2015 please see the flyway-specific databook']
         
 
-        table_title = 'Estimates of '+species_name+' Harvest in the '+flyway
-        FlywayTables.create_table_to_ws(wb, harvest_estimate_data, period_averages, asterisk_text_list, table_title, species_name)
-            
-        workbook_name = flyway+' Tables.xlsx'
-        wb.save(workbook_name)
-    print_info('Completed Excel workbook file ['+workbook_name+']')
-
-
-''' ########### FUNCTIONS: Printing Output ########### '''
-
-def print_info(output_str):
-    click.echo("[INFO] " + str(output_str))
-
-def print_error(output_str):
-    click.echo("[ERROR] " + str(output_str))
-
-def print_fatal_exit(output_str):
-    click.echo("[FATAL] " + str(output_str))
-    click.echo("[FATAL] Exiting now...")
-    sys.exit()
+        summary_sections = TimePeriods.calc_summary_sections(harvest_estimate_data, 'Season', moving_average_windows, long_term_average)
 
+        table_title = 'Estimates of '+species_name+' Harvest in the '+flyway
+        table_list.append((harvest_estimate_data, period_averages, asterisk_text_list, table_title, species_name, summary_sections))
 
+    workbook_name = flyway+' Tables.xlsx'
+    FlywayTables.write_tables_to_workbook(workbook_name, table_list, write_only, excel_engine)
 
 
-''' ########### MAIN FUNCTION ########### '''
+''' ########### FUNCTIONS: Machine-readable Table Export ########### '''
 
-@click.command()
-@click.argument('filename', required=1, type=click.Path(exists=True))
-@click.option('--flyway', default='Atlantic Flyway', help='Name of the flyway. Options are Atlantic Flyway, Mississipi Flyway, \
-                Central Flyway, Pacific Flyway. Default is "Atlantic Flyway".')
-@click.option('--seasons', default='all', help='Season range to generate. Use the notation <START>:<END>. E.g. 1999:2021. Default is ALL.')
-@click.option('--species_name', default='all', help='A comma seperated list of species or grouping of species to generate tables. \
-              Multiple species can be combined together into a named group using the notation \
-              <GROUP_NAME>:(<SPECIES#1>, <SPECIES#2>, <SPECIES#3>). E.g. "Duck:(Mallard|American Black Duck|Wigeon)". \
-              Values are case sensitive. Default is ALL.')
-@click.option('--species_aou', default='all', help='A comma seperated list of species AOU or grouping of AOU to generate tables. \
-              sMultiple species can be combined together into a named group using the notation <GROUP_NAME>:(<AOU#1>, <AOU#2>, <AOU#3>). \
-              E.g. "Duck:(ABDU|AGWT|AMWI|COGO|BAGO),BBWD,STEI". \
-              Values are case sensitive. Default is ALL. \
-              If both Species and Species AOU options are used, Species AOU will take precedent. Default is ALL.')
-# @click.option('--columns', default=None, help='A comma seperated list of custom column name mappings to overwrite the default. \
-#               Use the mapping notation <Column Key>:<Column Name>. Values are case sensitive. \
-#               Default column keys and names are "season,flyway_name,state,species_name,species_aou,harvest_weight".')
-def main(flyway, seasons, species_name, species_aou, filename):
+def export_tables_for_multiple_species(table_data_results_list, flyway_list, output_format, moving_average_windows=None,
+                                       long_term_average=False):
+    '''
+    Writes the tables of every species or group to one long format file.
 
-    print_info("###### Welcome to Harvest Table Generation #######")
+    The harvest tables cover every state and flyway, and the flyway workbooks differ only by their titles, so
+    each table is written once and not once per flyway.
+    '''
+    if (len(table_data_results_list) <= 0):
+        print_error('No table data to export.')
+        return
 
-    # Processing and parsing options
-    sdf = pd.read_csv(filename)
+    table_list = []
+    for result in table_data_results_list:
+        summary_sections = TimePeriods.calc_summary_sections(result[2], 'Season', moving_average_windows, long_term_average)
+        table_list.append(({'species': result[0]}, result[2], result[3], summary_sections))
+
+    export_name = flyway_list[0]+' Tables' if len(flyway_list) == 1 else 'Flyway Tables'
+    TableExport.write_tables(export_name, table_list, 'Season', output_format)
+
+
+''' ########### FUNCTIONS: Loading and Calculating Tables ########### '''
+
+def load_and_calc_harvest_tables(filename, flyway, seasons, species_name, species_aou, cache, streaming, chunksize, compiled, workers,
+                                 period_width, store, append_season, repository, partitioned):
+    ''' Loads the dataset and calculates the table data of every selected species. Returns the table data results. '''
+    ingest_record = PipelineMetrics.start_stage('ingest')
+    if (repository is not None):
+        if (append_season is not None):
+            print_fatal_exit('Option --append_season reads the new season from a dataset FILENAME and cannot be used with --repository.')
+        species_colname, species_filter = get_species_filter(species_name, species_aou)
+        sdf = TimeSeriesRepository.read_harvest_sums(repository, parse_seasons_option(seasons), ALL_FLYWAYS,
+                                                     species_colname, species_filter)
+        if (len(sdf) <= 0):
+            print_fatal_exit('Repository '+repository+' has no harvest sums of the selected seasons and species.')
+        filename = repository
+    elif (partitioned is not None):
+        if (append_season is not None):
+            print_fatal_exit('Option --append_season reads the new season from a dataset FILENAME and cannot be used with --partitioned.')
+        # The season range and the flyways select the partition files.
+        sdf = PartitionedDataset.read_harvest_data(partitioned, parse_seasons_option(seasons), ALL_FLYWAYS)
+        if (len(sdf) <= 0):
+            print_fatal_exit('Partitioned dataset '+partitioned+' has no wing records of the selected seasons.')
+        filename = partitioned
+    elif (append_season is not None):
+        if (store is None):
+            print_fatal_exit('Option --append_season requires the path of the aggregate store with --store.')
+        store_df = AggregateStore.read_store(store, 'harvest')
+        # Only the rows of the new season are read from the dataset.
+        season_sums = WingDataIngest.stream_wing_data_sums(filename, chunksize, season=append_season)
+        if (len(season_sums) <= 0):
+            print_fatal_exit('Dataset '+filename+' has no rows of season '+str(append_season)+'.')
+        sdf = AggregateStore.merge_season(store_df, season_sums, 'Season', append_season)
+        AggregateStore.write_store(sdf, store, 'harvest', 'Season')
+    elif (compiled):
+        sdf = CompiledHarvest.read_harvest_sums(filename, parse_seasons_option(seasons))
+    elif (streaming):
+        sdf = WingDataIngest.stream_wing_data_sums(filename, chunksize)
+    else:
+        sdf = WingDataIngest.load_wing_data(filename, WingDataIngest.WING_DATA_COLUMNS, use_cache=cache)
+    PipelineMetrics.end_stage(ingest_record, rows_out=len(sdf))
+
+    if (store is not None and append_season is None):
+        with PipelineMetrics.stage('store_write', rows_in=len(sdf)) as record:
+            # The store keeps the harvest sums, which give the same tables as the wing records.
+            sdf = WingDataIngest.reduce_harvest_sums(sdf)
+            AggregateStore.write_store(sdf, store, 'harvest', 'Season')
+            record['rows_out'] = len(sdf)
     print_info('Dataset '+filename+' is now stored in a Pandas Dataframe.') 
     print_info('Dataset column names='+str(sdf.columns))
 
@@ -375,13 +472,8 @@ def main(flyway, seasons, species_name, species_aou, filename):
         print_fatal_exit('Invalid column name(s) in dataset.')
         sys.exit()
 
-    if (seasons != 'all'):
-            if (re.match(r"^\d{4}:\d{4}$", seasons)):
-                seasons = seasons.split(':')
-                seasons = (int(seasons[0]), int(seasons[1]))
-            else:
-                print_fatal_exit("Invalid season parameter. Please refer to --help for more information.")
-    else: 
+    seasons = parse_seasons_option(seasons)
+    if (seasons is None):
         all_seasons = sdf['Season'].unique()
         all_seasons.sort()
         seasons = (int(all_seasons[0]), int(all_seasons[-1]))
@@ -394,13 +486,13 @@ def main(flyway, seasons, species_name, species_aou, filename):
         selected_species_groups_n_species = extract_option_groups_n_species(species_aou)
         selected_species_colname = 'species_aou'
         # Add new groups, if any.
-        sdf, new_groups, species = add_new_col_groups(sdf, selected_species_groups_n_species, selected_species_colname)
+        new_groups, species = split_option_groups_n_species(selected_species_groups_n_species)
         selected_species_list =  new_groups + species
     elif (species_name != 'all'):
         selected_species_groups_n_species = extract_option_groups_n_species(species_name)
         selected_species_colname = 'species_name'
         # Add new groups, if any.
-        sdf, new_groups, species = add_new_col_groups(sdf, selected_species_groups_n_species, selected_species_colname)
+        new_groups, species = split_option_groups_n_species(selected_species_groups_n_species)
         selected_species_list =  new_groups + species
     else:
         selected_species_colname = 'species_aou'
@@ -408,25 +500,182 @@ def main(flyway, seasons, species_name, species_aou, filename):
         # Remove nan values
         selected_species_list = selected_species_list[~pd.isnull(selected_species_list)]
 
-    # Cleaning: update 'species_aou' and 'species_name' where 'aou_number' equals 1722
-    sdf.loc[sdf['AOU_number'] == 1722, ['species_aou', 'species_name']] = 'MCGO', 'Minima Cackling Goose'
-
-    # Replace any punctuation in 'species_name' with '_'
-    sdf['species_name'] = sdf['species_name'].str.replace(r'[^\w\s]', '_', regex=True)
+    with PipelineMetrics.stage('clean', rows_in=len(sdf)):
+        if (selected_species_groups_n_species is not None and
+            any(not isinstance(members, str) for members in selected_species_groups_n_species.values())):
+            # Named groups are matched on the species values of the dataset, as before cleaning.
+            sdf = keep_raw_species_column(sdf, selected_species_colname)
+        sdf = WingDataIngest.clean_species_columns(sdf)
 
     # Printing parsed input options
     print_info('Parsed Input Options:')
     print_info('Seasons='+str(seasons))
-    print_info('Flyway='+flyway)
+    flyway_list = parse_flyway_option(flyway)
+    print_info('Flyway='+str(flyway_list))
     print_info('Selected Species='+str(selected_species_list))
     print_info('Selected Species Column='+str(selected_species_colname))
 
-    big_results = calc_harvest_tabledata_multiple_species(sdf, flyway, seasons[0], seasons[1], selected_species_list, selected_species_colname)
+    # The harvest tables cover every state and flyway, so they are calculated once for all flyway workbooks.
+    big_results = calc_harvest_tabledata_multiple_species(sdf, flyway_list[0], seasons[0], seasons[1], selected_species_list, selected_species_colname,
+                                                          selected_species_groups_n_species, workers, period_width)
+    return big_results
+
+def get_result_cache_key(result_cache, filename, repository, partitioned, seasons, species_name, species_aou, period_width):
+    '''
+    Key of the table data results in the result cache, from the content of the input and the options the results
+    depend on. The flyways and the workbook options are left out, the same results serve every flyway workbook.
+    '''
+    if (repository is not None):
+        input_path = repository
+    elif (partitioned is not None):
+        input_path = os.path.join(partitioned, 'harvest', PartitionedDataset.META_FILENAME)
+    else:
+        input_path = filename
+    species_options = {'species_aou': species_aou} if species_aou != 'all' else {'species_name': species_name}
+    species_options = {colname: list(extract_option_groups_n_species(value).items()) if value != 'all' else value
+                       for colname, value in species_options.items()}
+    options = dict(species_options, seasons=parse_seasons_option(seasons), period_width=period_width)
+    return ResultCache.get_result_key(result_cache, 'HarvestTableGen', input_path, options)
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
+
+def print_fatal_exit(output_str):
+    click.echo("[FATAL] " + str(output_str))
+    click.echo("[FATAL] Exiting now...")
+    sys.exit()
+
+
+
+
+''' ########### MAIN FUNCTION ########### '''
+
+@click.command()
+@click.argument('filename', required=0, type=click.Path(exists=True))
+@click.option('--flyway', default='Atlantic Flyway', help='Name of the flyway. Options are Atlantic Flyway, Mississipi Flyway, \
+                Central Flyway, Pacific Flyway. A comma seperated list of flyways, or "all" for the four flyways, generates one \
+                workbook per flyway from a single load of the dataset. Default is "Atlantic Flyway".')
+@click.option('--seasons', default='all', help='Season range to generate. Use the notation <START>:<END>. E.g. 1999:2021. Default is ALL.')
+@click.option('--species_name', default='all', help='A comma seperated list of species or grouping of species to generate tables. \
+              Multiple species can be combined together into a named group using the notation \
+              <GROUP_NAME>:(<SPECIES#1>, <SPECIES#2>, <SPECIES#3>). E.g. "Duck:(Mallard|American Black Duck|Wigeon)". \
+              Values are case sensitive. Default is ALL.')
+@click.option('--species_aou', default='all', help='A comma seperated list of species AOU or grouping of AOU to generate tables. \
+              sMultiple species can be combined together into a named group using the notation <GROUP_NAME>:(<AOU#1>, <AOU#2>, <AOU#3>). \
+              E.g. "Duck:(ABDU|AGWT|AMWI|COGO|BAGO),BBWD,STEI". \
+              Values are case sensitive. Default is ALL. \
+              If both Species and Species AOU options are used, Species AOU will take precedent. Default is ALL.')
+# @click.option('--columns', default=None, help='A comma seperated list of custom column name mappings to overwrite the default. \
+#               Use the mapping notation <Column Key>:<Column Name>. Values are case sensitive. \
+#               Default column keys and names are "season,flyway_name,state,species_name,species_aou,harvest_weight".')
+@click.option('--cache/--no-cache', default=True, help='Convert the CSV dataset once into a typed, columnar Parquet cache next to \
+              the dataset and read the cache on later runs. The cache is rebuilt when the dataset changes. Default is --cache.')
+@click.option('--streaming', is_flag=True, default=False, help='Read the CSV dataset in bounded chunks and reduce each chunk to \
+              harvest sums instead of loading the whole dataset into memory. Use for datasets larger than memory.')
+@click.option('--chunksize', default=1000000, type=click.IntRange(min=1), help='Number of CSV rows read at a time in --streaming mode. \
+              Default is 1000000.')
+@click.option('--compiled', is_flag=True, default=False, help='Compile the CSV dataset once into integer coded, memory-mapped \
+              NumPy arrays next to the dataset, and sum the harvest from the arrays on later runs. The compiled dataset is \
+              rebuilt when the dataset changes.')
+@click.option('--output_format', '--output-format', default='excel', type=click.Choice(TableExport.OUTPUT_FORMATS), help='Format \
+              of the generated tables. "excel" writes the Excel workbooks. "csv", "parquet" and "json" write every table and its \
+              averages to one long format file per run, one row per table cell, without building any workbook. Default is excel.')
+@click.option('--write_only', is_flag=True, default=False, help='Write the Excel workbook in openpyxl write-only mode, which streams \
+              rows to the file in near-constant memory. Use for workbooks with many tables.')
+@click.option('--excel_engine', '--excel-engine', default='openpyxl', type=click.Choice(FlywayTables.EXCEL_ENGINES), help='Writer \
+              of the Excel workbooks. "xlsxwriter" streams every row to the file in constant memory with the same tables and \
+              styles, and is faster for workbooks with many tables. Requires the XlsxWriter package. Default is openpyxl.')
+@click.option('--workers', default=1, type=click.IntRange(min=1), help='Number of worker processes calculating the species \
+              and group tables in parallel. Default is 1.')
+@click.option('--period_width', default=5, type=click.IntRange(min=1), help='Width in years of the time periods in the Averages \
+              section, e.g. 5 or 10. Periods end on years that are a multiple of the width. Default is 5.')
+@click.option('--moving_averages', default=None, help='A comma seperated list of moving average widths in years, e.g. 3,5,10. \
+              Adds a moving averages section per width to every table. Default is no moving averages.')
+@click.option('--long_term_average', is_flag=True, default=False, help='Adds a long-term average section, the average of every \
+              season of the table, to every table.')
+@click.option('--store', default=None, type=click.Path(dir_okay=False), help='Path of the persisted aggregate store (Parquet) \
+              holding the harvest sums by season, flyway, state and species. The store is built from the whole dataset, \
+              or updated with --append_season.')
+@click.option('--append_season', '--append-season', default=None, type=int, help='Season to append to the aggregate store, e.g. 2023. \
+              Only the rows of this season are read from the dataset and merged into the --store, replacing any stored \
+              sums of the season, and the tables are generated from the store.')
+@click.option('--repository', default=None, type=click.Path(exists=True, dir_okay=False), help='Path of the SQLite time series \
+              repository created by TimeSeriesRepository. The harvest sums of the selected seasons and species are read from \
+              the repository with indexed lookups, and no dataset FILENAME is needed.')
+@click.option('--partitioned', default=None, type=click.Path(exists=True, file_okay=False), help='Path of the season and flyway \
+              partitioned dataset directory created by PartitionedDataset. Only the partitions of the selected seasons and of \
+              the flyways are read, and no dataset FILENAME is needed.')
+@click.option('--result_cache', '--result-cache', default=None, type=click.Path(file_okay=False), help='Directory of the result \
+              cache. The table data is cached under a hash of the content of the input and of the options it depends on, and \
+              a run with an unchanged input and options skips straight to writing the workbooks.')
+@click.option('--result_cache_size', '--result-cache-size', default=ResultCache.DEFAULT_CACHE_SIZE_MB, type=click.IntRange(min=0), \
+              help='Size cap of the result cache in megabytes. The least recently used results are removed first. Default is 512.')
+@click.option('--metrics_json', '--metrics-json', default=None, type=click.Path(dir_okay=False), help='Path of a JSON file \
+              receiving the wall time, CPU time, peak resident memory and rows in and out of every stage of the run, by \
+              species and sheet, for monitoring.')
+@click.option('--profile', default=None, type=click.Path(file_okay=False), help='Directory receiving a profile of every stage, \
+              by species and sheet, as a pstats file and a collapsed stack file for flamegraph tools, plus the combined \
+              profile of the run. Profiling slows the run down.')
+def main(flyway, seasons, species_name, species_aou, cache, streaming, chunksize, compiled, output_format, write_only, excel_engine, workers,
+         period_width, moving_averages, long_term_average, store, append_season, repository, partitioned, result_cache, result_cache_size,
+         metrics_json, profile, filename):
+
+    print_info("###### Welcome to Harvest Table Generation #######")
+    PipelineMetrics.reset_metrics()
+    if (profile is not None):
+        PipelineProfiler.enable_profiling(profile, clear=True)
+
+    moving_average_windows = None
+    if (moving_averages is not None):
+        moving_average_windows = TimePeriods.parse_moving_average_windows(moving_averages)
+        if (moving_average_windows is None):
+            print_fatal_exit("Invalid moving_averages parameter. Please refer to --help for more information.")
+
+    # Processing and parsing options
+    if (filename is None and repository is None and partitioned is None):
+        print_fatal_exit('Missing dataset FILENAME, --repository or --partitioned. Please refer to --help for more information.')
+
+    flyway_list = parse_flyway_option(flyway)
+    big_results = None
+    result_key = None
+    if (result_cache is not None and store is not None):
+        print_info('Result cache is not used with --store, the store is written by the run.')
+    elif (result_cache is not None):
+        with PipelineMetrics.stage('result_cache'):
+            result_key = get_result_cache_key(result_cache, filename, repository, partitioned, seasons, species_name, species_aou,
+                                              period_width)
+            big_results = ResultCache.read_result(result_cache, result_key)
+
+    if (big_results is None):
+        big_results = load_and_calc_harvest_tables(filename, flyway, seasons, species_name, species_aou, cache, streaming, chunksize,
+                                                   compiled, workers, period_width, store, append_season, repository, partitioned)
+        if (result_key is not None):
+            ResultCache.write_result(result_cache, result_key, big_results, result_cache_size)
+
+    if (output_format != 'excel'):
+        # One long format file holds the tables of every flyway, no workbook is built.
+        export_tables_for_multiple_species(big_results, flyway_list, output_format, moving_average_windows, long_term_average)
+    else:
+        for fw in flyway_list:
+            flyway_results = [(result[0], fw, result[2], result[3]) for result in big_results]
+            # Genernating Excel workbook tables from all results.
+            generate_excel_workbook_for_multiple_species(flyway_results, write_only, moving_average_windows, long_term_average,
+                                                          excel_engine)
 
-    # Genernating Excel workbook tables from all results.
-    generate_excel_workbook_for_multiple_species(big_results)
+    if (metrics_json is not None):
+        PipelineMetrics.write_metrics_json(metrics_json, 'HarvestTableGen', click.get_current_context().params)
+    if (profile is not None):
+        PipelineProfiler.write_run_profile()
 
 
 if __name__ == '__main__':
     ''' Program entry point '''
+    # Needed by worker processes of the Windows executable.
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -1,10 +1,20 @@
 import click
+import os
 import re
 import pandas as pd
 import numpy as np
 import FlywayTables
-from openpyxl import Workbook
+import ParallelTables
+import AggregateStore
+import TimeSeriesRepository
+import PartitionedDataset
+import ResultCache
+import TableExport
+import TimePeriods
+import PipelineMetrics
+import PipelineProfiler
 import pandas as pd
+import multiprocessing
 import sys
 import warnings
 warnings.filterwarnings('ignore')
@@ -41,58 +51,247 @@ def validate_column_names(df):
     return True
 
 
-''' ########### FUNCTIONS: Calculate Harvest Data Total for Data Tables ########### '''
+# Flyways summed into the US total. Alaska is included in the US total but not shown as a column.
+ALL_FLYWAYS = ['AF', 'MF', 'PF', 'CF', 'AK']
+
+# Flyways with a Data Book, generated by --flyway all.
+DATA_BOOK_FLYWAYS = ['AF', 'MF', 'CF', 'PF']
+
+def parse_flyway_option(flyway):
+    ''' Parses the flyway option into a list of flyways. "all" selects every flyway with a Data Book. '''
+    if (flyway == 'all'):
+        return list(DATA_BOOK_FLYWAYS)
+    flyway_list = [x.strip() for x in flyway.split(',') if len(x.strip()) > 0]
+    if (len(flyway_list) <= 0):
+        print_fatal_exit("Invalid flyway parameter value. Please refer to --help for more information.")
+    return flyway_list
+
+def parse_seasons_option(seasons):
+    ''' Parses the seasons option into a (start, end) tuple. Returns None for "all". '''
+    if (seasons == 'all'):
+        return None
+    if (re.match(r"^\d{4}:\d{4}$", seasons)):
+        seasons = seasons.split(':')
+        return (int(seasons[0]), int(seasons[1]))
+    print_fatal_exit("Invalid season parameter value. Please refer to --help for more information.")
+
+def get_read_seasons(seasons):
+    ''' Season range read from a dataset for the seasons option. The state columns of a table always need STATE_TABLE_SEASONS. '''
+    if (seasons is None):
+        return None
+    return (min(seasons[0], STATE_TABLE_SEASONS[0]), max(seasons[1], STATE_TABLE_SEASONS[1]))
+
+def parse_species_group_option(species_group):
+    ''' Parses the species group option into a list of species groups. "all" returns None, every group of the dataset. '''
+    if (species_group == 'all'):
+        return None
+    return [x.strip() for x in species_group.split(',') if len(x.strip()) > 0]
 
-def find_next_year_ending_in_0_or_5(year):
-    while year % 5 != 0:
-        year += 1
-    return year
 
-# Define a function to sum values by year for a specified flyway
-def sum_values_by_flyway(df, flyway, season_start, season_end, species_group, aggregate_on):
-    flyway_df = df[
-        (df['mgmt_unit'] == flyway) &
-        (df['sp_group_estimated'] == species_group) &
-        (df['season'] >= season_start) &
-        (df['season'] <= season_end)
-    ].copy()
-
-    # Check if table_value is 'bag_per_hunter' to determine rounding
-    if aggregate_on != 'bag_per_hunter':
-        # If table_value is not 'bag_per_hunter', round to nearest hundred
-        flyway_df[aggregate_on] = np.round(flyway_df[aggregate_on], -2)
-    else:
-        # If table_value is 'bag_per_hunter', round to one decimal place
-        flyway_df[aggregate_on] = np.round(flyway_df[aggregate_on], 1)
+''' ########### FUNCTIONS: Calculate Harvest Data Total for Data Tables ########### '''
 
-    yearly_sum = flyway_df.groupby('season')[aggregate_on].sum()
+# Variance column of each aggregated estimate in the harvest estimates dataset.
+VARIANCE_COLNAMES = {
+    'active_hunters': 'Var_active_hunters',
+    'bag_per_hunter': 'Var_bph',
+    'days_hunted': 'Var_days_hunted'
+}
 
-    return yearly_sum
+# Normal quantile of the 95% confidence intervals, expressed as a percentage of the estimate like the CI_ columns.
+CONFIDENCE_Z = 1.96
 
+# Flyway and US total columns of the tables, which get variance and confidence interval columns.
+TOTAL_COLUMNS = ['AF', 'MF', 'PF', 'CF', 'US']
 
-def calc_tabledata_for_species_group(df, flyway, season_start, season_end, species_group, aggregate_on):
-    # Filter for Atlantic Flyway from first_year (1999) to last_year(2020) for Ducks
-    
-    df_hunt = df[
-        (df['mgmt_unit'] == flyway) &
-        (df['sp_group_estimated'] == species_group) &
-        (df['season'] >= 1999) &
-        (df['season'] <= 2021)
-    ].copy()
+def calc_ci_percent(estimates, variances):
+    ''' Confidence interval half-width as a percentage of the estimate. Estimates of 0 get a CI of 0. '''
+    estimates = np.asarray(estimates, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ci = CONFIDENCE_Z * np.sqrt(np.asarray(variances, dtype=float)) / np.abs(estimates) * 100
+    return np.round(np.where(estimates != 0, ci, 0), 1)
 
-    
+# Seasons of the state columns of a table, whatever the seasons option.
+STATE_TABLE_SEASONS = (1999, 2021)
 
+# Columns of the grouped pass over the harvest estimates, group first so that a group is sliced from it.
+AGGREGATE_KEYS = ['sp_group_estimated', 'mgmt_unit', 'season', 'survey_state']
 
-    # Round the active_hunters to the nearest hundred for Atlantic Flyway
-    # Apply rounding only if table_value does not equal bag_per_hunter
+def round_estimates(values, aggregate_on):
+    ''' Rounds state estimates to the nearest hundred, or to one decimal place for bag_per_hunter. '''
     if aggregate_on != 'bag_per_hunter':
-        df_hunt[aggregate_on] = np.round(df_hunt[aggregate_on], -2)
-    else: #hunting date
-        # If table_value equals bag_per_hunter round to 1 decimal place
-        df_hunt[aggregate_on] = np.round(df_hunt[aggregate_on], 1)
+        return np.round(values, -2)
+    return np.round(values, 1)
+
+def aggregate_hunter_estimates(df, aggregate_on_list, include_variance=False, sort=True):
+    '''
+    Sums the rounded state estimates of every aggregated column in one grouped pass over the dataset.
+
+    parameter aggregate_on_list: Columns to aggregate, e.g. ['active_hunters', 'bag_per_hunter', 'days_hunted'].
+    parameter include_variance: Also sums the variance column of each aggregated column.
+    parameter sort: Sort the aggregate by its keys. Unsorted, the keys are in order of first appearance in the dataset.
+    returns DataFrame indexed by (sp_group_estimated, mgmt_unit, season, survey_state) with one column per aggregated
+            column and variance. Estimates without a state are kept, they count toward the flyway totals.
+    '''
+    value_colnames = list(aggregate_on_list)
+    if include_variance:
+        value_colnames += [VARIANCE_COLNAMES[aggregate_on] for aggregate_on in aggregate_on_list]
+    record = PipelineMetrics.start_stage('aggregate', rows_in=len(df))
+    hunt_df = df[AGGREGATE_KEYS + value_colnames].copy()
+    for aggregate_on in aggregate_on_list:
+        hunt_df[aggregate_on] = round_estimates(hunt_df[aggregate_on], aggregate_on)
+    aggregate = hunt_df.groupby(AGGREGATE_KEYS, dropna=False, sort=sort)[value_colnames].sum()
+    PipelineMetrics.end_stage(record, rows_out=len(aggregate))
+    return aggregate
+
+def build_store_aggregate(df):
+    '''
+    Aggregates the harvest estimates for the aggregate store: the rounded state estimates of every aggregated
+    column, with their variances when the dataset has them, summed by AGGREGATE_KEYS.
+
+    The rows keep the order in which their keys first appear in the dataset, so that the species groups of the
+    store are listed in the same order as in the dataset.
+    returns DataFrame with the AGGREGATE_KEYS columns and one column per aggregated column and variance.
+    '''
+    aggregate_on_list = list(VARIANCE_COLNAMES)
+    include_variance = all(VARIANCE_COLNAMES[aggregate_on] in df.columns for aggregate_on in aggregate_on_list)
+    return aggregate_hunter_estimates(df, aggregate_on_list, include_variance, sort=False).reset_index()
+
+def store_to_aggregate(store_df, aggregate_on_list, include_variance=False):
+    ''' Aggregate of the selected columns from the rows of the aggregate store, the same as aggregate_hunter_estimates of the dataset. '''
+    value_colnames = list(aggregate_on_list)
+    if include_variance:
+        value_colnames += [VARIANCE_COLNAMES[aggregate_on] for aggregate_on in aggregate_on_list]
+    return store_df.set_index(AGGREGATE_KEYS)[value_colnames].sort_index()
+
+def slice_aggregate(aggregate, species_group):
+    ''' Returns the aggregated estimates of a species group, indexed by (mgmt_unit, season, survey_state). '''
+    if species_group not in aggregate.index.get_level_values(0):
+        return aggregate.iloc[:0].droplevel(0)
+    return aggregate.xs(species_group, level=0)
 
-    # Aggregate table value (active_hunters or hunt days) by year for the Atlantic Flyway
-    atlantic_totals = df_hunt.groupby(['season', 'survey_state'])[aggregate_on].sum().reset_index()
+# Define a function to sum values by year for a specified flyway
+def sum_values_by_flyway(group_aggregate, flyway, season_start, season_end, aggregate_on, include_variance=False):
+    '''
+    Sums the estimates of the states of a flyway by season, from the aggregated estimates of a species group.
+
+    With include_variance, the variances of the state estimates are summed in the same groupby, which is the
+    variance of the flyway total for independent state estimates.
+    returns DataFrame indexed by season with the aggregate_on column, and its variance column with include_variance.
+    '''
+    value_colnames = [aggregate_on] + ([VARIANCE_COLNAMES[aggregate_on]] if include_variance else [])
+    if flyway not in group_aggregate.index.get_level_values(0):
+        return pd.DataFrame(columns=value_colnames, index=pd.Index([], name='season'), dtype=float)
+    flyway_df = group_aggregate.xs(flyway, level=0)
+    seasons = flyway_df.index.get_level_values('season')
+    flyway_df = flyway_df[(seasons >= season_start) & (seasons <= season_end)]
+    return flyway_df.groupby(level='season')[value_colnames].sum()
+
+
+def calc_national_totals(aggregate, season_start, season_end, species_group, aggregate_on, include_variance=False):
+    ''' Sums the values of each flyway and the US total for a species group. These are shared by all flyway tables. '''
+    group_aggregate = slice_aggregate(aggregate, species_group)
+    national_totals = {}
+    for fw in ALL_FLYWAYS:
+        national_totals[fw] = sum_values_by_flyway(group_aggregate, fw, season_start, season_end, aggregate_on, include_variance)
+    us_totals = national_totals['AF']
+    for fw in ALL_FLYWAYS[1:]:
+        us_totals = us_totals.add(national_totals[fw], fill_value=0)
+    national_totals['US'] = us_totals
+    return national_totals
+
+def calc_national_totals_multiple_groups(aggregate, season_start, season_end, group_list, aggregate_on, include_variance=False):
+    ''' Calculates the national totals of every species group once, for reuse across flyways. '''
+    with PipelineMetrics.stage('national_totals', rows_in=len(aggregate)) as record:
+        national_totals_by_group = {sp: calc_national_totals(aggregate, season_start, season_end, sp, aggregate_on, include_variance)
+                                    for sp in group_list}
+        record['rows_out'] = len(national_totals_by_group)
+    return national_totals_by_group
+
+def calc_period_uncertainty(numeric_years, averages_df, season_start, season_end, aggregate_on, period_width=5):
+    '''
+    Replaces the period averages of the variance and CI columns with the variance of each period mean.
+
+    The variance of the mean of n independent yearly estimates is the sum of their variances divided by n squared.
+    '''
+    var_colnames = [c+' Var' for c in TOTAL_COLUMNS]
+    labels = TimePeriods.get_period_labels(numeric_years['season'], season_start, season_end, period_width)
+    grouped = numeric_years[var_colnames].groupby(pd.Series(labels, index=numeric_years.index))
+    period_variances = (grouped.sum() / grouped.count() ** 2).reindex(averages_df.index).fillna(0)
+    for c in TOTAL_COLUMNS:
+        averages_df[c+' Var'] = round_variance(period_variances[c+' Var'].values, aggregate_on)
+        averages_df[c+' CI'] = calc_ci_percent(averages_df[c], period_variances[c+' Var'])
+    return averages_df
+
+def calc_summary_uncertainty(table_df, summary_sections, aggregate_on):
+    '''
+    Replaces the averages of the variance and CI columns of the summary sections with the variance of each mean.
+
+    Each section row is labeled with the seasons it averages, e.g. "1999-2001". As in calc_period_uncertainty, the
+    variance of the mean of the n seasons of the table in that range is the sum of their variances divided by n squared.
+    parameter summary_sections: List of (section title, DataFrame) of TimePeriods.calc_summary_sections.
+    '''
+    seasons = table_df['season'].to_numpy(dtype=np.int64)
+    variances = table_df[[c+' Var' for c in TOTAL_COLUMNS]].to_numpy(dtype=float)
+    for section_title, section_df in summary_sections:
+        bounds = section_df['season'].str.split('-', expand=True).astype(np.int64).to_numpy()
+        # Seasons x section rows matrix of the seasons averaged by each row.
+        in_range = ((seasons >= bounds[:, [0]]) & (seasons <= bounds[:, [1]])).astype(float)
+        section_variances = (in_range @ variances) / (in_range.sum(axis=1) ** 2)[:, None]
+        for i, c in enumerate(TOTAL_COLUMNS):
+            section_df[c+' Var'] = round_variance(section_variances[:, i], aggregate_on)
+            section_df[c+' CI'] = calc_ci_percent(section_df[c], section_variances[:, i])
+    return summary_sections
+
+def calc_summary_sections(table_df, aggregate_on, moving_average_windows=None, long_term_average=False):
+    ''' Moving and long-term average sections of a table, with the variance of each mean when the table has variances. '''
+    summary_sections = TimePeriods.calc_summary_sections(table_df, 'season', moving_average_windows, long_term_average)
+    if 'US Var' in table_df.columns:
+        summary_sections = calc_summary_uncertainty(table_df, summary_sections, aggregate_on)
+    return summary_sections
+
+def round_variance(variances, aggregate_on):
+    ''' Rounds variances to whole numbers, or to 3 decimals for bag_per_hunter. '''
+    if aggregate_on != 'bag_per_hunter':
+        return np.round(variances, 0).astype(int)
+    return np.round(variances, 3)
+
+def calc_tabledata_for_species_group(df, flyway, season_start, season_end, species_group, aggregate_on, national_totals=None, period_width=5,
+                                     include_variance=False):
+    '''
+    Calculates the table data of a species group in a flyway from the harvest estimates dataset.
+
+    Only the estimates of the species group are aggregated, use calc_tabledata_from_aggregate to calculate the
+    tables of several groups, flyways or aggregated columns from one aggregate.
+    '''
+    aggregate = aggregate_hunter_estimates(df[df['sp_group_estimated'] == species_group], [aggregate_on], include_variance)
+    return calc_tabledata_from_aggregate(aggregate, flyway, season_start, season_end, species_group, aggregate_on, national_totals,
+                                         period_width, include_variance)
+
+def calc_tabledata_from_aggregate(aggregate, flyway, season_start, season_end, species_group, aggregate_on, national_totals=None,
+                                  period_width=5, include_variance=False):
+    '''
+    Calculates the table data of a species group in a flyway from the aggregated estimates.
+
+    parameter aggregate: Aggregated estimates returned by aggregate_hunter_estimates.
+    parameter include_variance: Adds the variance ("<FLYWAY> Var") and the 95% confidence interval as a percentage of
+                                the estimate ("<FLYWAY> CI") of each flyway and the US total, propagated from the state
+                                variances of the dataset.
+    '''
+    # Filter for Atlantic Flyway from first_year (1999) to last_year(2020) for Ducks
+    record = PipelineMetrics.start_stage('table_data', species_group, rows_in=len(aggregate))
+    group_aggregate = slice_aggregate(aggregate, species_group)
+    if flyway in group_aggregate.index.get_level_values(0):
+        flyway_aggregate = group_aggregate.xs(flyway, level=0)[[aggregate_on]].reset_index()
+    else:
+        flyway_aggregate = pd.DataFrame(columns=['season', 'survey_state', aggregate_on])
+    atlantic_totals = flyway_aggregate[
+        (flyway_aggregate['season'] >= STATE_TABLE_SEASONS[0]) &
+        (flyway_aggregate['season'] <= STATE_TABLE_SEASONS[1]) &
+        (flyway_aggregate['survey_state'].notnull())
+    ].reset_index(drop=True)
+
+    # State estimates were rounded to the nearest hundred, or to 1 decimal place for bag_per_hunter, before they
+    # were summed by season and state.
     # Convert values to integers
     if aggregate_on != 'bag_per_hunter':
         # Convert values to integers only if table_value is not 'bag_per_hunter'
@@ -104,20 +303,15 @@ def calc_tabledata_for_species_group(df, flyway, season_start, season_end, speci
     #create pivot tables
     atlantic_pivot = atlantic_totals.pivot(index='season', columns='survey_state', values=aggregate_on).fillna(0)
     
-    af_totals = sum_values_by_flyway(df, 'AF', season_start, season_end, species_group, aggregate_on)
-    mf_totals = sum_values_by_flyway(df, 'MF', season_start, season_end, species_group, aggregate_on)
-    pf_totals = sum_values_by_flyway(df, 'PF', season_start, season_end, species_group, aggregate_on)
-    cf_totals = sum_values_by_flyway(df, 'CF', season_start, season_end, species_group, aggregate_on)
-    ak_totals = sum_values_by_flyway(df, 'AK', season_start, season_end, species_group, aggregate_on)
-    us_totals = af_totals.add(mf_totals, fill_value=0).add(pf_totals, fill_value=0).add(cf_totals, fill_value=0).add(ak_totals, fill_value=0)
-
+    if national_totals is None:
+        national_totals = calc_national_totals(aggregate, season_start, season_end, species_group, aggregate_on, include_variance)
 
     # Merge the totals with the Atlantic Flyway DataFrame
-    atlantic_pivot['AF'] = af_totals
-    atlantic_pivot['MF'] = mf_totals
-    atlantic_pivot['PF'] = pf_totals
-    atlantic_pivot['CF'] = cf_totals
-    atlantic_pivot['US'] = us_totals
+    atlantic_pivot['AF'] = national_totals['AF'][aggregate_on]
+    atlantic_pivot['MF'] = national_totals['MF'][aggregate_on]
+    atlantic_pivot['PF'] = national_totals['PF'][aggregate_on]
+    atlantic_pivot['CF'] = national_totals['CF'][aggregate_on]
+    atlantic_pivot['US'] = national_totals['US'][aggregate_on]
 
     #values should be integers unless the table value is bag_per hunter
     should_convert_to_int = aggregate_on != 'bag_per_hunter'
@@ -132,28 +326,15 @@ def calc_tabledata_for_species_group(df, flyway, season_start, season_end, speci
     # Fill missing values with 0
     atlantic_pivot.fillna(0, inplace=True)
 
-    
-    # Calculate dynamic time period averges
-    # Calculate the first period's end year to end with 0 or 5
-    first_period_end_year = find_next_year_ending_in_0_or_5(season_start)
-
-    # Initialize time periods dictionary
-    time_periods = {}
-    if first_period_end_year > season_start:
-        time_periods[f"{season_start}-{first_period_end_year}"] = (season_start, first_period_end_year)
-
-    # generate subsequent 5-year periods
-    start_year = first_period_end_year + 1
-    while start_year <= season_end:
-        end_year = start_year + 4
-        if end_year > season_end or (end_year % 10 != 0 and end_year % 10 != 5):
-            end_year = find_next_year_ending_in_0_or_5(season_end)
-            if end_year > season_end:
-                end_year = season_end
-        period_label = f'{start_year}-{end_year}'
-        time_periods[period_label] = (start_year, end_year)
-        start_year = end_year + 1
+    if include_variance:
+        # Variance and confidence interval columns follow the totals, in the same order.
+        var_colname = VARIANCE_COLNAMES[aggregate_on]
+        for c in TOTAL_COLUMNS:
+            variances = national_totals[c][var_colname].reindex(atlantic_pivot.index).fillna(0)
+            atlantic_pivot[c+' Var'] = round_variance(variances.values, aggregate_on)
+            atlantic_pivot[c+' CI'] = calc_ci_percent(atlantic_pivot[c], variances)
 
+    
     # Ensure 'Season' is a column
     atlantic_pivot.reset_index(inplace=True)
 
@@ -163,42 +344,43 @@ def calc_tabledata_for_species_group(df, flyway, season_start, season_end, speci
     numeric_years['season'] = numeric_years['season'].astype(int)
     numeric_years.sort_values(by='season', inplace=True)
 
-    # Calculate averages for each time period and create a DataFrame for them
-    averages_rows = []
-    for label, (start_year, end_year) in time_periods.items():
-        # Select the data for the time period
-        
-        period_data = numeric_years[(numeric_years['season'] >= start_year) & (numeric_years['season'] <= end_year)]
+    # Calculate averages for each time period
+    averages_df = TimePeriods.calc_period_averages(numeric_years, 'season', season_start, season_end, period_width)
+    if include_variance:
+        averages_df = calc_period_uncertainty(numeric_years, averages_df, season_start, season_end, aggregate_on, period_width)
+    averages_df = averages_df.reset_index(drop=True)
+    PipelineMetrics.end_stage(record, rows_out=len(numeric_years))
 
-        # Calculate the mean for each column
-        averages = period_data.mean().round(0).fillna(0).astype(int)  # Round to 0 decimal places
-        averages['season'] = label  # Set the label for the averages row
-        averages_rows.append(averages)
+    return (numeric_years, averages_df)
 
-    # Convert the averages list of series to a DataFrame
-    averages_df = pd.DataFrame(averages_rows)
+def calc_harvest_tabledata_multiple_groups(aggregate, flyway, season_start, season_end, group_list, aggregate_on, national_totals_by_group=None,
+                                           workers=1, period_width=5, include_variance=False):
+    ''' Interate through a list of groups to generate a list of harvest table data results from the aggregated estimates.'''
+    table_args_list = []
+    for sp in group_list:
+        national_totals = national_totals_by_group[sp] if national_totals_by_group is not None else None
+        table_args_list.append((flyway, season_start, season_end, sp, aggregate_on, national_totals, period_width, include_variance))
 
-    return (numeric_years, averages_df)
+    # Tables are calculated in worker processes when workers > 1.
+    all_results = ParallelTables.map_tables(calc_tabledata_from_aggregate, aggregate, table_args_list, workers)
 
-def calc_harvest_tabledata_multiple_groups(df, flyway, season_start, season_end, group_list, aggregate_on):
-    ''' Interate through a list of groups to generate a list of harvest table data results.'''
     data_results_arr = []
-    for sp in group_list:
-        print_info("Calculating harvest data for group: "+sp)
-        results = calc_tabledata_for_species_group(df, flyway, season_start, season_end, sp, aggregate_on)
+    for sp, results in zip(group_list, all_results):
         data_results_arr.append((sp, flyway, results[0], results[1]))
     return data_results_arr
 
 
 ''' ########### FUNCTIONS: Excel Table Generation ########### '''
 
-def generate_excel_workbook_for_multiple_groups(table_data_results_list):
-    # Creating a new workbook
-    wb = Workbook()
-
-    # Removing the default 'Sheet'
-    del wb['Sheet']
+def generate_excel_workbook_for_multiple_groups(table_data_results_list, write_only=False, moving_average_windows=None,
+                                                 long_term_average=False, include_variance=False, workbook_name=None,
+                                                 excel_engine='openpyxl', aggregate_on='active_hunters'):
+    ''' Builds the table sheets of every species group and saves the workbook once, by default as "<FLYWAY> Hunter Data Tables.xlsx". '''
+    if (len(table_data_results_list) <= 0):
+        print_error('No table data to write to the Excel workbook.')
+        return
 
+    table_list = []
     for result in table_data_results_list:
         group_name = result[0]
         flyway = result[1]
@@ -207,64 +389,261 @@ def generate_excel_workbook_for_multiple_groups(table_data_results_list):
 
         asterisk_text_list = ['* Preliminary Estimate', \
                               '** For flyway estimates prior to 2015 please see the flyway-specific databook']
-        
+        if include_variance:
+            asterisk_text_list.append('Var: Variance of the estimate. CI: 95% confidence interval, as a percentage of the estimate.')
+
+        summary_sections = calc_summary_sections(hunter_estimate_data, aggregate_on, moving_average_windows, long_term_average)
 
         table_title = 'Estimates of '+str(group_name)+' in the '+flyway
         # table_title = ''
-        FlywayTables.create_table_to_ws(wb, hunter_estimate_data, period_averages, asterisk_text_list, table_title, group_name)
-            
-        workbook_name = flyway+' Hunter Data Tables.xlsx'
-        wb.save(workbook_name)
-    print_info('Completed Excel workbook file ['+workbook_name+']')
-
-''' ########### MAIN FUNCTION ########### '''
+        table_list.append((hunter_estimate_data, period_averages, asterisk_text_list, table_title, group_name, summary_sections))
 
-@click.command()
-@click.argument('filename', required=1, type=click.Path(exists=True))
-@click.option('--flyway', default='AF', help='Name of the flyway. Options are AF, MF, CF, and PF. \
-                Default is "AF". Value is case sensitive.')
-@click.option('--seasons', default='all', help='Season range to generate. Use the notation <START>:<END>. E.g. 1999:2021. Default is ALL.')
-@click.option('--species_group', default='all', help='A comma seperated list of species groups to generate tables. Possible values \
-              are [brant, ducks, geese, sea ducks]. E.g. --species_group=brant,ducks,geese,sea ducks. \
-              Values are case sensitive. Default is ALL.')
-@click.option('--aggregate_on', default='active_hunters', help='The column name contain the value to perform aggregation on. Available options are \
-              [active_hunters, bag_per_hunter, days_hunted]. The type of table generated is based on this parameter. Default is active_hunters.')
-def main(flyway, seasons, species_group, aggregate_on, filename):
-    print("")
-    ALLOWED_AGGREGATE_ON_COL = ['active_hunters', 'bag_per_hunter', 'days_hunted']
-    sdf = pd.read_csv(filename)
+    if workbook_name is None:
+        workbook_name = flyway+' Hunter Data Tables.xlsx'
+    FlywayTables.write_tables_to_workbook(workbook_name, table_list, write_only, excel_engine)
+
+''' ########### FUNCTIONS: Machine-readable Table Export ########### '''
+
+def export_tables_for_multiple_groups(workbook_results, output_format, moving_average_windows=None, long_term_average=False):
+    '''
+    Writes the tables of every species group, for every aggregated column and flyway, to one long format file.
+
+    parameter workbook_results: List of (aggregated column, flyway, table data results), one per workbook.
+    '''
+    table_list = []
+    for agg_on, fw, big_results in workbook_results:
+        for result in big_results:
+            summary_sections = calc_summary_sections(result[2], agg_on, moving_average_windows, long_term_average)
+            table_list.append(({'flyway': fw, 'aggregate_on': agg_on, 'species_group': result[0]}, result[2], result[3], summary_sections))
+    if (len(table_list) <= 0):
+        print_error('No table data to export.')
+        return
+
+    flyways = list(dict.fromkeys(fw for agg_on, fw, big_results in workbook_results))
+    export_name = flyways[0]+' Hunter Data Tables' if len(flyways) == 1 else 'Flyway Hunter Data Tables'
+    TableExport.write_tables(export_name, table_list, 'season', output_format)
+
+''' ########### FUNCTIONS: Loading and Calculating Tables ########### '''
+
+def load_and_calc_hunter_tables(filename, flyway, seasons, species_group, aggregate_on_list, workers, period_width, variance, store,
+                                append_season, repository, partitioned):
+    '''
+    Loads the dataset and calculates the table data of every selected species group.
+
+    returns List of (aggregated column, flyway, table data results), one per workbook.
+    '''
+    ingest_record = PipelineMetrics.start_stage('ingest')
+    if (repository is not None):
+        if (append_season is not None):
+            print_fatal_exit('Option --append_season reads the new season from a dataset FILENAME and cannot be used with --repository.')
+        # The national totals need the estimates of every flyway.
+        mgmt_units = list(dict.fromkeys(ALL_FLYWAYS + parse_flyway_option(flyway)))
+        sdf = TimeSeriesRepository.read_hunter_estimates(repository, None, mgmt_units, parse_species_group_option(species_group))
+        if (len(sdf) <= 0):
+            print_fatal_exit('Repository '+repository+' has no hunter estimates of the selected flyways and species groups.')
+        filename = repository
+    elif (partitioned is not None):
+        if (append_season is not None):
+            print_fatal_exit('Option --append_season reads the new season from a dataset FILENAME and cannot be used with --partitioned.')
+        # The season range and the flyways select the partition files. The national totals need the estimates of every flyway.
+        mgmt_units = list(dict.fromkeys(ALL_FLYWAYS + parse_flyway_option(flyway)))
+        sdf = PartitionedDataset.read_hunter_estimates(partitioned, get_read_seasons(parse_seasons_option(seasons)), mgmt_units,
+                                                       parse_species_group_option(species_group))
+        if (len(sdf) <= 0):
+            print_fatal_exit('Partitioned dataset '+partitioned+' has no hunter estimates of the selected seasons, flyways and species groups.')
+        filename = partitioned
+    elif (append_season is not None):
+        if (store is None):
+            print_fatal_exit('Option --append_season requires the path of the aggregate store with --store.')
+        store_df = AggregateStore.read_store(store, 'hunter')
+        # Only the rows of the new season are read from the dataset and aggregated.
+        season_df = AggregateStore.read_csv_season(filename, 'season', append_season)
+        if (len(season_df) <= 0):
+            print_fatal_exit('Dataset '+filename+' has no rows of season '+str(append_season)+'.')
+        sdf = AggregateStore.merge_season(store_df, build_store_aggregate(season_df), 'season', append_season)
+        AggregateStore.write_store(sdf, store, 'hunter', 'season')
+    else:
+        sdf = pd.read_csv(filename)
+    PipelineMetrics.end_stage(ingest_record, rows_out=len(sdf))
+
+    if (store is not None and append_season is None):
+        # The store keeps the aggregated estimates, which give the same tables as the dataset rows.
+        sdf = build_store_aggregate(sdf)
+        with PipelineMetrics.stage('store_write', rows_in=len(sdf)):
+            AggregateStore.write_store(sdf, store, 'hunter', 'season')
     print_info('Dataset '+filename+' is now stored in a Pandas Dataframe.') 
     print_info('Dataset column names='+str(sdf.columns))
 
-    if (seasons != 'all'):
-        if (re.match(r"^\d{4}:\d{4}$", seasons)):
-            seasons = seasons.split(':')
-            seasons = (int(seasons[0]), int(seasons[1]))
-        else:
-            print_fatal_exit("Invalid season parameter value. Please refer to --help for more information.")
-    else: 
+    seasons = parse_seasons_option(seasons)
+    if (seasons is None):
         all_seasons = sdf['season'].unique()
         all_seasons.sort()
         seasons = (int(all_seasons[0]), int(all_seasons[-1]))
 
-    if (species_group == 'all'):
+    # A comma seperated list of groups is split into groups, not iterated character by character.
+    species_group = parse_species_group_option(species_group)
+    if (species_group is None):
         species_group = sdf['sp_group_estimated'].unique()
     
     print_info('Processed input parameters:')
     print_info('--Flyway='+str(flyway))
     print_info('--Seasons='+str(seasons))
     print_info('--Species Groups='+str(species_group))
-    print_info('--Aggregate On='+ aggregate_on)
+    print_info('--Aggregate On='+str(aggregate_on_list))
+
+    for agg_on in aggregate_on_list:
+        if (variance and VARIANCE_COLNAMES[agg_on] not in sdf.columns):
+            print_fatal_exit('Dataset is missing the variance column ['+VARIANCE_COLNAMES[agg_on]+'] needed by --variance.')
+
+    if (store is not None):
+        # The aggregate store already holds the aggregated estimates.
+        aggregate = store_to_aggregate(sdf, aggregate_on_list, variance)
+    else:
+        # Single grouped pass over the dataset, every table below is sliced from the aggregate.
+        aggregate = aggregate_hunter_estimates(sdf, aggregate_on_list, variance)
+
+    flyway_list = parse_flyway_option(flyway)
+    workbook_results = []
+    for agg_on in aggregate_on_list:
+        national_totals_by_group = None
+        if (len(flyway_list) > 1):
+            # Flyway and US totals are the same in every flyway workbook, calculate them once.
+            print_info('Calculating national totals shared by flyways '+str(flyway_list))
+            national_totals_by_group = calc_national_totals_multiple_groups(aggregate, seasons[0], seasons[1], species_group, agg_on, variance)
+
+        for fw in flyway_list:
+            big_results = calc_harvest_tabledata_multiple_groups(aggregate, fw, seasons[0], seasons[1], species_group, agg_on,
+                                                                 national_totals_by_group, workers, period_width, variance)
+            workbook_results.append((agg_on, fw, big_results))
+    return workbook_results
+
+def get_result_cache_key(result_cache, filename, repository, partitioned, flyway, seasons, species_group, aggregate_on_list,
+                         period_width, variance):
+    ''' Key of the table data results in the result cache, from the content of the input and the options the results depend on. '''
+    if (repository is not None):
+        input_path = repository
+    elif (partitioned is not None):
+        input_path = os.path.join(partitioned, 'hunter', PartitionedDataset.META_FILENAME)
+    else:
+        input_path = filename
+    options = {'flyway': parse_flyway_option(flyway), 'seasons': parse_seasons_option(seasons),
+               'species_group': parse_species_group_option(species_group), 'aggregate_on': aggregate_on_list,
+               'period_width': period_width, 'variance': variance}
+    return ResultCache.get_result_key(result_cache, 'HunterTableGen', input_path, options)
+
+
+''' ########### MAIN FUNCTION ########### '''
+
+@click.command()
+@click.argument('filename', required=0, type=click.Path(exists=True))
+@click.option('--flyway', default='AF', help='Name of the flyway. Options are AF, MF, CF, and PF. \
+                A comma seperated list of flyways, or "all" for the four flyways, generates one workbook per flyway \
+                from a single load of the dataset. Default is "AF". Value is case sensitive.')
+@click.option('--seasons', default='all', help='Season range to generate. Use the notation <START>:<END>. E.g. 1999:2021. Default is ALL.')
+@click.option('--species_group', default='all', help='A comma seperated list of species groups to generate tables. Possible values \
+              are [brant, ducks, geese, sea ducks]. E.g. --species_group=brant,ducks,geese,sea ducks. \
+              Values are case sensitive. Default is ALL.')
+@click.option('--aggregate_on', default='active_hunters', help='The column name contain the value to perform aggregation on. Available options are \
+              [active_hunters, bag_per_hunter, days_hunted]. The type of table generated is based on this parameter. "all" writes \
+              one workbook per column, named "<FLYWAY> <COLUMN> Hunter Data Tables.xlsx", from a single aggregation of the \
+              dataset. Default is active_hunters.')
+@click.option('--output_format', '--output-format', default='excel', type=click.Choice(TableExport.OUTPUT_FORMATS), help='Format \
+              of the generated tables. "excel" writes the Excel workbooks. "csv", "parquet" and "json" write every table and its \
+              averages to one long format file per run, one row per table cell, without building any workbook. Default is excel.')
+@click.option('--write_only', is_flag=True, default=False, help='Write the Excel workbook in openpyxl write-only mode, which streams \
+              rows to the file in near-constant memory. Use for workbooks with many tables.')
+@click.option('--excel_engine', '--excel-engine', default='openpyxl', type=click.Choice(FlywayTables.EXCEL_ENGINES), help='Writer \
+              of the Excel workbooks. "xlsxwriter" streams every row to the file in constant memory with the same tables and \
+              styles, and is faster for workbooks with many tables. Requires the XlsxWriter package. Default is openpyxl.')
+@click.option('--workers', default=1, type=click.IntRange(min=1), help='Number of worker processes calculating the species \
+              group tables in parallel. Default is 1.')
+@click.option('--period_width', default=5, type=click.IntRange(min=1), help='Width in years of the time periods in the Averages \
+              section, e.g. 5 or 10. Periods end on years that are a multiple of the width. Default is 5.')
+@click.option('--moving_averages', default=None, help='A comma seperated list of moving average widths in years, e.g. 3,5,10. \
+              Adds a moving averages section per width to every table. Default is no moving averages.')
+@click.option('--long_term_average', is_flag=True, default=False, help='Adds a long-term average section, the average of every \
+              season of the table, to every table.')
+@click.option('--variance', is_flag=True, default=False, help='Adds the variance and the 95% confidence interval (percentage of \
+              the estimate) of each flyway and US total, propagated from the state variances of the dataset.')
+@click.option('--store', default=None, type=click.Path(dir_okay=False), help='Path of the persisted aggregate store (Parquet) \
+              holding the hunter estimates. The store is built from the whole dataset, or updated with --append_season.')
+@click.option('--append_season', '--append-season', default=None, type=int, help='Season to append to the aggregate store, e.g. 2023. \
+              Only the rows of this season are read from the dataset and merged into the --store, replacing any stored \
+              estimates of the season, and the tables are generated from the store.')
+@click.option('--repository', default=None, type=click.Path(exists=True, dir_okay=False), help='Path of the SQLite time series \
+              repository created by TimeSeriesRepository. The hunter estimates of the selected flyways and species groups are \
+              read from the repository with indexed lookups, and no dataset FILENAME is needed.')
+@click.option('--partitioned', default=None, type=click.Path(exists=True, file_okay=False), help='Path of the season and flyway \
+              partitioned dataset directory created by PartitionedDataset. Only the partitions of the selected seasons and of \
+              the flyways are read, and no dataset FILENAME is needed.')
+@click.option('--result_cache', '--result-cache', default=None, type=click.Path(file_okay=False), help='Directory of the result \
+              cache. The table data is cached under a hash of the content of the input and of the options it depends on, and \
+              a run with an unchanged input and options skips straight to writing the workbooks.')
+@click.option('--result_cache_size', '--result-cache-size', default=ResultCache.DEFAULT_CACHE_SIZE_MB, type=click.IntRange(min=0), \
+              help='Size cap of the result cache in megabytes. The least recently used results are removed first. Default is 512.')
+@click.option('--metrics_json', '--metrics-json', default=None, type=click.Path(dir_okay=False), help='Path of a JSON file \
+              receiving the wall time, CPU time, peak resident memory and rows in and out of every stage of the run, by \
+              species group and sheet, for monitoring.')
+@click.option('--profile', default=None, type=click.Path(file_okay=False), help='Directory receiving a profile of every stage, \
+              by species group and sheet, as a pstats file and a collapsed stack file for flamegraph tools, plus the combined \
+              profile of the run. Profiling slows the run down.')
+def main(flyway, seasons, species_group, aggregate_on, output_format, write_only, excel_engine, workers, period_width,
+         moving_averages, long_term_average, variance, store, append_season, repository, partitioned, result_cache, result_cache_size,
+         metrics_json, profile, filename):
+    print("")
+    PipelineMetrics.reset_metrics()
+    if (profile is not None):
+        PipelineProfiler.enable_profiling(profile, clear=True)
+    ALLOWED_AGGREGATE_ON_COL = ['active_hunters', 'bag_per_hunter', 'days_hunted']
+    moving_average_windows = None
+    if (moving_averages is not None):
+        moving_average_windows = TimePeriods.parse_moving_average_windows(moving_averages)
+        if (moving_average_windows is None):
+            print_fatal_exit("Invalid moving_averages parameter. Please refer to --help for more information.")
+
+    if (filename is None and repository is None and partitioned is None):
+        print_fatal_exit('Missing dataset FILENAME, --repository or --partitioned. Please refer to --help for more information.')
 
     # Validating aggregate_on parameter value
-    if aggregate_on.lower() not in ALLOWED_AGGREGATE_ON_COL:
-        print_fatal_exit("Invalid aggregate_on parameter value ["+aggregate_on+"]. Please refer to --help for more information.")
+    aggregate_on_list = list(ALLOWED_AGGREGATE_ON_COL) if aggregate_on == 'all' else [aggregate_on]
+    for agg_on in aggregate_on_list:
+        if agg_on.lower() not in ALLOWED_AGGREGATE_ON_COL:
+            print_fatal_exit("Invalid aggregate_on parameter value ["+agg_on+"]. Please refer to --help for more information.")
+
+    workbook_results = None
+    result_key = None
+    if (result_cache is not None and store is not None):
+        print_info('Result cache is not used with --store, the store is written by the run.')
+    elif (result_cache is not None):
+        with PipelineMetrics.stage('result_cache'):
+            result_key = get_result_cache_key(result_cache, filename, repository, partitioned, flyway, seasons, species_group,
+                                              aggregate_on_list, period_width, variance)
+            workbook_results = ResultCache.read_result(result_cache, result_key)
+
+    if (workbook_results is None):
+        workbook_results = load_and_calc_hunter_tables(filename, flyway, seasons, species_group, aggregate_on_list, workers, period_width,
+                                                       variance, store, append_season, repository, partitioned)
+        if (result_key is not None):
+            ResultCache.write_result(result_cache, result_key, workbook_results, result_cache_size)
+
+    if (output_format != 'excel'):
+        # One long format file holds the tables of every aggregated column and flyway, no workbook is built.
+        export_tables_for_multiple_groups(workbook_results, output_format, moving_average_windows, long_term_average)
+    else:
+        for agg_on, fw, big_results in workbook_results:
+            # Genernating Excel workbook tables from all results.
+            workbook_name = fw+' '+agg_on+' Hunter Data Tables.xlsx' if len(aggregate_on_list) > 1 else None
+            generate_excel_workbook_for_multiple_groups(big_results, write_only, moving_average_windows, long_term_average, variance,
+                                                        workbook_name, excel_engine, agg_on)
 
-    big_results = calc_harvest_tabledata_multiple_groups(sdf, flyway, seasons[0], seasons[1], species_group,  aggregate_on)
-    # Genernating Excel workbook tables from all results.
-    generate_excel_workbook_for_multiple_groups(big_results)
+    if (metrics_json is not None):
+        PipelineMetrics.write_metrics_json(metrics_json, 'HunterTableGen', click.get_current_context().params)
+    if (profile is not None):
+        PipelineProfiler.write_run_profile()
 
 
 if __name__ == '__main__':
     ''' Program entry point '''
+    # Needed by worker processes of the Windows executable.
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
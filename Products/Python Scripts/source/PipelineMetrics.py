@@ -0,0 +1,134 @@
+import click
+import contextlib
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+try:
+    import resource
+except ImportError:
+    resource = None
+import PipelineProfiler
+import sys
+
+''' ########### CONSTANTS: Stage Metrics ########### '''
+
+# Bump when the layout of the metrics file changes.
+METRICS_FORMAT_VERSION = 1
+
+# Stage records kept in memory, oldest first out, so that a long running query service stays bounded.
+MAX_RECORDS = 100000
+
+_records = deque(maxlen=MAX_RECORDS)
+_run_start = time.perf_counter()
+
+
+''' ########### FUNCTIONS: Recording Stages ########### '''
+
+def get_peak_rss_mb():
+    ''' Peak resident memory of the process so far, or None where the resource module is unavailable (Windows). '''
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return round(peak_rss / (1048576 if sys.platform == 'darwin' else 1024), 2)
+
+def reset_metrics():
+    ''' Drops the recorded stages and restarts the run clock. '''
+    global _run_start
+    _records.clear()
+    _run_start = time.perf_counter()
+
+def start_stage(stage_name, species=None, rows_in=None):
+    '''
+    Starts measuring a pipeline stage, and profiling it when PipelineProfiler is enabled.
+
+    parameter stage_name: Name of the stage, e.g. "ingest" or "table_data".
+    parameter species: Species, group, sheet or workbook the stage ran for, None for stages of the whole dataset.
+    parameter rows_in: Number of rows the stage reads.
+    returns The stage record to pass to end_stage.
+    '''
+    return {'stage': stage_name, 'species': species, 'rows_in': rows_in, 'rows_out': None,
+            '_profile': PipelineProfiler.start_scope(), '_start': time.perf_counter(), '_start_cpu': time.process_time()}
+
+def end_stage(record, rows_out=None):
+    ''' Completes a stage record with its wall time, CPU time, peak RSS and output rows, and records it. '''
+    record['seconds'] = round(time.perf_counter() - record.pop('_start'), 4)
+    record['cpu_seconds'] = round(time.process_time() - record.pop('_start_cpu'), 4)
+    PipelineProfiler.end_scope(record.pop('_profile'), record['stage'], record['species'])
+    record['peak_rss_mb'] = get_peak_rss_mb()
+    record['pid'] = os.getpid()
+    if rows_out is not None:
+        record['rows_out'] = rows_out
+    _records.append(record)
+
+    species = '' if record['species'] is None else ' '+str(record['species'])
+    rows = '' if record['rows_in'] is None and record['rows_out'] is None else \
+           ', rows '+str(record['rows_in'])+' -> '+str(record['rows_out'])
+    print_info('Stage ['+record['stage']+']'+species+' took '+str(record['seconds'])+'s, CPU '+str(record['cpu_seconds'])+'s'+rows)
+    return record
+
+@contextlib.contextmanager
+def stage(stage_name, species=None, rows_in=None):
+    '''
+    Measures the pipeline stage run in the with block.
+
+    Yields the stage record, set its "rows_out" in the block when the output size is known. The stage is
+    ended even when the block raises, so its record is kept and its profiler scope is closed.
+    '''
+    record = start_stage(stage_name, species, rows_in)
+    try:
+        yield record
+    finally:
+        end_stage(record)
+
+def get_metrics():
+    ''' Returns a copy of the stage records, oldest first. '''
+    return [dict(record) for record in _records]
+
+def add_metrics(records):
+    ''' Adds stage records measured in another process, e.g. by the table workers. '''
+    _records.extend(records)
+
+
+''' ########### FUNCTIONS: Metrics Report ########### '''
+
+def summarize_metrics(records):
+    ''' Totals of the wall time, CPU time and calls of each stage name, in order of first use. '''
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, 'cpu_seconds': 0.0})
+        total['calls'] += 1
+        total['seconds'] = round(total['seconds'] + record['seconds'], 4)
+        total['cpu_seconds'] = round(total['cpu_seconds'] + record['cpu_seconds'], 4)
+    return totals
+
+def write_metrics_json(metrics_path, command, options=None):
+    '''
+    Writes the recorded stages of the run to a JSON file for monitoring.
+
+    parameter command: Name of the script, e.g. "HarvestTableGen".
+    parameter options: Dictionary of the options of the run.
+    '''
+    records = get_metrics()
+    metrics = {'format_version': METRICS_FORMAT_VERSION,
+               'command': command,
+               'created': datetime.now(timezone.utc).isoformat(),
+               'options': options or {},
+               'total_seconds': round(time.perf_counter() - _run_start, 4),
+               'peak_rss_mb': get_peak_rss_mb(),
+               'totals': summarize_metrics(records),
+               'stages': records}
+    with open(metrics_path, 'w') as f:
+        json.dump(metrics, f, indent=2, default=str)
+    print_info('Stage metrics written to ['+metrics_path+']')
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
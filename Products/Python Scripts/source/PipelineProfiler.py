@@ -0,0 +1,176 @@
+import click
+import cProfile
+import glob
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+''' ########### CONSTANTS: Profiling ########### '''
+
+# Seconds between two stack samples of the collapsed stack files.
+SAMPLE_INTERVAL = 0.001
+
+# Name of the files combining every scope of the run.
+RUN_PROFILE_NAME = 'run'
+
+_profile_dir = None
+_sample_interval = SAMPLE_INTERVAL
+
+# Scopes do not nest, a stage run inside a profiled stage is part of the outer profile.
+_active = threading.local()
+
+
+''' ########### FUNCTIONS: Profiler Settings ########### '''
+
+def enable_profiling(profile_dir, sample_interval=SAMPLE_INTERVAL, clear=False):
+    '''
+    Profiles every pipeline stage from now on, writing one profile per stage and species into profile_dir.
+
+    parameter clear: Removes the profile files of an earlier run from profile_dir.
+    '''
+    global _profile_dir, _sample_interval
+    os.makedirs(profile_dir, exist_ok=True)
+    if clear:
+        for path in glob.glob(os.path.join(profile_dir, '*.pstats')) + glob.glob(os.path.join(profile_dir, '*.collapsed')):
+            os.remove(path)
+    _profile_dir = profile_dir
+    _sample_interval = sample_interval
+
+def get_profile_settings():
+    ''' Returns the (profile directory, sample interval) to enable the same profiling in worker processes, or None. '''
+    if _profile_dir is None:
+        return None
+    return (_profile_dir, _sample_interval)
+
+
+''' ########### FUNCTIONS: Stack Sampling ########### '''
+
+class StackSampler(threading.Thread):
+    '''
+    Samples the Python stack of a thread at a fixed interval, for the collapsed stack file of a scope.
+
+    Each stack is weighted by the microseconds since the previous sample, so calls holding the interpreter
+    lock for longer than the interval, such as large pandas operations, keep their share of the time.
+    '''
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last_sample = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                self.stacks[format_stack(frame)] += int((now - last_sample) * 1000000)
+            last_sample = now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def format_stack(frame):
+    ''' Formats a stack as the root-first, semicolon separated frames of the collapsed stack format. '''
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(os.path.basename(code.co_filename)+':'+code.co_name)
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+''' ########### FUNCTIONS: Profiling Scopes ########### '''
+
+def start_scope():
+    ''' Starts profiling the current thread. Returns None when profiling is not enabled or a scope is already active. '''
+    if _profile_dir is None or getattr(_active, 'scope', False):
+        return None
+    _active.scope = True
+    sampler = StackSampler(threading.get_ident(), _sample_interval)
+    sampler.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return (profiler, sampler)
+
+def end_scope(scope, stage_name, species=None):
+    '''
+    Stops profiling a scope and writes its <stage>[_<species>].pstats and .collapsed files.
+
+    The .pstats file is read with the pstats module or snakeviz, and the .collapsed file, one
+    "frame;frame;frame microseconds" line per stack, is accepted by flamegraph.pl and speedscope.
+    '''
+    if scope is None:
+        return
+    profiler, sampler = scope
+    profiler.disable()
+    sampler.stop()
+    _active.scope = False
+
+    path = get_scope_path(stage_name, species)
+    profiler.dump_stats(path+'.pstats')
+    write_collapsed_stacks(path+'.collapsed', sampler.stacks)
+
+def get_scope_path(stage_name, species=None):
+    ''' Path of the profile files of a scope, without extension. Scopes run more than once get a numbered suffix. '''
+    name = stage_name if species is None else stage_name+'_'+str(species)
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+    path = os.path.join(_profile_dir, name)
+    suffix = 2
+    while os.path.exists(path+'.pstats'):
+        path = os.path.join(_profile_dir, name+'_'+str(suffix))
+        suffix += 1
+    return path
+
+def write_collapsed_stacks(collapsed_path, stacks):
+    ''' Writes stack weights in the collapsed stack format of flamegraph tools. '''
+    with open(collapsed_path, 'w') as f:
+        for stack, weight in stacks.items():
+            if weight > 0:
+                f.write(stack+' '+str(weight)+'\n')
+
+
+''' ########### FUNCTIONS: Run Profile ########### '''
+
+def write_run_profile():
+    '''
+    Combines the profiles of every scope of the run, including the scopes of worker processes, into
+    run.pstats and run.collapsed.
+    '''
+    if _profile_dir is None:
+        return
+    pstats_paths = [p for p in sorted(glob.glob(os.path.join(_profile_dir, '*.pstats')))
+                    if os.path.basename(p) != RUN_PROFILE_NAME+'.pstats']
+    if (len(pstats_paths) <= 0):
+        print_error('No profiled stages in ['+_profile_dir+'].')
+        return
+
+    run_stats = pstats.Stats(*pstats_paths)
+    run_path = os.path.join(_profile_dir, RUN_PROFILE_NAME)
+    run_stats.dump_stats(run_path+'.pstats')
+
+    stacks = Counter()
+    for pstats_path in pstats_paths:
+        with open(pstats_path[:-len('.pstats')]+'.collapsed') as f:
+            for line in f:
+                stack, weight = line.rstrip('\n').rsplit(' ', 1)
+                stacks[stack] += int(weight)
+    write_collapsed_stacks(run_path+'.collapsed', stacks)
+    print_info('Profiles of '+str(len(pstats_paths))+' stages written to ['+_profile_dir+'], combined in ['+run_path+'.pstats] and ['+
+               run_path+'.collapsed]')
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+''' ########### FUNCTIONS: Time Periods ########### '''
+
+def get_period_bounds(seasons, first_year, last_year, period_width=5):
+    '''
+    Maps each season to the (start, end) years of its time period, in a single vectorized pass.
+
+    Periods end on years that are a multiple of the period width (years ending in 0 or 5 for
+    5-year periods). The first period starts on the first year and the last period is cut to
+    the last year. When the first year is itself a multiple of the period width it starts no
+    period, and periods begin on the year after it.
+
+    parameter seasons: Array of season years.
+    returns (start, end) arrays. Seasons outside of any period get a start and end of 0.
+    '''
+    seasons = np.asarray(seasons, dtype=np.int64)
+    end = -(-seasons // period_width) * period_width
+    start = np.maximum(end - period_width + 1, first_year)
+    # The label of the first period keeps its full end year
+    first_period_end = -(-first_year // period_width) * period_width
+    end = np.where(end == first_period_end, end, np.minimum(end, last_year))
+    in_period = (seasons >= first_year) & (seasons <= last_year)
+    if first_year % period_width == 0:
+        in_period &= seasons != first_year
+    return (np.where(in_period, start, 0), np.where(in_period, end, 0))
+
+def get_period_labels(seasons, first_year, last_year, period_width=5):
+    ''' Maps each season to its time period label, such as "2001-2005". Seasons outside of any period get None. '''
+    start, end = get_period_bounds(seasons, first_year, last_year, period_width)
+    return [f'{s}-{e}' if s > 0 else None for s, e in zip(start.tolist(), end.tolist())]
+
+def get_all_period_labels(first_year, last_year, period_width=5):
+    ''' Labels of every time period from the first to the last year, in order. '''
+    labels = get_period_labels(np.arange(first_year, last_year + 1), first_year, last_year, period_width)
+    return [label for label in dict.fromkeys(labels) if label is not None]
+
+
+''' ########### FUNCTIONS: Time Period Averages ########### '''
+
+def calc_period_averages(table_df, season_colname, first_year, last_year, period_width=5):
+    '''
+    Calculates the time period averages of every column of a table.
+
+    The seasons are mapped to their periods in one vectorized pass, and the rows are split by period in a
+    single groupby pass. Each period is then averaged with DataFrame.mean over its rows, which sums the
+    values as the original per-period averages did. GroupBy.mean sums with compensation, and averages
+    close to .5 could round the other way.
+
+    parameter table_df: Table data with one row per season.
+    parameter season_colname: Name of the season column.
+    parameter period_width: Width of the time periods in years, e.g. 5 or 10.
+    returns DataFrame with one row per time period, indexed by the period label and with the label in
+    the season column. Averages are rounded to whole numbers and periods without data average to 0.
+    '''
+    labels = np.array(get_period_labels(table_df[season_colname], first_year, last_year, period_width), dtype=object)
+    all_labels = get_all_period_labels(first_year, last_year, period_width)
+
+    period_means = {label: period_df.mean(numeric_only=True) for label, period_df in table_df.groupby(labels, sort=False)}
+    averages_df = pd.DataFrame.from_dict(period_means, orient='index').reindex(index=all_labels, columns=table_df.columns)
+    averages_df = averages_df.drop(columns=[season_colname]).fillna(0).round(0).astype(int)
+    averages_df.insert(list(table_df.columns).index(season_colname), season_colname, all_labels)
+    averages_df.index = all_labels
+    return averages_df
+
+
+''' ########### FUNCTIONS: Moving and Long-term Averages ########### '''
+
+def parse_moving_average_windows(option_input):
+    ''' Parses a comma seperated list of moving average window widths, e.g. "3,5,10". Returns None when invalid. '''
+    windows = [x.strip() for x in option_input.split(',') if len(x.strip()) > 0]
+    if (len(windows) <= 0 or not all(x.isdigit() and int(x) > 0 for x in windows)):
+        return None
+    return list(dict.fromkeys(int(x) for x in windows))
+
+def _round_like_table(averages_df, table_df):
+    ''' Rounds averages of integer table columns to whole numbers and of decimal table columns to one decimal. '''
+    for colname in averages_df.columns:
+        if table_df[colname].dtype.kind in 'iub':
+            averages_df[colname] = averages_df[colname].round(0).astype(int)
+        else:
+            averages_df[colname] = averages_df[colname].round(1)
+    return averages_df
+
+def calc_moving_averages(table_df, season_colname, windows=(3, 5, 10)):
+    '''
+    Calculates the moving averages of every column of a table, for each window width.
+
+    The table is indexed by season over the full season range and each window is a single rolling mean
+    over all of its columns. Seasons missing from the table are left out of the means of their windows.
+
+    parameter table_df: Table data with one row per season.
+    parameter windows: Window widths in years, e.g. (3, 5, 10).
+    returns List of (section title, DataFrame) with one row per season that ends a full window, labeled
+            with the years of the window, e.g. "2018-2022".
+    '''
+    values_df = table_df.set_index(season_colname)
+    first_year = int(values_df.index.min())
+    last_year = int(values_df.index.max())
+    values_df = values_df.reindex(range(first_year, last_year + 1))
+    seasons = pd.Series(values_df.index, index=values_df.index)
+
+    sections = []
+    for window in windows:
+        averages_df = values_df.rolling(window, min_periods=1).mean()
+        averages_df = averages_df[(seasons >= first_year + window - 1) & seasons.isin(table_df[season_colname])]
+        averages_df = _round_like_table(averages_df, table_df)
+        labels = [str(s - window + 1)+'-'+str(s) for s in averages_df.index]
+        averages_df.insert(list(table_df.columns).index(season_colname), season_colname, labels)
+        sections.append((str(window)+'-Year Moving Averages', averages_df.reset_index(drop=True)))
+    return sections
+
+def calc_long_term_average(table_df, season_colname):
+    '''
+    Calculates the long-term average of every column of a table, over all of its seasons.
+
+    returns (section title, DataFrame) with a single row labeled with the season range, e.g. "1999-2022".
+    '''
+    averages_df = table_df.drop(columns=[season_colname]).mean(numeric_only=True).to_frame().T
+    averages_df = _round_like_table(averages_df, table_df)
+    label = str(int(table_df[season_colname].min()))+'-'+str(int(table_df[season_colname].max()))
+    averages_df.insert(list(table_df.columns).index(season_colname), season_colname, [label])
+    return ('Long-term Average', averages_df)
+
+def calc_summary_sections(table_df, season_colname, windows=None, long_term_average=False):
+    ''' Optional summary sections of a table: moving averages for each window width and the long-term average. '''
+    sections = []
+    if (len(table_df) <= 0):
+        return sections
+    if windows:
+        sections += calc_moving_averages(table_df, season_colname, windows)
+    if long_term_average:
+        sections.append(calc_long_term_average(table_df, season_colname))
+    return sections
@@ -0,0 +1,247 @@
+import click
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+''' ########### CONSTANTS: Wing Survey Dataset Layout ########### '''
+
+# Columns used by the harvest table generation pipeline.
+WING_DATA_COLUMNS = ['Season', 'flyway_name', 'state', 'species_aou', 'species_name', 'AOU_number', 'harvest_weight']
+
+# Narrow types for the columns documented in FileLayout.txt. Text dimensions are dictionary
+# encoded (categorical) and integer codes use the smallest type that holds them. Nullable
+# integer types are used for columns that may be blank in the survey extract.
+WING_DATA_DTYPES = {
+    'PartId': 'int64',
+    'Season': 'int16',
+    'PCSHunterId': 'int64',
+    'harvest_month': 'Int8',
+    'harvest_day': 'Int8',
+    'harvest_year': 'Int16',
+    'flyway_code': 'Int8',
+    'flyway_name': 'category',
+    'flyway_abbrev': 'category',
+    'state_code': 'Int16',
+    'state_name': 'category',
+    'state': 'category',
+    'aou_number': 'Int16',
+    'AOU_number': 'Int16',
+    'species_aou': 'category',
+    'species_name': 'category',
+    'age_code': 'Int8',
+    'age_char': 'category',
+    'sex_code': 'Int8',
+    'sex_char': 'category',
+    'cohort': 'category',
+    'harvest_weight': 'float64'
+}
+
+# Bump when the cache layout or dtypes change so that stale caches are rebuilt.
+CACHE_FORMAT_VERSION = 1
+
+
+''' ########### FUNCTIONS: Columnar Cache for Wing Survey Data ########### '''
+
+def get_cache_path(filename):
+    ''' Returns the path of the columnar cache file kept next to the CSV dataset. '''
+    return os.path.splitext(filename)[0] + '.cache.parquet'
+
+def get_source_fingerprint(filename):
+    ''' Fingerprint of the CSV dataset used to detect when the cache is stale. '''
+    stat = os.stat(filename)
+    return {'source': os.path.abspath(filename), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'version': CACHE_FORMAT_VERSION}
+
+def is_cache_valid(filename, cache_path):
+    ''' Checks that the cache exists and was built from the current version of the CSV dataset. '''
+    meta_path = cache_path + '.json'
+    if not (os.path.exists(cache_path) and os.path.exists(meta_path)):
+        return False
+    try:
+        with open(meta_path) as f:
+            cached_fingerprint = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return cached_fingerprint == get_source_fingerprint(filename)
+
+def read_csv_header(filename):
+    ''' Reads only the column names of the CSV dataset. '''
+    return list(pd.read_csv(filename, nrows=0).columns)
+
+def read_wing_data_csv(filename, columns=None):
+    ''' Reads the CSV dataset with dictionary encoded dimensions and narrow numeric types. '''
+    header = read_csv_header(filename)
+    if columns is not None:
+        columns = [c for c in columns if c in header]
+        header = columns
+    dtypes = {c: WING_DATA_DTYPES[c] for c in header if c in WING_DATA_DTYPES}
+    return pd.read_csv(filename, usecols=columns, dtype=dtypes)
+
+def build_wing_data_cache(filename, cache_path):
+    ''' Converts the CSV dataset into a typed, columnar Parquet cache. '''
+    print_info('Building columnar cache ['+cache_path+'] from dataset '+filename+'. This is done once per dataset version.')
+    df = read_wing_data_csv(filename)
+    tmp_path = cache_path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+    with open(cache_path + '.json', 'w') as f:
+        json.dump(get_source_fingerprint(filename), f)
+    print_info('Columnar cache created with '+str(len(df))+' rows.')
+    return df
+
+def load_wing_data(filename, columns=WING_DATA_COLUMNS, use_cache=True):
+    '''
+    Loads the wing survey dataset, using the columnar cache when possible.
+
+    parameter filename: Path to the CSV dataset.
+    parameter columns: Columns to load. Columns missing from the dataset are skipped. None loads all columns.
+    parameter use_cache: Build and read the Parquet cache next to the dataset.
+    returns DataFrame with categorical dimensions and narrow numeric types.
+    '''
+    if not use_cache:
+        return read_wing_data_csv(filename, columns)
+    if pyarrow is None:
+        print_error('Package pyarrow is not installed. Columnar cache is disabled, reading CSV dataset directly.')
+        return read_wing_data_csv(filename, columns)
+
+    cache_path = get_cache_path(filename)
+    if not is_cache_valid(filename, cache_path):
+        try:
+            df = build_wing_data_cache(filename, cache_path)
+        except OSError as e:
+            print_error('Unable to write columnar cache ['+cache_path+']: '+str(e))
+            return read_wing_data_csv(filename, columns)
+        if columns is not None:
+            df = df[[c for c in columns if c in df.columns]]
+        return df
+
+    print_info('Reading dataset from columnar cache ['+cache_path+'].')
+    if columns is not None:
+        cached_columns = pyarrow.parquet.read_schema(cache_path).names
+        columns = [c for c in columns if c in cached_columns]
+    return pd.read_parquet(cache_path, columns=columns)
+
+
+''' ########### FUNCTIONS: Cleaning Wing Survey Data ########### '''
+
+# Species recoded by AOU number: (AOU_number, species_aou, species_name).
+SPECIES_RECODES = [(1722, 'MCGO', 'Minima Cackling Goose')]
+
+def clean_species_name(names):
+    ''' Replaces any punctuation in species names with "_". '''
+    return names.str.replace(r'[^\w\s]', '_', regex=True)
+
+def relabel_categories(series, relabel):
+    '''
+    Relabels the categories of a categorical column without touching its values.
+
+    Categories relabeled the same are merged, so only the category codes of the rows are remapped.
+    parameter relabel: Function returning the new labels of an Index of categories.
+    '''
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype('category')
+    labels = pd.Index(relabel(series.cat.categories))
+    categories = labels.unique()
+    codes = series.cat.codes.to_numpy()
+    new_codes = categories.get_indexer(labels)[codes]
+    new_codes[codes < 0] = -1
+    return pd.Series(pd.Categorical.from_codes(new_codes, categories), index=series.index, name=series.name)
+
+def clean_species_columns(df):
+    '''
+    Applies the species cleaning rules of the harvest tables. Cleaning cleaned data again changes nothing.
+
+    The species columns are categorical, so the names are cleaned once per species on the categories instead
+    of once per row, and only the rows of recoded AOU numbers are assigned.
+    '''
+    for colname in ['species_aou', 'species_name']:
+        if not isinstance(df[colname].dtype, pd.CategoricalDtype):
+            df[colname] = df[colname].astype('category')
+
+    # Cleaning: update 'species_aou' and 'species_name' where 'aou_number' equals 1722
+    for aou_number, species_aou, species_name in SPECIES_RECODES:
+        for colname, value in [('species_aou', species_aou), ('species_name', species_name)]:
+            if value not in df[colname].cat.categories:
+                df[colname] = df[colname].cat.add_categories([value])
+        df.loc[df['AOU_number'] == aou_number, ['species_aou', 'species_name']] = species_aou, species_name
+
+    # Replace any punctuation in 'species_name' with '_'
+    df['species_name'] = relabel_categories(df['species_name'], clean_species_name)
+    return df
+
+
+''' ########### FUNCTIONS: Species Dimension Table ########### '''
+
+def build_species_dimension(df):
+    '''
+    Species dimension table of the dataset, one row per (species_aou, species_name) pair in order of first
+    appearance. The pairs are found from the category codes, so the table costs one pass over integer codes.
+    '''
+    species_dimension = df.groupby(['species_aou', 'species_name'], observed=True, dropna=False, sort=False).size()
+    return species_dimension.index.to_frame(index=False)
+
+def get_species_names(species_dimension):
+    ''' Dictionary of species AOU codes to species names. An AOU code with several names gets its last name. '''
+    return dict(zip(species_dimension['species_aou'], species_dimension['species_name']))
+
+
+''' ########### FUNCTIONS: Streaming Aggregation of Wing Survey Data ########### '''
+
+# Dimensions kept when wing records are reduced to harvest sums. AOU_number is kept so that
+# species cleaning rules keyed on it still apply to the reduced dataset.
+WING_DATA_SUM_KEYS = ['Season', 'flyway_name', 'state', 'species_aou', 'species_name', 'AOU_number']
+
+def reduce_harvest_sums(df):
+    ''' Reduces wing records (or partial sums) to harvest_weight sums per dimension combination. '''
+    keys = [k for k in WING_DATA_SUM_KEYS if k in df.columns]
+    return df.groupby(keys, observed=True, dropna=False, sort=False)['harvest_weight'].sum().reset_index()
+
+def stream_wing_data_sums(filename, chunksize=1000000, merge_every=10, season=None):
+    '''
+    Reads the CSV dataset in bounded chunks and reduces it to harvest sums without loading it whole.
+
+    parameter filename: Path to the CSV dataset.
+    parameter chunksize: Number of CSV rows held in memory at a time.
+    parameter merge_every: Number of chunk partials collected before they are merged together.
+    parameter season: Only reduce the rows of this season, e.g. when appending a new season to the aggregate store.
+    returns DataFrame with one row per (Season, flyway_name, state, species) and the summed harvest_weight.
+    '''
+    header = read_csv_header(filename)
+    columns = [c for c in WING_DATA_COLUMNS if c in header]
+    # Text dimensions are read as plain strings since categories differ from chunk to chunk.
+    dtypes = {c: WING_DATA_DTYPES[c] for c in columns if WING_DATA_DTYPES[c] != 'category'}
+
+    print_info('Streaming dataset '+filename+' in chunks of '+str(chunksize)+' rows.')
+    merged = None
+    partials = []
+    rows_read = 0
+    for chunk in pd.read_csv(filename, usecols=columns, dtype=dtypes, chunksize=chunksize):
+        rows_read += len(chunk)
+        if season is not None:
+            chunk = chunk[chunk['Season'] == season]
+        partials.append(reduce_harvest_sums(chunk))
+        if len(partials) >= merge_every:
+            merged = reduce_harvest_sums(pd.concat(([merged] if merged is not None else []) + partials, ignore_index=True))
+            partials = []
+    if partials or merged is None:
+        merged = reduce_harvest_sums(pd.concat(([merged] if merged is not None else []) + partials, ignore_index=True))
+    print_info('Streamed '+str(rows_read)+' rows into '+str(len(merged))+' harvest sums.')
+
+    for c in merged.columns:
+        if WING_DATA_DTYPES.get(c) == 'category':
+            merged[c] = merged[c].astype('category')
+    return merged
+
+
+''' ########### FUNCTIONS: Printing Output ########### '''
+
+def print_info(output_str):
+    click.echo("[INFO] " + str(output_str))
+
+def print_error(output_str):
+    click.echo("[ERROR] " + str(output_str))
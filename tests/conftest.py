@@ -0,0 +1,16 @@
+import os
+import pytest
+import sys
+
+# The scripts of Data/ import each other as top-level modules.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data'))
+
+import SyntheticData
+
+
+@pytest.fixture(scope='session')
+def wing_csv(tmp_path_factory):
+    ''' Small synthetic wing survey dataset, with Cackling Goose rows of AOU 1722 recoded by the species cleaning. '''
+    filename = str(tmp_path_factory.mktemp('wing') / 'WingData.csv')
+    SyntheticData.generate_wing_data_csv(filename, 50000, seed=1, first_season=1990, last_season=2000)
+    return filename
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+import FlywayQuery
+import HarvestTableGen
+
+
+def calc_cli_tables(filename, species_name='all', species_aou='all'):
+    ''' Table data of HarvestTableGen for the species options, by species or group name. '''
+    big_results = HarvestTableGen.load_and_calc_harvest_tables(filename, 'Atlantic Flyway', '1990:2000', species_name, species_aou,
+                                                               False, False, 1000000, False, 1, 5, None, None, None, None)
+    return {result[0]: (result[2], result[3]) for result in big_results}
+
+@pytest.mark.parametrize('species_colname, members', [
+    ('species_aou', ['CACG', 'CANG', 'SNGO']),
+    ('species_name', ["Barrow's Goldeneye", 'Common Goldeneye'])
+])
+def test_group_tables_match_cli(wing_csv, species_colname, members):
+    FlywayQuery.clear_cache()
+    option = 'Group:('+'|'.join(members)+')'
+    if species_colname == 'species_aou':
+        cli_table, cli_averages = calc_cli_tables(wing_csv, species_aou=option)['Group']
+    else:
+        cli_table, cli_averages = calc_cli_tables(wing_csv, species_name=option)['Group']
+
+    table_df, averages_df = FlywayQuery.get_harvest_table(wing_csv, 'Atlantic Flyway', members, (1990, 2000),
+                                                          species_colname=species_colname)
+    pd.testing.assert_frame_equal(table_df, cli_table)
+    pd.testing.assert_frame_equal(averages_df, cli_averages)
+    assert table_df['US'].sum() > 0
+
+def test_species_table_matches_cli(wing_csv):
+    FlywayQuery.clear_cache()
+    cli_table, cli_averages = calc_cli_tables(wing_csv, species_aou='MCGO')['Minima Cackling Goose']
+    table_df, averages_df = FlywayQuery.get_harvest_table(wing_csv, 'Atlantic Flyway', 'MCGO', (1990, 2000))
+    pd.testing.assert_frame_equal(table_df, cli_table)
+    pd.testing.assert_frame_equal(averages_df, cli_averages)
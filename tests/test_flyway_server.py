@@ -0,0 +1,26 @@
+import json
+import pytest
+import FlywayQuery
+import FlywayServer
+
+
+def query_harvest(wing_csv, query):
+    params = FlywayServer.parse_qs(query)
+    return json.loads(FlywayServer.query_harvest({'harvest': wing_csv}, params))
+
+def test_species_is_species_aou(wing_csv):
+    response = query_harvest(wing_csv, 'flyway=AF&species=MALL&from=1990&to=2000')
+    assert response['query']['species_aou'] == ['MALL']
+    assert response == query_harvest(wing_csv, 'flyway=AF&species_aou=MALL&from=1990&to=2000')
+
+def test_columns_of_the_flyway(wing_csv):
+    response = query_harvest(wing_csv, 'flyway=PF&species=MALL&from=1990&to=2000')
+    flyway_states = FlywayQuery.get_flyway_states(wing_csv, 'Pacific Flyway')
+    columns = list(response['estimates'][0])
+    assert columns == ['Season'] + flyway_states + ['Pacific Flyway', 'US']
+    assert list(response['averages'][0]) == columns
+
+@pytest.mark.parametrize('query', ['flyway=XX&species=MALL', 'flyway=AF&species=MALL&from=2000&to=1990', 'flyway=AF'])
+def test_invalid_queries(wing_csv, query):
+    with pytest.raises(ValueError):
+        query_harvest(wing_csv, query)
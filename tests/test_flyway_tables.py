@@ -0,0 +1,24 @@
+import openpyxl
+import pandas as pd
+import pytest
+import FlywayTables
+
+
+LONG_NAMES = ['Long-tailed and other sea ducks of the coast', 'Long-tailed and other sea ducks of the bays', 'Mallard']
+
+def write_workbook(path, write_only, excel_engine):
+    estimate_df = pd.DataFrame({'Season': [2000, 2001], 'US': [100, 200]})
+    averages_df = pd.DataFrame({'Season': ['2000-2001'], 'US': [150]})
+    table_list = [(estimate_df, averages_df, [], 'Estimates of '+name, name) for name in LONG_NAMES]
+    FlywayTables.write_tables_to_workbook(str(path), table_list, write_only, excel_engine)
+    return openpyxl.load_workbook(str(path)).sheetnames
+
+@pytest.mark.parametrize('write_only, excel_engine', [(False, 'openpyxl'), (True, 'openpyxl'), (False, 'xlsxwriter')])
+def test_sheet_names_of_every_engine(tmp_path, write_only, excel_engine):
+    sheet_names = write_workbook(tmp_path / 'Tables.xlsx', write_only, excel_engine)
+    assert sheet_names == ['Long-tailed and other sea ducks', 'Long-tailed and other sea duc 2', 'Mallard']
+
+def test_sheet_names_are_unique_ignoring_case():
+    used_names = set()
+    assert FlywayTables.get_sheet_name('Geese/Brant', used_names) == 'Geese Brant'
+    assert FlywayTables.get_sheet_name('geese brant', used_names) == 'geese brant 2'
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+import HunterTableGen
+import SyntheticData
+
+
+@pytest.fixture(scope='module')
+def ducks_table():
+    df = SyntheticData.generate_hunter_data(20000, seed=2)
+    table_df, averages_df = HunterTableGen.calc_tabledata_for_species_group(df, 'AF', 1999, 2020, 'ducks', 'active_hunters',
+                                                                            include_variance=True)
+    return table_df
+
+def test_moving_average_variance(ducks_table):
+    sections = HunterTableGen.calc_summary_sections(ducks_table, 'active_hunters', [3], long_term_average=True)
+    moving_df = dict(sections)['3-Year Moving Averages']
+    first_row = moving_df.iloc[0]
+    assert first_row['season'] == '1999-2001'
+
+    # The variance of the mean of 3 seasons is the sum of their variances divided by 9.
+    seasons_df = ducks_table[ducks_table['season'].between(1999, 2001)]
+    assert first_row['US Var'] == round(seasons_df['US Var'].sum() / 9)
+    expected_ci = 1.96 * np.sqrt(seasons_df['US Var'].sum() / 9) / first_row['US'] * 100
+    assert first_row['US CI'] == pytest.approx(round(expected_ci, 1))
+
+    long_term_df = dict(sections)['Long-term Average']
+    assert long_term_df['US Var'].iloc[0] == round(ducks_table['US Var'].sum() / len(ducks_table) ** 2)